@@ -5,6 +5,7 @@
 import math
 import geopandas as gpd
 from pathlib import Path
+import sys
 
 # --- Control file handling
 # Easy access to control file folder
@@ -13,38 +14,11 @@ controlFolder = Path('../0_control_files')
 # Store the name of the 'active' file in a variable
 controlFile = 'control_active.txt'
 
-# Function to extract a given setting from the control file
-def read_from_control( file, setting ):
-    
-    # Open 'control_active.txt' and ...
-    for line in open(file):
-        
-        # ... find the line with the requested setting
-        if setting in line:
-            break
-    
-    # Extract the setting's value\n",
-    substring = line.split('|',1)[1]      # Remove the setting's name (split into 2 based on '|', keep only 2nd part)
-    substring = substring.split('#',1)[0] # Remove comments, does nothing if no '#' is found
-    substring = substring.strip()         # Remove leading and trailing whitespace, tabs, newlines
-    
-    # Return this value
-    return substring
+# Shared control file handling (see cwarhm/control.py)
+sys.path.append(str(controlFolder.parent.resolve()))
+from cwarhm.control import read_from_control, load_control
+control = load_control(controlFolder/controlFile)
 
-# Function to specify a default path
-def make_default_path(suffix):
-    
-    # Get the root path
-    rootPath = Path( read_from_control(controlFolder/controlFile,'root_path') )
-    
-    # Get the domain folder
-    domainName = read_from_control(controlFolder/controlFile,'domain_name')
-    domainFolder = 'domain_' + domainName
-    
-    # Specify the forcing path
-    defaultPath = rootPath / domainFolder / suffix
-    
-    return defaultPath
 
 # --- Find spatial domain as bounding box of shapefile
 # function to round coordinates of a bounding box to ERA5s 0.25 degree resolution
@@ -67,15 +41,9 @@ def round_bounding_box(coords):
     return control_string, rounded_lat, rounded_lon
 
 # Find name and location of catchment shapefile
-shp_path = read_from_control(controlFolder/controlFile, 'catchment_shp_path')
+shp_path = control.path('catchment_shp_path')
 shp_name = read_from_control(controlFolder/controlFile, 'catchment_shp_name')
 
-# Specify default path if needed
-if shp_path == 'default':
-    shp_path = make_default_path('shapefiles/catchment')
-else:
-    shp_path = Path(shp_path)
-
 # Open the shapefile
 shp = gpd.read_file(shp_path/shp_name)
 
@@ -3,6 +3,7 @@
 #  Assumes we're after raw ERA5 data and reads the output location from control_active.txt
 
 from pathlib import Path
+import sys
 import math
 import xarray as xr
 
@@ -21,39 +22,10 @@ controlFolder = Path('../0_control_files')
 # Store the name of the 'active' file in a variable
 controlFile = 'control_active.txt'
 
-# Function to extract a given setting from the control file
-def read_from_control( file, setting ):
-    
-    # Open 'control_active.txt' and ...
-    with open(file) as contents:
-        for line in contents:
-            
-            # ... find the line with the requested setting
-            if setting in line and not line.startswith('#'):
-                break
-    
-    # Extract the setting's value
-    substring = line.split('|',1)[1]      # Remove the setting's name (split into 2 based on '|', keep only 2nd part)
-    substring = substring.split('#',1)[0] # Remove comments, does nothing if no '#' is found
-    substring = substring.strip()         # Remove leading and trailing whitespace, tabs, newlines
-       
-    # Return this value    
-    return substring
-    
-# Function to specify a default path
-def make_default_path(suffix):
-    
-    # Get the root path
-    rootPath = Path( read_from_control(controlFolder/controlFile,'root_path') )
-    
-    # Get the domain folder
-    domainName = read_from_control(controlFolder/controlFile,'domain_name')
-    domainFolder = 'domain_' + domainName
-    
-    # Specify the forcing path
-    defaultPath = rootPath / domainFolder / suffix
-    
-    return defaultPath
+# Shared control file handling (see cwarhm/control.py)
+sys.path.append(str(controlFolder.parent.resolve()))
+from cwarhm.control import read_from_control, load_control
+control = load_control(controlFolder/controlFile)
 
 
 # --- Define coordinates of interest
@@ -117,14 +89,7 @@ def extract_ERA5_subset(infile, outfile, latmin, latmax, lonmin, lonmax):
 for ix,in_file in enumerate(in_files):
    
     # Find where the data needs to go and make that folder
-    outPath = read_from_control(controlFolder/controlFile, control_names[ix])
-    
-    # Specify the default paths if required
-    if outPath == 'default':
-        pathString = ''.join(['forcing/',inout_paths[ix]])
-        outPath = make_default_path(pathString) # returns Path() object
-    else: 
-        outPath = Path(outPath) # ensure Path() object
+    outPath = control.path(control_names[ix])
 
     # Make the folder if it doesn't exist
     outPath.mkdir(parents=True, exist_ok=True)
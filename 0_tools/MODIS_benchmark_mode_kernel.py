@@ -0,0 +1,50 @@
+'''Compares the speed of the categorical mode function in cwarhm/categorical.py with scipy.stats.mode().
+
+Creates synthetic stacks of 18 bands (one per MODIS year) of IGBP land classes (1-17) with some fill values
+(255), finds the mode over the bands with both functions, checks that the results are identical and reports
+the time each function needs.
+
+Usage: python MODIS_benchmark_mode_kernel.py [optional: number of pixels per side (default: 1000)] [optional: number of repeats (default: 3)]
+'''
+
+import sys
+import time
+import numpy as np
+import scipy.stats as sc
+from pathlib import Path
+
+# Make the shared workflow code importable
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from cwarhm.categorical import mode_of_classes
+
+# --- check args
+size    = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+# --- functions
+def best_time(function, data):
+
+    '''Returns the result and the fastest time [s] out of 'repeats' runs.'''
+
+    times = []
+    for _ in range(repeats):
+        start = time.time()
+        result = function(data)
+        times.append(time.time() - start)
+    return result, min(times)
+
+def scipy_mode(data):
+    return sc.mode(data, axis=0)[0].reshape(data.shape[1:])
+
+# --- run
+rng = np.random.default_rng(42)
+cases = [('uniform classes', rng.integers(1, 18, size=(18, size, size))),
+         ('few classes per pixel', rng.integers(1, 18, size=(1, size, size)) + rng.integers(0, 3, size=(18, size, size)))]
+
+print('{:22s} {:>12s} {:>12s} {:>10s} {:>10s}'.format('', 'scipy [s]', 'cwarhm [s]', 'speed-up', 'identical'))
+for label, classes in cases:
+    classes = np.where(rng.random(classes.shape) < 0.05, 255, classes).astype(np.uint8) # add fill values
+    reference, time_scipy = best_time(scipy_mode, classes)
+    result, time_cwarhm = best_time(mode_of_classes, classes)
+    print('{:22s} {:12.3f} {:12.3f} {:10.1f} {:>10s}'.format(label, time_scipy, time_cwarhm, time_scipy / time_cwarhm,
+                                                             str(np.array_equal(reference, result))))
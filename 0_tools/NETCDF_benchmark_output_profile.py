@@ -0,0 +1,74 @@
+'''Compares file size and SUMMA-style read speed of a forcing file written with and without the output profile in cwarhm/netcdf_profile.py.
+
+Writes two copies of every (time, ...) variable in the source file: one uncompressed with default chunking,
+and one using the compression and chunking settings of the workflow's output profile. Then reads both copies
+the way SUMMA does: one time step at a time, for all HRUs (or grid cells) at once.
+
+Usage: python NETCDF_benchmark_output_profile.py <forcing_file.nc> [folder for temporary files (default: ./)]
+'''
+
+import os
+import sys
+import time
+import netCDF4 as nc4
+import numpy as np
+from pathlib import Path
+
+# Make the shared workflow code importable
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from cwarhm.netcdf_profile import variable_settings
+
+# --- check args
+if len(sys.argv) < 2:
+    print("Usage: %s <forcing_file.nc> [temporary_folder]" % sys.argv[0])
+    sys.exit(0)
+src_file = Path(sys.argv[1])
+tmp_path = Path(sys.argv[2]) if len(sys.argv) > 2 else Path('./')
+tmp_path.mkdir(parents=True, exist_ok=True)
+
+# --- functions
+def write_copy(src_file, des_file, use_profile):
+
+    '''Copies all variables with a leading time dimension into a new file; returns the time this took [s].'''
+
+    start = time.time()
+    with nc4.Dataset(src_file) as src, nc4.Dataset(des_file, 'w') as des:
+        for name, dimension in src.dimensions.items():
+            des.createDimension(name, None if dimension.isunlimited() else len(dimension))
+        for name, variable in src.variables.items():
+            if not variable.dimensions or variable.dimensions[0] != 'time' or len(variable.dimensions) < 2:
+                continue
+            settings = variable_settings(variable.shape, 4) if use_profile else {}
+            des.createVariable(name, 'f4', variable.dimensions, fill_value=False, **settings)
+            for t in range(variable.shape[0]): # one time step at a time to keep memory use low
+                des[name][t] = variable[t]
+    return time.time() - start
+
+def read_summa_style(file):
+
+    '''Reads every time step of every variable for all HRUs; returns (seconds, MB of data read).'''
+
+    start = time.time()
+    nbytes = 0
+    with nc4.Dataset(file) as src:
+        src.set_auto_maskandscale(False)
+        variables = [variable for variable in src.variables.values() if variable.dimensions and variable.dimensions[0] == 'time']
+        for t in range(len(src.dimensions['time'])):
+            for variable in variables:
+                nbytes += variable[t].nbytes
+    return time.time() - start, nbytes / 2**20
+
+# --- run
+results = []
+for label, use_profile in [('uncompressed', False), ('output profile', True)]:
+    des_file = tmp_path / ('benchmark_{}_{}'.format(label.replace(' ','_'), src_file.name))
+    write_time = write_copy(src_file, des_file, use_profile)
+    read_time, read_mb = read_summa_style(des_file)
+    size_mb = os.path.getsize(des_file) / 2**20
+    results.append((label, size_mb, write_time, read_time, read_mb / read_time if read_time > 0 else np.inf))
+    os.remove(des_file)
+
+print('{:16s} {:>10s} {:>10s} {:>10s} {:>12s}'.format('', 'size [MB]', 'write [s]', 'read [s]', 'read [MB/s]'))
+for label, size_mb, write_time, read_time, throughput in results:
+    print('{:16s} {:10.1f} {:10.2f} {:10.2f} {:12.1f}'.format(label, size_mb, write_time, read_time, throughput))
+print('Size ratio (profile/uncompressed): {:.2f}'.format(results[1][1] / results[0][1]))
@@ -0,0 +1,96 @@
+'''Compares the time needed to write the variables of a SUMMA attributes.nc file one HRU at a time with writing
+each variable in a single array assignment.
+
+Creates a synthetic catchment table (hruId, gruId, area, latitude, longitude) and writes the 13 HRU variables
+that 5_model_input/SUMMA/1f_attributes/1_initialize_attributes_nc.py initializes to two temporary netCDF files:
+once with a loop over HRUs that looks up each HRU's row in the table and writes scalar values (the original
+approach), and once with one array assignment per variable (the current approach). Checks that both files
+contain identical values and reports the time each approach needs.
+
+Usage: python SUMMA_benchmark_attributes_writes.py [optional: number of HRUs (default: 100000)] [optional: folder for temporary files (default: current folder)]
+'''
+
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+import netCDF4 as nc4
+from pathlib import Path
+
+# --- check args
+num_hru = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+tmp_path = Path(sys.argv[2]) if len(sys.argv) > 2 else Path('.')
+
+# --- synthetic catchment: 5 HRUs per GRU on average
+rng = np.random.default_rng(42)
+shp = pd.DataFrame({'HRU_ID':  np.arange(1, num_hru+1),
+                    'GRU_ID':  np.sort(rng.integers(1, num_hru//5 + 2, num_hru)),
+                    'HRU_area': rng.random(num_hru) * 1e7,
+                    'center_lat': rng.random(num_hru) * 180 - 90,
+                    'center_lon': rng.random(num_hru) * 360 - 180})
+mHeight = 3.0
+variables = {'hruId': 'i4', 'hru2gruId': 'i4', 'downHRUindex': 'i4', 'longitude': 'f8', 'latitude': 'f8',
+             'elevation': 'f8', 'HRUarea': 'f8', 'tan_slope': 'f8', 'contourLength': 'f8', 'slopeTypeIndex': 'i4',
+             'soilTypeIndex': 'i4', 'vegTypeIndex': 'i4', 'mHeight': 'f8'}
+
+# --- functions
+def create_file(file):
+    att = nc4.Dataset(file, 'w', format='NETCDF4')
+    att.createDimension('hru', num_hru)
+    for var, dtype in variables.items():
+        att.createVariable(var, dtype, 'hru', fill_value = False)
+    return att
+
+def write_per_hru(att):
+    for idx in range(0, num_hru):
+        att['hruId'][idx]          = shp.iloc[idx]['HRU_ID']
+        att['HRUarea'][idx]        = shp.iloc[idx]['HRU_area']
+        att['latitude'][idx]       = shp.iloc[idx]['center_lat']
+        att['longitude'][idx]      = shp.iloc[idx]['center_lon']
+        att['hru2gruId'][idx]      = shp.iloc[idx]['GRU_ID']
+        att['tan_slope'][idx]      = 0.1
+        att['contourLength'][idx]  = 30
+        att['slopeTypeIndex'][idx] = 1
+        att['mHeight'][idx]        = mHeight
+        att['downHRUindex'][idx]   = 0
+        att['elevation'][idx]      = -999
+        att['soilTypeIndex'][idx]  = -999
+        att['vegTypeIndex'][idx]   = -999
+
+def write_arrays(att):
+    att['hruId'][:]          = shp['HRU_ID'].values
+    att['HRUarea'][:]        = shp['HRU_area'].values
+    att['latitude'][:]       = shp['center_lat'].values
+    att['longitude'][:]      = shp['center_lon'].values
+    att['hru2gruId'][:]      = shp['GRU_ID'].values
+    att['tan_slope'][:]      = np.full(num_hru, 0.1)
+    att['contourLength'][:]  = np.full(num_hru, 30)
+    att['slopeTypeIndex'][:] = np.full(num_hru, 1)
+    att['mHeight'][:]        = np.full(num_hru, mHeight)
+    att['downHRUindex'][:]   = np.full(num_hru, 0)
+    att['elevation'][:]      = np.full(num_hru, -999)
+    att['soilTypeIndex'][:]  = np.full(num_hru, -999)
+    att['vegTypeIndex'][:]   = np.full(num_hru, -999)
+
+# --- run
+times = {}
+files = {}
+for label, function in [('per HRU', write_per_hru), ('arrays', write_arrays)]:
+    files[label] = tmp_path / 'benchmark_attributes_{}.nc'.format(label.replace(' ', '_'))
+    start = time.time()
+    with create_file(files[label]) as att:
+        function(att)
+    times[label] = time.time() - start
+
+# --- compare and clean up
+with nc4.Dataset(files['per HRU']) as a, nc4.Dataset(files['arrays']) as b:
+    identical = all(np.array_equal(a[var][:], b[var][:]) for var in variables)
+for file in files.values():
+    os.remove(file)
+
+print('{} HRUs, {} variables'.format(num_hru, len(variables)))
+print('{:10s} {:>10s}'.format('', 'time [s]'))
+for label, seconds in times.items():
+    print('{:10s} {:10.2f}'.format(label, seconds))
+print('speed-up: {:.0f}x, identical: {}'.format(times['per HRU'] / times['arrays'], identical))
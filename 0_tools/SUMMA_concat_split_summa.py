@@ -24,14 +24,17 @@ summa_runoff = sys.argv[3]  # eg 'gage_06280300_day.nc'
 outfilelist = glob((ncdir+'/'+file_pattern))
 outfilelist.sort()   # not needed, perhaps
 
-# count the number of gru and hru
-gru_num = 0
-hru_num = 0
+# count the number of gru and hru in each file; these give the position of each file's data in the output
+gru_counts = []
+hru_counts = []
 for file in outfilelist:
-    # f = nc.Dataset(os.path.join(ncdir, file))
-    f = nc.Dataset(file)
-    gru_num = gru_num+len(f.dimensions['gru'])
-    hru_num = hru_num+len(f.dimensions['hru'])
+    with nc.Dataset(file) as f:
+        gru_counts.append(len(f.dimensions['gru']))
+        hru_counts.append(len(f.dimensions['hru']))
+gru_starts = np.concatenate(([0], np.cumsum(gru_counts)))
+hru_starts = np.concatenate(([0], np.cumsum(hru_counts)))
+gru_num = int(gru_starts[-1])
+hru_num = int(hru_starts[-1])
 
 # write output    
 # with nc.Dataset(os.path.join(ncdir, outfilelist[0])) as src:
@@ -48,8 +51,7 @@ with nc.Dataset(outfilelist[0]) as src:
                 dst.createDimension(name, (len(dimension) if not dimension.isunlimited() else None))
 
         # copy variable attributes all at once via dictionary
-        gru_vars = [] # variable name, gru axis in variable dimension for concatenation. 
-        hru_vars = []
+        split_vars = [] # variable name, dimension along which the split files are concatenated
         for name, variable in src.variables.items():
             x = dst.createVariable(name, variable.datatype, variable.dimensions)               
             dst[name].setncatts(src[name].__dict__)
@@ -58,44 +60,27 @@ with nc.Dataset(outfilelist[0]) as src:
             # Assign different values depending on dimension
             dims = variable.dimensions
             if 'gru' in dims:
-                gru_vars.append([name,dims.index('gru')])                
+                split_vars.append([name,'gru'])
             elif 'hru' in dims:
-                hru_vars.append([name,dims.index('hru')]) 
+                split_vars.append([name,'hru'])
             else:
                 dst[name][:]=src[name][:]                
 
-        # read values for gru and hru dimensioned variables
-        Dict = {} 
-        gru_vars_num = len(gru_vars)
-        hru_vars_num = len(hru_vars)
+        # write the values of gru and hru dimensioned variables of each file directly into their part of the
+        # output, so that only one variable of one file is in memory at any time
         for i,file in enumerate(outfilelist):
             
             print("combining file %d %s" % (i,file))
             # f = nc.Dataset(os.path.join(ncdir, file))
-            f = nc.Dataset(file)
-            for j in range(gru_vars_num):
-                gru_var_name = gru_vars[j][0]
-                dim_index = gru_vars[j][1]
-                data=f[gru_var_name][:]
-                if i == 0:
-                    Dict[gru_var_name]=data
-                else:
-                    Dict[gru_var_name]=np.concatenate((Dict[gru_var_name],data),axis=dim_index)
-
-            for j in range(hru_vars_num):
-                hru_var_name = hru_vars[j][0]
-                dim_index = hru_vars[j][1]
-                data=f[hru_var_name][:]
-                if i == 0:
-                    Dict[hru_var_name]=data
-                else:
-                    Dict[hru_var_name]=np.concatenate((Dict[hru_var_name],data),axis=dim_index)
-                    
-        # assign values for gru and hru dimensioned variables
-        for j in range(gru_vars_num):
-            dst.variables[gru_vars[j][0]][:] = Dict[gru_vars[j][0]]
-        for j in range(hru_vars_num):
-            dst.variables[hru_vars[j][0]][:] = Dict[hru_vars[j][0]]
+            with nc.Dataset(file) as f:
+                for name, split_dim in split_vars:
+                    data = f[name][:]
+                    if split_dim == 'gru':
+                        part = slice(gru_starts[i], gru_starts[i+1])
+                    else:
+                        part = slice(hru_starts[i], hru_starts[i+1])
+                    index = tuple(part if dim == split_dim else slice(0, size) for dim, size in zip(f[name].dimensions, data.shape))
+                    dst[name][index] = data
         
         # Temporarily create gruId from hruId
         #if gru_num == hru_num:
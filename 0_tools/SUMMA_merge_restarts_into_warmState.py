@@ -1,10 +1,11 @@
+
 # Combine split domain state files (with 2 dimensions, hru and gru)
 # Modified by W. Knoben (2021) from A. Wood (2020)
 # -----------------------------------------------
 
-import sys, glob
-import pandas as pd
-import xarray as xr
+import os, sys, glob
+import numpy as np
+import netCDF4 as nc
 
 # --------- arguments -----------
 '''
@@ -22,26 +23,77 @@ srcPath = '/project/gwf/gwf_cmt/wknoben/summaWorkflow_data/domain_Nelson/simulat
 srcName = 'run3_be4_make_ics_restart_2017123123_*.nc'
 desPath = '/project/gwf/gwf_cmt/wknoben/summaWorkflow_data/domain_Nelson/settings/SUMMA/'
 desName = 'warmState.nc'
+attName = 'attributes.nc' # in desPath; the merged states must be in the same hru order as this file
 
 # --------- code -----------
 # find the files
 output_file_list = glob.glob(srcPath + '/' + srcName)
 output_file_list.sort()
+if not output_file_list:
+    sys.exit('No restart files found matching ' + srcPath + '/' + srcName)
+
+# read the headers: number of hru and gru in each file, the size of the other dimensions, and the hru/gru IDs
+# if the restart files contain them
+hru_counts = []
+gru_counts = []
+dim_sizes  = {} # largest size of each other dimension across all files
+ids = {'hruId': [], 'gruId': []}
+for file in output_file_list:
+    with nc.Dataset(file) as f:
+        hru_counts.append(len(f.dimensions['hru']))
+        gru_counts.append(len(f.dimensions['gru']))
+        for name, dimension in f.dimensions.items():
+            if name not in ['hru','gru']:
+                dim_sizes[name] = max(dim_sizes.get(name,0), len(dimension))
+        for name in ids:
+            if name in f.variables:
+                ids[name].append(f[name][:])
+hru_starts = np.concatenate(([0], np.cumsum(hru_counts)))
+gru_starts = np.concatenate(([0], np.cumsum(gru_counts)))
+
+# check that the merged states line up with the HRUs and GRUs in the attributes file
+with nc.Dataset(desPath + '/' + attName) as att:
+    for dim, name, starts in [('hru','hruId',hru_starts), ('gru','gruId',gru_starts)]:
+        if starts[-1] != len(att.dimensions[dim]):
+            sys.exit('Restart files contain {} {}s but {} contains {}'.format(starts[-1], dim, attName, len(att.dimensions[dim])))
+        if len(ids[name]) == len(output_file_list) and name in att.variables:
+            mismatch = np.flatnonzero(np.concatenate(ids[name]) != att[name][:])
+            if len(mismatch) > 0:
+                sys.exit('{} of the restart files is not in the order of {}; first mismatch at {} index {}'.format(name, attName, dim, mismatch[0]))
+        elif dim == 'hru':
+            print('Restart files do not contain {}; only the number of {}s was checked against {}'.format(name, dim, attName))
+
+# write output under a temporary name first, so that an interrupted merge never leaves an incomplete warmState
+part_file = desPath + '/' + desName + '.part'
+with nc.Dataset(output_file_list[0]) as src, nc.Dataset(part_file, 'w') as dst:
+
+    # dimensions and variable definitions
+    dst.createDimension('hru', int(hru_starts[-1]))
+    dst.createDimension('gru', int(gru_starts[-1]))
+    for name, size in dim_sizes.items():
+        dst.createDimension(name, size)
+    dst.setncatts(src.__dict__)
+    for name, variable in src.variables.items():
+        if 'hru' not in variable.dimensions and 'gru' not in variable.dimensions:
+            continue # only variables with hru or gru dimension are merged
+        dst.createVariable(name, variable.datatype, variable.dimensions, fill_value=variable.__dict__.get('_FillValue', None))
+        dst[name].setncatts({k:v for k,v in variable.__dict__.items() if k != '_FillValue'})
+
+    # write the variables of each file directly into their hru or gru part of the output, so that only one
+    # variable of one file is in memory at any time
+    for i,file in enumerate(output_file_list):
+        print("merging file %d %s" % (i,file))
+        with nc.Dataset(file) as f:
+            for name, variable in f.variables.items():
+                if 'hru' in variable.dimensions:
+                    split_dim, part = 'hru', slice(hru_starts[i], hru_starts[i+1])
+                elif 'gru' in variable.dimensions:
+                    split_dim, part = 'gru', slice(gru_starts[i], gru_starts[i+1])
+                else:
+                    continue
+                data = variable[:]
+                index = tuple(part if dim == split_dim else slice(0, size) for dim, size in zip(variable.dimensions, data.shape))
+                dst[name][index] = data
 
-out_ds   = [xr.open_dataset(f) for f in output_file_list]
-hru_vars = [] # variables that have hru dimension
-gru_vars = [] # variables that have gru dimension
-
-for name, var in out_ds[0].variables.items():
-    if 'hru' in var.dims:
-        hru_vars.append(name)
-    elif 'gru' in var.dims:
-        gru_vars.append(name)
-
-hru_ds = [ds[hru_vars] for ds in out_ds]
-gru_ds = [ds[gru_vars] for ds in out_ds]
-hru_merged = xr.concat(hru_ds, dim='hru')
-gru_merged = xr.concat(gru_ds, dim='gru')
-merged_ds  = xr.merge([hru_merged, gru_merged])
-    
-merged_ds.load().to_netcdf(desPath + '/' + desName)
\ No newline at end of file
+os.replace(part_file, desPath + '/' + desName)
+print("wrote output: %s" % (desPath + '/' + desName))
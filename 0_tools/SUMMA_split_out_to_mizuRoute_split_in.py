@@ -1,16 +1,27 @@
 # concatenate SUMMA domain-split outputs into time-split files
 # Splits on calendar years by default, months optional
+#
+# Each SUMMA file is read once (or once per process when run in parallel), in blocks of time steps that are
+# written directly into the right time and GRU/HRU positions of the output files. The output files contain
+# the time, the variable of interest and the GRU/HRU IDs (gruId or hruId) that mizuRoute needs.
 
 import os
 import sys
 import glob
-import xarray as xr
+import time
+import numpy as np
+import netCDF4 as nc
+import multiprocessing as mp
 from pathlib import Path
 
+# Make the shared workflow code importable
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from cwarhm.parallel import process_count
+
 
 # --- check args
-if len(sys.argv) != 9:
-    print(""" Usage: %s <arg1> <arg2> <...> <arg8>
+if len(sys.argv) not in (9,10):
+    print(""" Usage: %s <arg1> <arg2> <...> <arg8> [arg9]
                arg1: summa output directory,       e.g. /path/to/summa/out/
                arg2: summa output file pattern,    e.g. run1_G*_day.nc
                arg3: summa variable of interest,   e.g. averageRoutedRunoff
@@ -18,7 +29,8 @@ if len(sys.argv) != 9:
                arg5: mizuRoute input file pattern, e.g. run1_{}.nc
                arg6: first data year,              e.g. 1979
                arg7: final data year,              e.g. 2019
-               arg8: flag to split by months,           True/False""" % sys.argv[0])
+               arg8: flag to split by months,           True/False
+               arg9: optional number of processes, e.g. 4""" % sys.argv[0])
     sys.exit(0)
     
 # otherwise continue
@@ -45,11 +57,20 @@ split_m = sys.argv[8] # Split by months too: True/False
 # Print flag
 progres = False
 
+# Number of parallel processes: optional 9th argument, else the number of CPUs available to a SLURM job (1 outside of SLURM)
+ncpus = process_count(sys.argv, position=9)
+
+# Size of the blocks of data read from the SUMMA files in one go [bytes], and the maximum number of output
+# files that one process has open at the same time
+block_bytes = 2**26
+max_open_files = 100
+
 # Make sure we're dealing with the right kind of inputs 
 src_dir = Path(src_dir) 
 des_dir = Path(des_dir)
 split_s = int(split_s) 
 split_e = int(split_e)
+split_m = split_m.lower() == 'true'
 
 # Ensure the output path exists
 des_dir.mkdir(parents=True, exist_ok=True) 
@@ -58,54 +79,142 @@ des_dir.mkdir(parents=True, exist_ok=True)
 src_files = glob.glob(str( src_dir / src_pat ))
 src_files.sort()
 
-# define the extraction function
-def make_new_file(time):
+
+# --- Metadata pass
+# Finds the number of GRUs/HRUs in each SUMMA file (their offsets in the output files) and the time steps
+# that belong to each output file (a year or month). All SUMMA files are assumed to cover the same times.
+with nc.Dataset(src_files[0]) as src:
+    var_dims  = src[src_var].dimensions
+    split_dim = 'gru' if 'gru' in var_dims else 'hru'
+    id_var    = split_dim + 'Id' # gruId or hruId, if present
+    time_values = src['time'][:]
+    time_attrs  = src['time'].__dict__
+    time_dtype  = src['time'].datatype
+    var_dtype   = src[src_var].datatype
+    var_attrs   = src[src_var].__dict__
+    has_id      = id_var in src.variables
+    if has_id:
+        id_dtype = src[id_var].datatype
+        id_attrs = src[id_var].__dict__
+dates = nc.num2date(time_values, time_attrs['units'], time_attrs.get('calendar','standard'))
+
+split_counts = []
+for src_file in src_files:
+    with nc.Dataset(src_file) as src:
+        split_counts.append(len(src.dimensions[split_dim]))
+split_starts = np.concatenate(([0], np.cumsum(split_counts)))
+split_num = int(split_starts[-1])
+
+# Find the time steps in each output file; times are assumed to be sorted
+years  = np.array([date.year for date in dates])
+months = np.array([date.month for date in dates])
+periods = [] # [period, first time step, last time step + 1]
+for year in range(split_s,split_e+1):
+    for month in (range(1,13) if split_m else [None]):
+        if split_m:
+            this_time = str(year)+'-'+str(month).zfill(2)
+            steps = np.flatnonzero((years == year) & (months == month))
+        else:
+            this_time = str(year)
+            steps = np.flatnonzero(years == year)
+        if len(steps) > 0:
+            periods.append([this_time, steps[0], steps[-1]+1])
+
+
+# --- Functions
+def create_new_file(file, period_start, period_end):
+    
+    '''Creates an output file for the given time steps, with the time variable filled in and space for
+    the variable of interest (and GRU/HRU IDs) of all SUMMA files.'''
+    
+    dst = nc.Dataset(file, 'w', format='NETCDF4')
+    dst.createDimension('time', period_end - period_start)
+    dst.createDimension(split_dim, split_num)
+    
+    dst.createVariable('time', time_dtype, ('time',))
+    dst['time'].setncatts(time_attrs)
+    dst['time'][:] = time_values[period_start:period_end]
     
-    # Check if the file already exists and skip if sort
-    if os.path.isfile(des_dir / des_fil.format(time)):
-        print('file for {} already exists. Skipping.'.format(time))
+    dst.createVariable(src_var, var_dtype, var_dims, fill_value=var_attrs.get('_FillValue',None))
+    dst[src_var].setncatts({k:v for k,v in var_attrs.items() if k != '_FillValue'})
+    
+    if has_id:
+        dst.createVariable(id_var, id_dtype, (split_dim,), fill_value=id_attrs.get('_FillValue',None))
+        dst[id_var].setncatts({k:v for k,v in id_attrs.items() if k != '_FillValue'})
+    return dst
+
+def make_new_files(batch):
+    
+    '''Makes the output files of a batch of consecutive periods. Each SUMMA file is opened once per batch
+    and read in blocks of time steps, which are written directly into the right part of each output file.'''
+    
+    # Check if the files already exist and skip if so
+    todo = []
+    for period, period_start, period_end in batch:
+        if os.path.isfile(des_dir / des_fil.format(period)):
+            print('file for {} already exists. Skipping.'.format(period))
+        else:
+            todo.append([period, period_start, period_end])
+    if not todo:
         return
-    else:
-        print('Starting on file for {}.'.format(time))
     
-    # Initialize a variable
-    new = None
+    # Create the output files under a temporary name, so that existing files are always complete
+    outputs = [[create_new_file(str(des_dir / des_fil.format(period)) + '.part', period_start, period_end), period_start, period_end]
+               for period, period_start, period_end in todo]
+    batch_start = todo[0][1]
+    batch_end   = todo[-1][2]
     
     # Loop over all identified files
-    for src_file in src_files:
+    for i,src_file in enumerate(src_files):
         
         # Progress print
         if progres:
             print('    ' + src_file)
         
-        # Open the subset we need
-        ds = xr.open_dataset(src_file).sel(time=time)
-        
-        # Keep only the variable of interest
-        for var,da in ds.data_vars.items():
-            if not var == src_var:
-                ds = ds.drop(var)
-        
-        # Store/append
-        if new is None:
-            new = ds
-        else:
-            new = xr.merge([new,ds])
+        with nc.Dataset(src_file) as src:
             
-        ds.close()
+            # Part of the output files that this file's GRUs/HRUs go in
+            part = slice(split_starts[i], split_starts[i+1])
+            if has_id:
+                ids = src[id_var][:]
+                for dst, _, _ in outputs:
+                    dst[id_var][part] = ids
             
-    # Done looping, save to file
-    new.to_netcdf(des_dir / des_fil.format(time))
+            # Read blocks of time steps and copy these into each output file that covers them
+            block_length = max(1, block_bytes // (split_counts[i] * var_dtype.itemsize))
+            for block_start in range(batch_start, batch_end, block_length):
+                block_end = min(block_start + block_length, batch_end)
+                data = src[src_var][tuple(slice(block_start, block_end) if dim == 'time' else slice(None) for dim in var_dims)]
+                for dst, period_start, period_end in outputs:
+                    start = max(block_start, period_start)
+                    end   = min(block_end, period_end)
+                    if start >= end:
+                        continue
+                    block_index = tuple(slice(start - block_start, end - block_start) if dim == 'time' else slice(None) for dim in var_dims)
+                    dst_index   = tuple(slice(start - period_start, end - period_start) if dim == 'time' else part for dim in var_dims)
+                    dst[src_var][dst_index] = data[block_index]
+    
+    # Done looping, close and rename the files
+    for (dst, _, _), (period, _, _) in zip(outputs, todo):
+        dst.close()
+        os.replace(str(des_dir / des_fil.format(period)) + '.part', des_dir / des_fil.format(period))
+        print('Finished file for {}.'.format(period))
     
     return # nothing, already saved
 
 
-# run the loop
-for year in range(split_s,split_e+1):
-    if split_m:
-        for month in range(1,13):
-            this_time = str(year)+'-'+str(month).zfill(2)
-            make_new_file(this_time)
+# --- Run
+# Periods are processed in batches of consecutive periods, one batch per process (or more, if a batch would
+# have too many output files open at once)
+n_batches = min(len(periods), max(ncpus, -(-len(periods) // max_open_files)))
+batches = [periods[len(periods) * b // n_batches : len(periods) * (b+1) // n_batches] for b in range(n_batches)]
+
+if __name__ == '__main__':
+    start_all = time.time()
+    if ncpus > 1:
+        with mp.Pool(processes=ncpus) as pool:
+            pool.map(make_new_files, batches)
     else:
-        this_time = str(year)
-        make_new_file(this_time)
\ No newline at end of file
+        for batch in batches:
+            make_new_files(batch)
+    print('Processed {} periods of {} files with {} process(es) in {:.1f} s'.format(len(periods), len(src_files), ncpus, time.time() - start_all))
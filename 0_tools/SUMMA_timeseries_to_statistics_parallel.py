@@ -1,26 +1,47 @@
-'''Loads timeseries of simulated variables and computes a variety of statistics.'''
+'''Loads timeseries of simulated variables and computes a variety of statistics.
+
+Each SUMMA output file is read once, in blocks of time steps, and all requested statistics of all requested
+variables are updated from each block (see cwarhm/statistics.py). Memory use is therefore set by the block size
+and the number of GRUs/HRUs in a file, not by the length of the simulation. Files are processed in parallel,
+and the statistics of all files are then merged into a single file that covers the full spatial domain.
+Output variables are named [variable]_[statistic], e.g. scalarSWE_mean or scalarSWE_q90.'''
 
 import os
+import sys
 import glob
-import xarray as xr
+import numpy as np
+import netCDF4 as nc
 from pathlib import Path
 import multiprocessing as mp
 
+# Make the shared workflow code importable
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from cwarhm.statistics import StreamingStatistics
+from cwarhm.parallel import process_count
+
 # Settings
 src_dir = '/scratch/wknoben/summaWorkflow_data/domain_NorthAmerica/simulations/run1/SUMMA'
 src_pat = 'run1_G*_timestep.nc'
 des_dir = '/scratch/wknoben/summaWorkflow_data/domain_NorthAmerica/simulations/run1/statistics'
-des_fil = 'run1_summa_day_stats_{}_{}_{}.nc'
-settings= {'wallClockTime': 'mean'}
+des_fil = 'run1_summa_day_stats_subset_{}.nc' # statistics of a single file (subset); removed after merging
+settings= {'wallClockTime': ['mean']}  # statistics per variable: mean, min, max, sum, count, std, qNN (percentile NN, e.g. q90), monthly_mean
+settings= {var: [stat] if isinstance(stat,str) else list(stat) for var,stat in settings.items()} # also accept a single statistic per variable
 viz_fil = 'run1_summa_day_stats_{}_{}.nc'
-viz_fil = viz_fil.format(','.join(settings.keys()),','.join(settings.values()))
+viz_fil = viz_fil.format(','.join(settings.keys()),','.join(stat for stats in settings.values() for stat in stats))
+
+# Memory for the data of a single file [bytes]: the samples of time steps kept for percentiles (qNN; 4 bytes
+# per sampled time step per GRU/HRU) plus the blocks of data read in one go, which get what the samples leave
+block_bytes = 2**26
 
-# Make sure we're dealing with the right kind of inputs 
-src_dir = Path(src_dir) 
+# Maximum number of time steps sampled for percentiles (see cwarhm/statistics.py)
+sample_size = 10000
+
+# Make sure we're dealing with the right kind of inputs
+src_dir = Path(src_dir)
 des_dir = Path(des_dir)
 
 # Ensure the output path exists
-des_dir.mkdir(parents=True, exist_ok=True) 
+des_dir.mkdir(parents=True, exist_ok=True)
 
 # Get the names of all inputs
 src_files = glob.glob(str( src_dir / src_pat ))
@@ -28,56 +49,109 @@ src_files.sort()
 
 # -- functions
 def run_loop(file):
-    
+
     # extract the subset IDs
     subset = file.split('/')[-1].split('_')[1]
-    
+
     # pass if file exists already
-    if os.path.isfile(des_dir / 'run1_summa_day_stats_mean_wallClockTime_{}'.format(subset)):
+    des_file = des_dir / des_fil.format(subset)
+    if os.path.isfile(des_file):
         return
-    
+
     # open file
-    dat = xr.open_dataset(file)
-    
-    # compute the requested statistics
-    for var,stat in settings.items():
-        
-        # Select the case
-        if stat == 'mean':
-            new = dat[var].mean(dim='time')
-        elif stat == 'max':
-            new = dat[var].max(dim='time')
-        
-        new.to_netcdf(des_dir / des_fil.format(stat,var,subset))
+    with nc.Dataset(file) as dat:
+
+        # calendar month of each time step, for monthly statistics
+        time = dat['time']
+        months = np.array([date.month for date in nc.num2date(time[:], time.units, getattr(time, 'calendar', 'standard'))])
+        n_time = len(months)
+
+        # set up the requested statistics; time is assumed to be the first dimension
+        stats = {var: StreamingStatistics(stat, dat[var].shape[1:], n_time=n_time, sample_size=sample_size) for var,stat in settings.items()}
+        sample_bytes = sum(stat.sample_bytes for stat in stats.values())
+        if sample_bytes >= block_bytes:
+            raise ValueError('Percentile samples of {} need {} bytes, more than block_bytes = {}. Increase block_bytes '
+                             'or reduce sample_size.'.format(file, sample_bytes, block_bytes))
+
+        # read the data in blocks of time steps and update the statistics of all variables
+        elements = sum(int(np.prod(dat[var].shape[1:])) for var in settings)
+        block_length = max(1, (block_bytes - sample_bytes) // (8 * max(elements,1)))
+        for start in range(0, n_time, block_length):
+            end = min(start + block_length, n_time)
+            for var in settings:
+                data = np.ma.filled(dat[var][start:end].astype(np.float64), np.nan)
+                stats[var].update(data, months[start:end])
+
+        # save the statistics of this file, with the GRU/HRU IDs, under a temporary name first
+        with nc.Dataset(str(des_file) + '.part', 'w') as out:
+            for name, dimension in dat.dimensions.items():
+                if name != 'time':
+                    out.createDimension(name, len(dimension))
+            for id_var in ['gruId', 'hruId']:
+                if id_var in dat.variables:
+                    out.createVariable(id_var, dat[id_var].datatype, dat[id_var].dimensions)
+                    out[id_var].setncatts({k:v for k,v in dat[id_var].__dict__.items() if k != '_FillValue'})
+                    out[id_var][:] = dat[id_var][:]
+            if any('monthly_mean' in stat for stat in settings.values()):
+                out.createDimension('month', 12)
+            for var in settings:
+                for stat, values in stats[var].results().items():
+                    dims = dat[var].dimensions[1:]
+                    if stat == 'monthly_mean':
+                        dims = ('month',) + dims
+                    name = '{}_{}'.format(var, stat)
+                    out.createVariable(name, 'i8' if stat == 'count' else 'f8', dims, fill_value=False if stat == 'count' else np.nan)
+                    out[name].setncatts({k:v for k,v in dat[var].__dict__.items() if k in ['long_name','units']})
+                    out[name].setncattr('statistic', stat)
+                    out[name][:] = values
+    os.replace(str(des_file) + '.part', des_file)
     return
-    
+
 def merge_subsets_into_one(src,pattern,des,name):
-    
-    '''Merges all files in {src} that match {pattern} into one file stored in /{des}/{name.nc}'''
-    
+
+    '''Merges all files in {src} that match {pattern} into one file stored in /{des}/{name.nc}. Variables
+    are placed one after the other along their 'gru' or 'hru' dimension, in order of the file names.'''
+
     # Find all files
     src_files = glob.glob(str( src / pattern ))
-    
+    src_files.sort()
+
+    # Find the position of each file along the gru and hru dimensions
+    starts = {'gru': [0], 'hru': [0]}
+    for file in src_files:
+        with nc.Dataset(file) as f:
+            for dim in starts:
+                starts[dim].append(starts[dim][-1] + (len(f.dimensions[dim]) if dim in f.dimensions else 0))
+
     # Merge into one
-    out = xr.merge([xr.open_dataset(file) for file in src_files])
-    
-    # save to file
-    out.to_netcdf(des / name)
-    
+    with nc.Dataset(src_files[0]) as first, nc.Dataset(des / name, 'w') as out:
+        for dim, dimension in first.dimensions.items():
+            out.createDimension(dim, starts[dim][-1] if dim in starts else len(dimension))
+        for var, variable in first.variables.items():
+            out.createVariable(var, variable.datatype, variable.dimensions, fill_value=variable.__dict__.get('_FillValue', False))
+            out[var].setncatts({k:v for k,v in variable.__dict__.items() if k != '_FillValue'})
+        for i,file in enumerate(src_files):
+            with nc.Dataset(file) as f:
+                for var, variable in f.variables.items():
+                    index = tuple(slice(starts[dim][i], starts[dim][i+1]) if dim in starts else slice(None) for dim in variable.dimensions)
+                    out[var][index] = variable[:]
+
     return #nothing
 # -- end functions
 
 # -- start parallel processing
-ncpus = int(os.environ.get('SLURM_CPUS_PER_TASK',default=1))
+# Number of processes: optional command line argument, else the number of CPUs available to a SLURM job (1 outside of SLURM)
+# python SUMMA_timeseries_to_statistics_parallel.py [number of processes]
+ncpus = process_count(sys.argv)
 if __name__ == "__main__":
     pool = mp.Pool(processes=ncpus)
     pool.map(run_loop,src_files)
     pool.close()
-# -- end parallel processing
 
-# merge the individual files into one for further vizualization
-merge_subsets_into_one(des_dir,des_fil.replace('{}','*'),des_dir,viz_fil)
+    # merge the individual files into one for further vizualization
+    merge_subsets_into_one(des_dir,des_fil.replace('{}','*'),des_dir,viz_fil)
 
-# remove the individual files for cleanliness
-for file in glob.glob(des_fil.replace('{}','*')):
-    os.remove(file)
\ No newline at end of file
+    # remove the individual files for cleanliness
+    for file in glob.glob(str(des_dir / des_fil.replace('{}','*'))):
+        os.remove(file)
+# -- end parallel processing
@@ -20,6 +20,7 @@ sourceFile  = 'control_Bow_at_Banff.txt'
 # Modules
 import os
 from pathlib import Path
+import sys
 from shutil import copyfile
 from datetime import datetime
 
@@ -34,24 +35,9 @@ controlFile = 'control_active.txt'
 copyfile( controlFolder/sourceFile, controlFolder/controlFile );
 
 # --- Create the main domain folders
-# Function to extract a given setting from the control file
-def read_from_control( file, setting ):
-    
-    # Open 'control_active.txt' and ...
-    with open(file) as contents:
-        for line in contents:
-            
-            # ... find the line with the requested setting
-            if setting in line:
-                break
-    
-    # Extract the setting's value
-    substring = line.split('|',1)[1]      # Remove the setting's name (split into 2 based on '|', keep only 2nd part)
-    substring = substring.split('#',1)[0] # Remove comments, does nothing if no '#' is found
-    substring = substring.strip()         # Remove leading and trailing whitespace, tabs, newlines
-       
-    # Return this value    
-    return substring
+# Shared control file handling (see cwarhm/control.py)
+sys.path.append(str(controlFolder.parent.resolve()))
+from cwarhm.control import read_from_control, load_control
     
 # Find the path where the domain folders need to go
 # Immediately store as a 'Path' to avoid issues with '/' and '\' on different operating systems
@@ -67,22 +53,16 @@ Path( rootPath / domainFolder ).mkdir(parents=True, exist_ok=True)
 
 # --- Make the shapefile folders
 # Find the catchment shapefile folder in 'control_active'
-catchmentShapeFolder = read_from_control(controlFolder/controlFile,'catchment_shp_path')
-networkShapeFolder = read_from_control(controlFolder/controlFile,'river_network_shp_path')
-riverBasinFolder =  read_from_control(controlFolder/controlFile,'river_basin_shp_path')
-
-# Specify the default paths if required
-if catchmentShapeFolder == 'default':
-    catchmentShapeFolder = 'shapefiles/catchment'
-if networkShapeFolder == 'default':
-    networkShapeFolder = 'shapefiles/river_network'
-if riverBasinFolder == 'default':
-    riverBasinFolder = 'shapefiles/river_basins'
+# 'default' is resolved to the default location inside the domain folder
+control = load_control(controlFolder/controlFile)
+catchmentShapeFolder = control.path('catchment_shp_path')
+networkShapeFolder = control.path('river_network_shp_path')
+riverBasinFolder = control.path('river_basin_shp_path')
 
 # Try to make the shapefile folders; does nothing if the folder already exists
-Path( rootPath / domainFolder / catchmentShapeFolder ).mkdir(parents=True, exist_ok=True)
-Path( rootPath / domainFolder / networkShapeFolder ).mkdir(parents=True, exist_ok=True)
-Path( rootPath / domainFolder / riverBasinFolder ).mkdir(parents=True, exist_ok=True)
+catchmentShapeFolder.mkdir(parents=True, exist_ok=True)
+networkShapeFolder.mkdir(parents=True, exist_ok=True)
+riverBasinFolder.mkdir(parents=True, exist_ok=True)
 
 
 # --- Code provenance
@@ -10,6 +10,7 @@ from shutil import copyfile
 from pathlib import Path
 import netCDF4 as nc4
 import numpy as np
+import multiprocessing as mp
 import time
 import sys
 import os
@@ -21,60 +22,22 @@ controlFolder = Path('../../0_control_files')
 # Store the name of the 'active' file in a variable
 controlFile = 'control_active.txt'
 
-# Function to extract a given setting from the control file
-def read_from_control( file, setting ):
-    
-    # Open 'control_active.txt' and ...
-    with open(file) as contents:
-        for line in contents:
-            
-            # ... find the line with the requested setting
-            if setting in line and not line.startswith('#'):
-                break
-    
-    # Extract the setting's value
-    substring = line.split('|',1)[1]      # Remove the setting's name (split into 2 based on '|', keep only 2nd part)
-    substring = substring.split('#',1)[0] # Remove comments, does nothing if no '#' is found
-    substring = substring.strip()         # Remove leading and trailing whitespace, tabs, newlines
-       
-    # Return this value    
-    return substring
-    
-# Function to specify a default path
-def make_default_path(suffix):
-    
-    # Get the root path
-    rootPath = Path( read_from_control(controlFolder/controlFile,'root_path') )
-    
-    # Get the domain folder
-    domainName = read_from_control(controlFolder/controlFile,'domain_name')
-    domainFolder = 'domain_' + domainName
-    
-    # Specify the forcing path
-    defaultPath = rootPath / domainFolder / suffix
-    
-    return defaultPath
-    
-    
+# Shared control file handling (see cwarhm/control.py)
+sys.path.append(str(controlFolder.parent.resolve()))
+from cwarhm.control import read_from_control, load_control
+from cwarhm.netcdf_profile import variable_settings
+from cwarhm.parallel import process_count
+control = load_control(controlFolder/controlFile)
+
+
 # --- Find source and destination paths
 # Find the path where the raw forcing is
 # Immediately store as a 'Path' to avoid issues with '/' and '\' on different operating systems
-forcingPath = read_from_control(controlFolder/controlFile,'forcing_raw_path')
+forcingPath = control.path('forcing_raw_path')
 
 # Find the path where the merged forcing needs to go
-mergePath = read_from_control(controlFolder/controlFile,'forcing_merged_path')
+mergePath = control.path('forcing_merged_path')
 
-# Specify the default paths if required
-if forcingPath == 'default':
-    forcingPath = make_default_path('forcing/1_ERA5_raw_data')
-else: 
-    forcingPath = Path(forcingPath) # ensure Path() object 
-    
-if mergePath == 'default':
-    mergePath = make_default_path('forcing/2_merged_data')
-else: 
-    mergePath = Path(mergePath) # ensure Path() object 
-    
 # Make the merge folder if it doesn't exist
 mergePath.mkdir(parents=True, exist_ok=True)
 
@@ -88,25 +51,94 @@ years = years.split(',')
 years = [int(year) for year in years]
 
 
-# --- Merge the files
-# Loop through all years and months
-for year in range(years[0],years[1]+1):
-    for month in range (1,13):
+# --- Number of parallel processes
+# Months are independent of each other and can be merged in parallel. By default this uses the number of CPUs
+# available to a SLURM job (1 outside of SLURM). A different number can be given as a command line argument:
+# python ERA5_surface_and_pressure_level_combiner.py [number of processes]
+ncpus = process_count(sys.argv)
+
+
+# --- Number of time steps processed at once
+# Variables are read, converted and written in slabs of this many time steps. Peak memory use scales
+# with this number; a larger number means fewer (but larger) read and write operations. By default this is 
+# 24 hourly steps, one day of ERA5 data. A different number can be given as second command line argument:
+# python ERA5_surface_and_pressure_level_combiner.py [number of processes] [time steps per slab]
+if len(sys.argv) > 2:
+    time_slab = int(sys.argv[2])
+else:
+    time_slab = 24 # [time steps]
+if time_slab < 1:
+    sys.exit('The number of time steps per slab must be at least 1, found {}'.format(time_slab))
+
+
+# --- Decoding of packed ERA5 data
+# ERA5 forcing variables are stored as 16-bit integers with a 'scale_factor' and 'add_offset'. We decode these
+# ourselves into float32 arrays, instead of letting netCDF4 create float64 masked arrays that need to be converted
+# to float32 again when writing. The arrays are kept between slabs, variables and months, so that each process
+# allocates them only once.
+buffers = {}
+
+# Function that returns a float32 array of a given shape, re-using an earlier array if possible
+def get_buffer(name, shape):
+    buf = buffers.get(name)
+    if buf is None or buf.shape[1:] != shape[1:] or buf.shape[0] < shape[0]:
+        buf = np.empty(shape, dtype='f4')
+        buffers[name] = buf
+    return buf[:shape[0]] # the last slab of a month can be shorter
+
+# Function that reads a slab of a packed variable and decodes it as: value = packed * scale_factor + add_offset
+# Returns the decoded values and a boolean array marking missing values (None if the variable has no fill values)
+def read_decoded(variable, slab, buffer='data'):
+    
+    # Read the packed values
+    packed = variable[slab]
+    
+    # Decode into the buffer
+    values = get_buffer(buffer, packed.shape)
+    np.multiply(packed, np.float32(getattr(variable, 'scale_factor', 1)), out=values)
+    np.add(values, np.float32(getattr(variable, 'add_offset', 0)), out=values)
+    
+    # Find missing values
+    missing = None
+    fill_values = [variable.getncattr(attr) for attr in ['_FillValue','missing_value'] if attr in variable.ncattrs()]
+    if fill_values:
+        missing = np.isin(packed, fill_values)
     
-        # Define file names 
-        data_pres = 'ERA5_pressureLevel137_' + str(year) + str(month).zfill(2) + '.nc'
-        data_surf = 'ERA5_surface_' + str(year) + str(month).zfill(2) + '.nc'
-        data_dest = 'ERA5_merged_' + str(year) + str(month).zfill(2) + '.nc'
+    return values, missing
+
+
+# --- Merge the files
+# Function that merges the surface and pressure level files of a single month
+def merge_month(year_and_month):
+
+    # Get the month to process and start the timer
+    year, month = year_and_month
+    start = time.time()
+
+    # Define file names 
+    data_pres = 'ERA5_pressureLevel137_' + str(year) + str(month).zfill(2) + '.nc'
+    data_surf = 'ERA5_surface_' + str(year) + str(month).zfill(2) + '.nc'
+    data_dest = 'ERA5_merged_' + str(year) + str(month).zfill(2) + '.nc'
+    data_temp = data_dest + '.part' # written first and renamed when complete, so that a killed job leaves no incomplete files
+
+    # Skip months that were merged in an earlier run
+    if os.path.isfile(mergePath / data_dest):
+        return data_dest, 'skipped (already merged)', 0.0
+
+    # Open both source files once. Automatic masking and scaling are switched off: coordinates are not packed,
+    # and the packed forcing variables are decoded explicitly into float32 buffers (see 'read_decoded()')
+    with nc4.Dataset(forcingPath / data_pres) as src1, nc4.Dataset(forcingPath / data_surf) as src2:
+        src1.set_auto_maskandscale(False)
+        src2.set_auto_maskandscale(False)
 
         # Step 1: convert lat/lon in the pressure level file to range [-180,180], [-90,90]
-        # Extract the variables we need for the similarity check in a way that closes the files implicitly
-        with nc4.Dataset(forcingPath / data_pres) as src1, nc4.Dataset(forcingPath / data_surf) as src2:
-            pres_lat = src1.variables['latitude'][:]
-            pres_lon = src1.variables['longitude'][:]
-            pres_time = src1.variables['time'][:]
-            surf_lat = src2.variables['latitude'][:]
-            surf_lon = src2.variables['longitude'][:]
-            surf_time = src2.variables['time'][:]
+        # Extract the variables we need for the similarity check
+        pres_lat = src1.variables['latitude'][:]
+        pres_lon = src1.variables['longitude'][:]
+        pres_time = src1.variables['time'][:]
+        surf_lat = src2.variables['latitude'][:]
+        surf_lon = src2.variables['longitude'][:]
+        surf_time = src2.variables['time'][:]
 
         # Update the pressure level coordinates
         pres_lat[pres_lat > 90] = pres_lat[pres_lat > 90] - 180
@@ -120,7 +152,7 @@ for year in range(years[0],years[1]+1):
         if not all(flag_loc_and_time_same):
             err_txt = 'Dimension mismatch while merging ' + data_pres + ' and ' + data_surf + '. Check latitude, longitude and time dimensions in both files. Continuing with next files.'
             print(err_txt)
-            continue
+            return data_dest, 'failed (dimension mismatch)', time.time() - start
 
         # Step 3: combine everything into a single .nc file
         # Order of writing things:
@@ -138,19 +170,20 @@ for year in range(years[0],years[1]+1):
         loop_attr_copy_these = ['units','long_name','standard_name'] # we will define new values for _FillValue and missing_value when writing the .nc variables' attributes
 
         # Open the destination file and transfer information
-        with nc4.Dataset(forcingPath / data_pres) as src1, nc4.Dataset(forcingPath / data_surf) as src2, nc4.Dataset(mergePath / data_dest, "w") as dest: 
-    
+        with nc4.Dataset(mergePath / data_temp, "w") as dest: 
+            dest.set_auto_maskandscale(False) # we write plain float32 arrays; missing values are set to -999 already
+
             # === Some general attributes
             dest.setncattr('History','Created ' + time.ctime(time.time()))
             dest.setncattr('Language','Written using Python')
             dest.setncattr('Reason','(1) ERA5 surface and pressure files need to be combined into a single file (2) Wind speed U and V components need to be combined into a single vector (3) Forcing variables need to be given to SUMMA without scale and offset')
-    
+
             # === Meta attributes from both sources
             for name in src1.ncattrs():
                 dest.setncattr(name + ' (pressure level (10m) data)', src1.getncattr(name))
             for name in src2.ncattrs():
                 dest.setncattr(name + ' (surface level data)', src1.getncattr(name))
-    
+
             # === Dimensions: latitude, longitude, time
             # NOTE: we can use the lat/lon from the surface file (src2), because those are already in proper units. If there is a mismatch between surface and pressure we shouldn't have reached this point at all due to the check above
             for name, dimension in src2.dimensions.items():
@@ -158,7 +191,16 @@ for year in range(years[0],years[1]+1):
                     dest.createDimension( name, None)
                 else:
                     dest.createDimension( name, len(dimension))
-    
+
+            # === Split the time dimension into slabs that are read and written one at a time
+            # This keeps memory use bounded by the slab size rather than the number of time steps in the month
+            n_time = len(src2.dimensions['time'])
+            time_slabs = [slice(t, min(t + time_slab, n_time)) for t in range(0, n_time, time_slab)]
+
+            # === Compression and chunking of the forcing variables (see cwarhm/netcdf_profile.py)
+            # Chunks contain full lat/lon fields, so that reading a single time step touches only one chunk
+            output_profile = variable_settings((n_time, len(src2.dimensions['latitude']), len(src2.dimensions['longitude'])))
+
             # === Get the surface level generic variables (lat, lon, time)
             for name, variable in src2.variables.items():
         
@@ -169,27 +211,22 @@ for year in range(years[0],years[1]+1):
                     dest.variables[name][:] = src2.variables[name][:]
             
             # === For the forcing variables, we need to:
-            # 1. Extract them (this automatically applies scaling and offset with nc4) and apply non-negativity constraints
+            # 1. Find their attributes
             # 2. Create a .nc variable with the right SUMMA name and file type
-            # 3. Put all data into the new .nc file
-    
+            # 3. Extract and decode the data (see 'read_decoded()'), apply non-negativity constraints
+            #    and put the data into the new .nc file, one slab of time steps at a time
+
             # ===  Transfer the surface level data first, for no particular reason
             # This should contain surface pressure (sp), downward longwave (msdwlwrf), downward shortwave (msdwswrf) and precipitation (mtpr)
             for name, variable in src2.variables.items():
-    
+
                 # Check that we are only using the names we expect, and thus the names for which we have the required code ready
                 if name in variables_surf_convert:
             
                     # 0. Reset the dictionary that we keep attribute values in
                     loop_attr_source_values = {name: 'n/a' for name in attr_names_expected}
             
-                    # 1a. Get the values of this variable from the source (this automatically applies scaling and offset)
-                    loop_val = variable[:]
-
-                    # 1b. Apply non-negativity constraint. This is intended to remove very small negative data values that sometimes occur
-                    loop_val[loop_val < 0] = 0
-            
-                    # 1c. Get the attributes for this variable from source
+                    # 1. Get the attributes for this variable from source
                     for attrname in variable.ncattrs():
                         loop_attr_source_values[attrname] = variable.getncattr(attrname)
             
@@ -207,7 +244,7 @@ for year in range(years[0],years[1]+1):
             
                     # 2b. Create the .nc variable with the proper SUMMA name
                     # Inputs: variable name as needed by SUMMA; data type: 'float'; dimensions; no need for fill value, because thevariable gets populated in this same script
-                    dest.createVariable(name_summa, 'f4', ('time','latitude','longitude'), fill_value = False)
+                    dest.createVariable(name_summa, 'f4', ('time','latitude','longitude'), fill_value = False, **output_profile)
             
                     # 3a. Select the attributes we want to copy for this variable, based on the dictionary defined before the loop starts
                     loop_attr_copy_values = {use_this: loop_attr_source_values[use_this] for use_this in loop_attr_copy_these}
@@ -216,8 +253,17 @@ for year in range(years[0],years[1]+1):
                     dest[name_summa].setncattr('missing_value',-999)
                     dest[name_summa].setncatts(loop_attr_copy_values)
             
-                    # 3c. Copy the data SECOND
-                    dest[name_summa][:] = loop_val
+                    # 3c. Copy the data SECOND, one slab of time steps at a time
+                    for slab in time_slabs:
+                    
+                        # Get the decoded values of this variable from the source
+                        loop_val, loop_missing = read_decoded(variable, slab)
+                        
+                        # Apply non-negativity constraint. This is intended to remove very small negative data values that sometimes occur
+                        np.maximum(loop_val, 0, out=loop_val)
+                        if loop_missing is not None:
+                            loop_val[loop_missing] = -999
+                        dest[name_summa][slab] = loop_val
             
             # === Transfer the pressure level variables next, using the same procedure as above
             for name, variable in src1.variables.items():
@@ -226,10 +272,7 @@ for year in range(years[0],years[1]+1):
                     # 0. Reset the dictionary that we keep attribute values in
                     loop_attr_source_values = {name: 'n/a' for name in attr_names_expected}
             
-                    # 1a. Get the values of this variable from the source (this automatically applies scaling and offset)
-                    loop_val = variable[:] 
-            
-                    # 1b. Get the attributes for this variable from source
+                    # 1. Get the attributes for this variable from source
                     for attrname in variable.ncattrs():
                         loop_attr_source_values[attrname] = variable.getncattr(attrname)
             
@@ -247,7 +290,7 @@ for year in range(years[0],years[1]+1):
             
                     # 2b. Create the .nc variable with the proper SUMMA name
                     # Inputs: variable name as needed by SUMMA; data type: 'float'; dimensions; no need for fill value, because thevariable gets populated in this same script
-                    dest.createVariable(name_summa, 'f4', ('time','latitude','longitude'), fill_value = False)
+                    dest.createVariable(name_summa, 'f4', ('time','latitude','longitude'), fill_value = False, **output_profile)
             
                     # 3a. Select the attributes we want to copy for this variable, based on the dictionary defined before the loop starts
                     loop_attr_copy_values = {use_this: loop_attr_source_values[use_this] for use_this in loop_attr_copy_these}
@@ -256,38 +299,72 @@ for year in range(years[0],years[1]+1):
                     dest[name_summa].setncattr('missing_value',-999)
                     dest[name_summa].setncatts(loop_attr_copy_values)
             
-                    # 3c. Copy the data SECOND
-                    dest[name_summa][:] = loop_val
+                    # 3c. Copy the data SECOND, one slab of time steps at a time
+                    for slab in time_slabs:
+                        loop_val, loop_missing = read_decoded(variable, slab)
+                        if loop_missing is not None:
+                            loop_val[loop_missing] = -999
+                        dest[name_summa][slab] = loop_val
             
             # === Calculate combined wind speed and store
-            # 1a. Get the values of this variable from the source (this automatically applies scaling and offset)
-            pres_u = src1.variables['u'][:]
-            pres_v = src1.variables['v'][:]
-    
-            # 1b. Create the variable attribute 'units' from the source data. This lets us check if the source units match (they should match)
+            # 1. Create the variable attribute 'units' from the source data. This lets us check if the source units match (they should match)
             unit_u = src1.variables['u'].getncattr('units')
             unit_v = src1.variables['v'].getncattr('units')
             unit_w = '(({})**2 + ({})**2)**0.5'.format(unit_u,unit_v) 
-    
+
             # 2a. Set the summa_name
             name_summa = 'windspd'
-    
+
             # 2b. Create the .nc variable with the proper SUMMA name
             # Inputs: variable name as needed by SUMMA; data type: 'float'; dimensions; no need for fill value, because thevariable gets populated in this same script
-            dest.createVariable(name_summa,'f4',('time','latitude','longitude'),fill_value = False)
-    
+            dest.createVariable(name_summa,'f4',('time','latitude','longitude'),fill_value = False, **output_profile)
+
             # 3a. Set the attributes FIRST, so we don't run into any scaling/offset issues
             dest[name_summa].setncattr('missing_value',-999)
             dest[name_summa].setncattr('units',unit_w)
             dest[name_summa].setncattr('long_name','wind speed at the measurement height, computed from ERA5 U and V-components')
             dest[name_summa].setncattr('standard_name','wind_speed')
-    
-            # 3b. Copy the data SECOND
-            # Creating a new variable first and writing to .nc later seems faster than directly writing to .nc
-            pres_w = ((pres_u**2)+(pres_v**2))**0.5
-            dest[name_summa][:] = pres_w
-    
-        print('Finished merging {} and {} into {}'.format(data_surf,data_pres,data_dest))
+
+            # 3b. Compute and copy the data SECOND, one slab of time steps at a time
+            for slab in time_slabs:
+                
+                # Get the decoded values of the wind components from the source
+                pres_u, missing_u = read_decoded(src1.variables['u'], slab, buffer='u')
+                pres_v, missing_v = read_decoded(src1.variables['v'], slab, buffer='v')
+                
+                # Compute wind speed in place, in the buffer of the u-component
+                np.multiply(pres_u, pres_u, out=pres_u)
+                np.multiply(pres_v, pres_v, out=pres_v)
+                np.add(pres_u, pres_v, out=pres_u)
+                pres_w = np.sqrt(pres_u, out=pres_u)
+                for missing in [missing_u, missing_v]:
+                    if missing is not None:
+                        pres_w[missing] = -999
+                dest[name_summa][slab] = pres_w
+
+    # Step 4: move the completed file into place
+    os.replace(mergePath / data_temp, mergePath / data_dest)
+
+    return data_dest, 'merged {} and {}'.format(data_surf,data_pres), time.time() - start
+
+
+# All combinations of year and month that need to be merged
+months = [(year,month) for year in range(years[0],years[1]+1) for month in range(1,13)]
+
+# Loop through all years and months, in parallel if possible
+if __name__ == '__main__':
+    start_all = time.time()
+    if ncpus > 1:
+        pool = mp.Pool(processes=ncpus)
+        results = pool.imap_unordered(merge_month, months)
+    else:
+        results = map(merge_month, months)
+    for data_dest, status, seconds in results:
+        print('{}: {} in {:.1f} s'.format(data_dest, status, seconds))
+    if ncpus > 1:
+        pool.close()
+        pool.join()
+    print('Processed {} months with {} process(es) in {:.1f} s'.format(len(months), ncpus, time.time() - start_all))
         
 
 # --- Code provenance
@@ -13,12 +13,12 @@
 
 # modules
 import os
-import shapefile # listed for install as "PyShp" library
 import numpy as np
 import xarray as xr
 import netCDF4 as nc4
 import geopandas as gpd
 from pathlib import Path
+import sys
 from shutil import copyfile
 from datetime import datetime
 
@@ -29,76 +29,30 @@ controlFolder = Path('../../0_control_files')
 # Store the name of the 'active' file in a variable
 controlFile = 'control_active.txt'
 
-# Function to extract a given setting from the control file
-def read_from_control( file, setting ):
-    
-    # Open 'control_active.txt' and ...
-    with open(file) as contents:
-        for line in contents:
-            
-            # ... find the line with the requested setting
-            if setting in line and not line.startswith('#'):
-                break
-    
-    # Extract the setting's value
-    substring = line.split('|',1)[1]      # Remove the setting's name (split into 2 based on '|', keep only 2nd part)
-    substring = substring.split('#',1)[0] # Remove comments, does nothing if no '#' is found
-    substring = substring.strip()         # Remove leading and trailing whitespace, tabs, newlines
-       
-    # Return this value    
-    return substring
-    
-# Function to specify a default path
-def make_default_path(suffix):
-    
-    # Get the root path
-    rootPath = Path( read_from_control(controlFolder/controlFile,'root_path') )
-    
-    # Get the domain folder
-    domainName = read_from_control(controlFolder/controlFile,'domain_name')
-    domainFolder = 'domain_' + domainName
-    
-    # Specify the forcing path
-    defaultPath = rootPath / domainFolder / suffix
-    
-    return defaultPath
-    
+# Shared control file handling (see cwarhm/control.py)
+sys.path.append(str(controlFolder.parent.resolve()))
+from cwarhm.control import read_from_control, load_control
+from cwarhm.geopotential import cell_elevation
+control = load_control(controlFolder/controlFile)
+
 
 # --- Find location of merged forcing data
 # Find the path where the merged forcing is
-mergePath = read_from_control(controlFolder/controlFile,'forcing_merged_path')
+mergePath = control.path('forcing_merged_path')
+
 
-# Specify the default path if required
-if mergePath == 'default':
-    mergePath = make_default_path('forcing/2_merged_data')
-else: 
-    mergePath = Path(mergePath) # ensure Path() object     
-    
-    
 # --- Find location of geopotential data file
 # Find file path
-geoPath = read_from_control(controlFolder/controlFile,'forcing_geo_path')
+geoPath = control.path('forcing_geo_path')
 
-# Specify the default path if required
-if geoPath == 'default':
-    geoPath = make_default_path('forcing/0_geopotential')
-else: 
-    geoPath = Path(geoPath) # ensure Path() object 
-    
 # Specify the filename
 geoName = 'ERA5_geopotential.nc'
     
 
 # --- Find where the shapefile needs to go
 # Find the path where the new shapefile needs to go
-shapePath = read_from_control(controlFolder/controlFile,'forcing_shape_path')
+shapePath = control.path('forcing_shape_path')
 
-# Specify the default path if required
-if shapePath == 'default':
-    shapePath = make_default_path('shapefiles/forcing')
-else: 
-    shapePath = Path(shapePath) # ensure Path() object 
-    
 # Find name of the new shapefile
 shapeName = read_from_control(controlFolder/controlFile,'forcing_shape_name')
 
@@ -129,58 +83,41 @@ half_dlon = abs(lon[1] - lon[0])/2
 
 
 # --- Create the new shape
-with shapefile.Writer(str(shapePath / shapeName)) as w:
-    w.autoBalance = 1 # turn on function that keeps file stable if number of shapes and records don't line up
-    w.field("ID",'N') # create (N)umerical attribute fields, integer
-    w.field(field_lat,'F',decimal=4) # float with 4 decimals
-    w.field(field_lon,'F',decimal=4)
-    ID = 0 # start ID counter of empty
-    
-    for i in range(0,len(lon)):
-        for j in range(0,len(lat)):
-            ID += 1
-            center_lon = lon[i]
-            center_lat = lat[j]
-            vertices = []
-            parts = []
-            vertices.append([center_lon-half_dlon, center_lat])
-            vertices.append([center_lon-half_dlon, center_lat+half_dlat])
-            vertices.append([center_lon          , center_lat+half_dlat])
-            vertices.append([center_lon+half_dlon, center_lat+half_dlat])
-            vertices.append([center_lon+half_dlon, center_lat])
-            vertices.append([center_lon+half_dlon, center_lat-half_dlat])
-            vertices.append([center_lon          , center_lat-half_dlat])
-            vertices.append([center_lon-half_dlon, center_lat-half_dlat])
-            vertices.append([center_lon-half_dlon, center_lat])
-            parts.append(vertices)
-            w.poly(parts)
-            w.record(ID, center_lat, center_lon)
+# All cells are created at once with NumPy, instead of one cell at a time. Cells are ordered by longitude first 
+# and latitude second (i.e. all latitudes for the first longitude, then all latitudes for the second, etc.) and 
+# IDs count up from 1 in that order.
+center_lon, center_lat = np.meshgrid(np.asarray(lon, dtype='float64'), np.asarray(lat, dtype='float64'), indexing='ij')
+center_lon = center_lon.ravel()
+center_lat = center_lat.ravel()
+ID = np.arange(1, center_lon.size+1)
+
+# Each cell has nine vertices: the corners and the mid-points of each side, going clockwise from the left side
+offsets = np.array([[-1, 0], [-1, 1], [0, 1], [1, 1], [1, 0], [1,-1], [0,-1], [-1,-1], [-1, 0]]) * [half_dlon, half_dlat]
+vertices = np.stack([center_lon, center_lat], axis=-1)[:,None,:] + offsets[None,:,:] # [cell, vertex, lon/lat]
+
+# Convert the vertices into polygons. Shapely 2.0 and later can do this in one go; older versions need a loop
+try:
+    from shapely import polygons as make_polygons
+    polygons = make_polygons(vertices)
+except ImportError:
+    from shapely.geometry import Polygon
+    polygons = [Polygon(cell) for cell in vertices]
+
+# Create the shape. This is written to file after the elevation data has been added. The lat/lon fields are
+# rounded to 4 decimals, as in the fixed-precision fields that were used when the shape was made one cell at a time
+shp = gpd.GeoDataFrame({'ID': ID, field_lat: np.round(center_lat, 4), field_lon: np.round(center_lon, 4)}, geometry=polygons)
             
 
+
 # --- Add the geopotential data to the shape
 # Open the geopotential data file
 geo = xr.open_dataset( geoPath / geoName ).isel(time=0)
 
-# Open shapefile
-shp = gpd.read_file( shapePath / shapeName )
-
-# Define the constant
-g = 9.80665
-
-# Add new column to shapefile
-shp = shp.assign(elev_m = -999)  # insert a placeholder value
-
-# For each row in the shapefile, match its ERA5 lat/lon coordinates 
-# with those in the 'geo' file and extract the appropriate geopotential
-for index, row in shp.iterrows():
-       
-    # Find elevation
-    elev = geo['z'].sel(latitude = row['lat'], longitude=row['lon']).values.flatten() / g
-    
-    # Add elevation into shapefile
-    shp.at[index,'elev_m'] = elev[0]
+# Match each cell's ERA5 lat/lon coordinates with those in the 'geo' file and extract the appropriate
+# geopotential, for all cells at once (see cwarhm/geopotential.py)
+shp = shp.assign(elev_m = cell_elevation(geo['z'], shp[field_lat].values, shp[field_lon].values))
     
-# Overwrite the existing shapefile
+# Write the shapefile
 shp.to_file( shapePath / shapeName )
 
 # close the files
@@ -11,6 +11,7 @@
 from datetime import datetime
 from shutil import copyfile
 from pathlib import Path
+import sys
 import numpy as np
 import requests
 import shutil
@@ -24,51 +25,16 @@ controlFolder = Path('../../../0_control_files')
 # Store the name of the 'active' file in a variable
 controlFile = 'control_active.txt'
 
-# Function to extract a given setting from the control file
-def read_from_control( file, setting ):
-    
-    # Open 'control_active.txt' and ...
-    with open(file) as contents:
-        for line in contents:
-            
-            # ... find the line with the requested setting
-            if setting in line and not line.startswith('#'):
-                break
-    
-    # Extract the setting's value
-    substring = line.split('|',1)[1]      # Remove the setting's name (split into 2 based on '|', keep only 2nd part)
-    substring = substring.split('#',1)[0] # Remove comments, does nothing if no '#' is found
-    substring = substring.strip()         # Remove leading and trailing whitespace, tabs, newlines
-       
-    # Return this value    
-    return substring
-    
-# Function to specify a default path
-def make_default_path(suffix):
-    
-    # Get the root path
-    rootPath = Path( read_from_control(controlFolder/controlFile,'root_path') )
-    
-    # Get the domain folder
-    domainName = read_from_control(controlFolder/controlFile,'domain_name')
-    domainFolder = 'domain_' + domainName
-    
-    # Specify the forcing path
-    defaultPath = rootPath / domainFolder / suffix
-    
-    return defaultPath
-    
-    
+# Shared control file handling (see cwarhm/control.py)
+sys.path.append(str(controlFolder.parent.resolve()))
+from cwarhm.control import read_from_control, load_control
+control = load_control(controlFolder/controlFile)
+
+
 # --- Find where to save the files
 # Find the path where the raw files need to go
-merit_path = read_from_control(controlFolder/controlFile,'parameter_dem_raw_path')
+merit_path = control.path('parameter_dem_raw_path')
 
-# Specify the default paths if required 
-if merit_path == 'default':
-    merit_path = make_default_path('parameters/dem/1_MERIT_raw_data') # outputs a Path()
-else:
-    merit_path = Path(merit_path) # make sure a user-specified path is a Path()
-    
 # Make the folder if it doesn't exist
 merit_path.mkdir(parents=True, exist_ok=True)
 
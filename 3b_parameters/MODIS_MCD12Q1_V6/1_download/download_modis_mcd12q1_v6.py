@@ -9,6 +9,7 @@ import shutil
 import requests
 from netrc import netrc
 from pathlib import Path
+import sys
 from shutil import copyfile
 from datetime import datetime
 
@@ -20,61 +21,20 @@ controlFolder = Path('../../../0_control_files')
 # Store the name of the 'active' file in a variable
 controlFile = 'control_active.txt'
 
-# Function to extract a given setting from the control file
-def read_from_control( file, setting ):
-    
-    # Open 'control_active.txt' and ...
-    with open(file) as contents:
-        for line in contents:
-            
-            # ... find the line with the requested setting
-            if setting in line and not line.startswith('#'):
-                break
-    
-    # Extract the setting's value
-    substring = line.split('|',1)[1]      # Remove the setting's name (split into 2 based on '|', keep only 2nd part)
-    substring = substring.split('#',1)[0] # Remove comments, does nothing if no '#' is found
-    substring = substring.strip()         # Remove leading and trailing whitespace, tabs, newlines
-       
-    # Return this value    
-    return substring
-    
-# Function to specify a default path
-def make_default_path(suffix):
-    
-    # Get the root path
-    rootPath = Path( read_from_control(controlFolder/controlFile,'root_path') )
-    
-    # Get the domain folder
-    domainName = read_from_control(controlFolder/controlFile,'domain_name')
-    domainFolder = 'domain_' + domainName
-    
-    # Specify the forcing path
-    defaultPath = rootPath / domainFolder / suffix
-    
-    return defaultPath
-    
-    
+# Shared control file handling (see cwarhm/control.py)
+sys.path.append(str(controlFolder.parent.resolve()))
+from cwarhm.control import read_from_control, load_control
+control = load_control(controlFolder/controlFile)
+
+
 # --- Get the download settings
 # Path and name of file with download links
-links_path = read_from_control(controlFolder/controlFile,'parameter_land_list_path')
+links_path = control.path('parameter_land_list_path')
 links_file = read_from_control(controlFolder/controlFile,'parameter_land_list_name')
-
-# Specify the default paths if required 
-if links_path == 'default':
-    links_path = Path('./') # outputs a Path()
-else:
-    links_path = Path(links_path) # make sure a user-specified path is a Path()
     
 # Find where the data needs to go
-modis_path = read_from_control(controlFolder/controlFile,'parameter_land_raw_path')
+modis_path = control.path('parameter_land_raw_path')
 
-# Specify the default paths if required 
-if modis_path == 'default':
-    modis_path = make_default_path('parameters/landclass/1_MODIS_raw_data') # outputs a Path()
-else:
-    modis_path = Path(modis_path) # make sure a user-specified path is a Path()
-    
 # Make output dir
 modis_path.mkdir(parents=True, exist_ok=True)
 
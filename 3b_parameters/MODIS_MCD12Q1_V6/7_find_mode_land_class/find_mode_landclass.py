@@ -4,7 +4,8 @@
 import os
 import numpy as np
 from pathlib import Path
-import scipy.stats as sc
+import sys
+import multiprocessing as mp
 from shutil import copyfile
 from datetime import datetime
 from osgeo import gdal, ogr, osr
@@ -16,60 +17,21 @@ controlFolder = Path('../../../0_control_files')
 # Store the name of the 'active' file in a variable
 controlFile = 'control_active.txt'
 
-# Function to extract a given setting from the control file
-def read_from_control( file, setting ):
-    
-    # Open 'control_active.txt' and ...
-    with open(file) as contents:
-        for line in contents:
-            
-            # ... find the line with the requested setting
-            if setting in line and not line.startswith('#'):
-                break
-    
-    # Extract the setting's value
-    substring = line.split('|',1)[1]      # Remove the setting's name (split into 2 based on '|', keep only 2nd part)
-    substring = substring.split('#',1)[0] # Remove comments, does nothing if no '#' is found
-    substring = substring.strip()         # Remove leading and trailing whitespace, tabs, newlines
-       
-    # Return this value    
-    return substring
-    
-# Function to specify a default path
-def make_default_path(suffix):
-    
-    # Get the root path
-    rootPath = Path( read_from_control(controlFolder/controlFile,'root_path') )
-    
-    # Get the domain folder
-    domainName = read_from_control(controlFolder/controlFile,'domain_name')
-    domainFolder = 'domain_' + domainName
-    
-    # Specify the forcing path
-    defaultPath = rootPath / domainFolder / suffix
-    
-    return defaultPath
-    
+# Shared control file handling (see cwarhm/control.py)
+sys.path.append(str(controlFolder.parent.resolve()))
+from cwarhm.control import read_from_control, load_control
+from cwarhm.categorical import mode_of_classes
+from cwarhm.parallel import process_count
+control = load_control(controlFolder/controlFile)
+
 
 # --- Find source and destination locations
 # Find where the soil classes are
-landClassPath = read_from_control(controlFolder/controlFile,'parameter_land_tif_path')
-
-# Specify the default paths if required 
-if landClassPath == 'default':
-    landClassPath = make_default_path('parameters/landclass/6_tif_multiband') # outputs a Path()
-else:
-    landClassPath = Path(landClassPath) # make sure a user-specified path is a Path()
+landClassPath = control.path('parameter_land_tif_path')
 
 # Find where the mode soil class needs to go
-modeLandClassPath = read_from_control(controlFolder/controlFile,'parameter_land_mode_path')
+modeLandClassPath = control.path('parameter_land_mode_path')
 
-# Specify the default paths if required 
-if modeLandClassPath == 'default':
-    modeLandClassPath = make_default_path('parameters/landclass/7_mode_land_class') # outputs a Path()
-else:
-    modeLandClassPath = Path(modeLandClassPath) # make sure a user-specified path is a Path()
-    
 # Make the folder if it doesn't exist
 modeLandClassPath.mkdir(parents=True, exist_ok=True)
 
@@ -83,89 +45,92 @@ for file in os.listdir(landClassPath):
 dest_file = read_from_control(controlFolder/controlFile,'parameter_land_tif_name')
 
 
-# --- Function definition
-# Opens geotif file, extracts data from a single band and computes corner & center coordinates in lat/lon
-def open_geotif(file,band):
-    
-    # Do the things
-    ds = gdal.Open(file) # open the file
-    band = ds.GetRasterBand(band) # get the data band; there should be 18 for each of the 18 years
-    data = band.ReadAsArray() # convert to numpy array for further manipulation
-    width = ds.RasterXSize # pixel width
-    height = ds.RasterYSize # pixel height
-    rasterSize = [width,height]
-    geoTransform = ds.GetGeoTransform() # geolocation
-    boundingBox = np.zeros((5,2)) # coordinates of bounding box
-    boundingBox[0,0] = boundingBox[1,0] = geoTransform[0]
-    boundingBox[0,1] = boundingBox[2,1] = geoTransform[3]
-    boundingBox[2,0] = boundingBox[3,0] = geoTransform[0] + width*geoTransform[1]
-    boundingBox[1,1] = boundingBox[3,1] = geoTransform[3] + height*geoTransform[5]
-    boundingBox[4,0] = geoTransform[0] + (width/2)*geoTransform[1]
-    boundingBox[4,1] = geoTransform[3] + (height/2)*geoTransform[5]
-    
-    return data, geoTransform, rasterSize, boundingBox
-    
-# Writes data into a new geotif file
+# --- Number of parallel processes
+# Windows of the raster are independent of each other and can be processed in parallel. By default this uses 
+# the number of CPUs available to a SLURM job (1 outside of SLURM). A different number can be given as a command 
+# line argument: python find_mode_landclass.py [number of processes]
+ncpus = process_count(sys.argv)
+
+
+# --- Window size
+# The raster is processed in windows made up of whole GDAL blocks, so that reads follow the file's internal
+# layout. Windows are at least this many pixels (but at most the full raster width); memory use scales with
+# this number times the number of bands.
+window_pixels = 2**20
+
+
+# --- Function definitions
+# Splits a raster into windows (xoff, yoff, xsize, ysize) of whole blocks 
+def make_windows(ds):
+    width, height = ds.RasterXSize, ds.RasterYSize
+    block_x, block_y = ds.GetRasterBand(1).GetBlockSize()
+    rows_per_window = max(block_y, (window_pixels // min(block_x, width)) // block_y * block_y)
+    windows = []
+    for yoff in range(0, height, rows_per_window):
+        for xoff in range(0, width, block_x):
+            windows.append((xoff, yoff, min(block_x, width-xoff), min(rows_per_window, height-yoff)))
+    return windows
+
+# Finds the mode land class of a single window. The source file is opened once per process
+src_ds = None
+def mode_of_window(window):
+    global src_ds
+    if src_ds is None:
+        src_ds = gdal.Open(str(landClassPath/source_file))
+    xoff, yoff, xsize, ysize = window
+    land_use_classes = src_ds.ReadAsArray(xoff, yoff, xsize, ysize) # all bands (i.e. years) at once: [band,row,col]
+    if land_use_classes.ndim == 2:
+        land_use_classes = land_use_classes[np.newaxis,:,:] # single band file
+    mode = mode_of_classes(land_use_classes,axis=0) # ties go to the smallest class, as with scipy.stats.mode()
+    return window, mode
+
+# Creates an empty geotif file with the same size, geotransform and projection as the source file
 # Source: https://gis.stackexchange.com/questions/199477/gdal-python-cut-geotiff-image/199565
-def write_geotif_sameDomain(src_file,des_file,des_data):
+def create_geotif_sameDomain(src_file,des_file):
     
     # load the source file to get the appropriate attributes
     src_ds = gdal.Open(src_file)
     
-    # get the geotransform
-    des_transform = src_ds.GetGeoTransform()
-    
-    # get the data dimensions
-    ncols = des_data.shape[1]
-    nrows = des_data.shape[0]
-    
     # make the file
     driver = gdal.GetDriverByName("GTiff")
-    dst_ds = driver.Create(des_file,ncols,nrows,1,gdal.GDT_Float32, options = [ 'COMPRESS=DEFLATE' ])
-    dst_ds.GetRasterBand(1).WriteArray( des_data ) 
-    dst_ds.SetGeoTransform(des_transform)
+    dst_ds = driver.Create(des_file,src_ds.RasterXSize,src_ds.RasterYSize,1,gdal.GDT_Float32, options = [ 'COMPRESS=DEFLATE' ])
+    dst_ds.SetGeoTransform(src_ds.GetGeoTransform())
     wkt = src_ds.GetProjection()
     srs = osr.SpatialReference()
     srs.ImportFromWkt(wkt)
     dst_ds.SetProjection( srs.ExportToWkt() )
     
-    # close files
+    # close the source file
     src_ds = None
-    des_ds = None
-
-    return
+    
+    return dst_ds
     
 
 # -------------------------------------------------------------
 
 # ---  Find mode land class 
-# Get land use classes for each year
-land_use_classes = np.dstack((open_geotif( str(landClassPath/source_file) ,1)[0], \
-                              open_geotif( str(landClassPath/source_file) ,2)[0], \
-                              open_geotif( str(landClassPath/source_file) ,3)[0], \
-                              open_geotif( str(landClassPath/source_file) ,4)[0], \
-                              open_geotif( str(landClassPath/source_file) ,5)[0], \
-                              open_geotif( str(landClassPath/source_file) ,6)[0], \
-                              open_geotif( str(landClassPath/source_file) ,7)[0], \
-                              open_geotif( str(landClassPath/source_file) ,8)[0], \
-                              open_geotif( str(landClassPath/source_file) ,9)[0], \
-                              open_geotif( str(landClassPath/source_file) ,10)[0], \
-                              open_geotif( str(landClassPath/source_file) ,11)[0], \
-                              open_geotif( str(landClassPath/source_file) ,12)[0], \
-                              open_geotif( str(landClassPath/source_file) ,13)[0], \
-                              open_geotif( str(landClassPath/source_file) ,14)[0], \
-                              open_geotif( str(landClassPath/source_file) ,15)[0], \
-                              open_geotif( str(landClassPath/source_file) ,16)[0], \
-                              open_geotif( str(landClassPath/source_file) ,17)[0], \
-                              open_geotif( str(landClassPath/source_file) ,18)[0]))
-
-# Extract mode
-mode = sc.mode(land_use_classes,axis=2)[0].squeeze()
-
-# Store this in a new geotif file
-src_file = str(landClassPath/source_file)
-des_file = str(modeLandClassPath/dest_file)
-write_geotif_sameDomain(src_file,des_file,mode)
+# Reads all bands of one window at a time, finds the mode over the bands (years) and writes the window
+# into the new geotif file. Memory use is thus bounded by the window size instead of the raster size.
+if __name__ == '__main__':
+    src_file = str(landClassPath/source_file)
+    des_file = str(modeLandClassPath/dest_file)
+    dst_ds = create_geotif_sameDomain(src_file,des_file)
+    dst_band = dst_ds.GetRasterBand(1)
+    windows = make_windows(gdal.Open(src_file))
+    if ncpus > 1:
+        pool = mp.Pool(processes=ncpus)
+        results = pool.imap_unordered(mode_of_window, windows)
+    else:
+        results = map(mode_of_window, windows)
+    for (xoff, yoff, _, _), mode in results:
+        dst_band.WriteArray(mode, xoff, yoff)
+    if ncpus > 1:
+        pool.close()
+        pool.join()
+    
+    # close the file
+    dst_band = None
+    dst_ds = None
 
 
 # --- Code provenance
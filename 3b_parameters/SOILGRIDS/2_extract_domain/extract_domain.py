@@ -5,6 +5,7 @@
 import os
 from osgeo import gdal
 from pathlib import Path
+import sys
 from shutil import copyfile
 from datetime import datetime
 
@@ -15,63 +16,22 @@ controlFolder = Path('../../../0_control_files')
 # Store the name of the 'active' file in a variable
 controlFile = 'control_active.txt'
 
-# Function to extract a given setting from the control file
-def read_from_control( file, setting ):
-    
-    # Open 'control_active.txt' and ...
-    with open(file) as contents:
-        for line in contents:
-            
-            # ... find the line with the requested setting
-            if setting in line:
-                break
-    
-    # Extract the setting's value
-    substring = line.split('|',1)[1]      # Remove the setting's name (split into 2 based on '|', keep only 2nd part)
-    substring = substring.split('#',1)[0] # Remove comments, does nothing if no '#' is found
-    substring = substring.strip()         # Remove leading and trailing whitespace, tabs, newlines
-       
-    # Return this value    
-    return substring
-    
-# Function to specify a default path
-def make_default_path(suffix):
-    
-    # Get the root path
-    rootPath = Path( read_from_control(controlFolder/controlFile,'root_path') )
-    
-    # Get the domain folder
-    domainName = read_from_control(controlFolder/controlFile,'domain_name')
-    domainFolder = 'domain_' + domainName
-    
-    # Specify the forcing path
-    defaultPath = rootPath / domainFolder / suffix
-    
-    return defaultPath
-    
-    
+# Shared control file handling (see cwarhm/control.py)
+sys.path.append(str(controlFolder.parent.resolve()))
+from cwarhm.control import read_from_control, load_control
+control = load_control(controlFolder/controlFile)
+
+
 # --- Find where the data is
 # Find the path where the raw soil maps need to go
-soil_raw_path = read_from_control(controlFolder/controlFile,'parameter_soil_raw_path')
+soil_raw_path = control.path('parameter_soil_raw_path')
 
-# Specify the default paths if required 
-if soil_raw_path == 'default':
-    soil_raw_path = make_default_path('parameters/soilclass/1_soil_classes_global') # outputs a Path()
-else:
-    soil_raw_path = Path(soil_raw_path) # make sure a user-specified path is a Path()
-    
 
 # --- Find where the new map needs to go
 # Find the path where the subset soil map need to go
-soil_domain_path = read_from_control(controlFolder/controlFile,'parameter_soil_domain_path')
+soil_domain_path = control.path('parameter_soil_domain_path')
 soil_domain_name = read_from_control(controlFolder/controlFile,'parameter_soil_tif_name')
 
-# Specify the default paths if required 
-if soil_domain_path == 'default':
-    soil_domain_path = make_default_path('parameters/soilclass/2_soil_classes_domain') # outputs a Path()
-else:
-    soil_domain_path = Path(soil_domain_path) # make sure a user-specified path is a Path()
-    
 # Make the folder if it doesn't exist
 soil_domain_path.mkdir(parents=True, exist_ok=True)
 
@@ -0,0 +1,144 @@
+# Find HRU elevation, soil classes and land classes in one pass
+# This script is an alternative to running scripts 1, 2 and 3 in this folder. Instead of reading the catchment
+# shapefile three times and intersecting it with each raster separately, it reads the catchment once and finds
+# the fraction of each raster cell that is covered by each HRU once per raster grid. If the DEM, soil and land
+# class rasters are on the same grid, these coverage fractions are found only once. They are also saved in a
+# cache folder, so that later runs with the same catchment and raster grid(s) do not need to find them again. The mean elevation and the
+# soil and land class fractions of each HRU then follow from these coverage fractions (see cwarhm/zonal.py).
+#
+# The results are the same as those of scripts 1, 2 and 3, and are saved in the same three intersection
+# shapefiles, so that later parts of the workflow can use them without changes.
+
+# modules
+import time
+from pathlib import Path
+import sys
+from shutil import copyfile
+from datetime import datetime
+import geopandas as gpd
+
+
+# --- Control file handling
+# Easy access to control file folder
+controlFolder = Path('../../0_control_files')
+
+# Store the name of the 'active' file in a variable
+controlFile = 'control_active.txt'
+
+# Shared control file handling (see cwarhm/control.py)
+sys.path.append(str(controlFolder.parent.resolve()))
+from cwarhm.control import read_from_control, load_control
+from cwarhm.zonal import cached_coverage_weights, raster_grid, class_fraction_table
+from cwarhm.parallel import process_count
+control = load_control(controlFolder/controlFile)
+
+
+# --- Find location of shapefile and rasters
+# Catchment shapefile path & name
+catchment_path = control.path('catchment_shp_path')
+catchment_name = read_from_control(controlFolder/controlFile,'catchment_shp_name')
+
+# DEM path & name
+dem_path = control.path('parameter_dem_tif_path')
+dem_name = read_from_control(controlFolder/controlFile,'parameter_dem_tif_name')
+
+# Soil class path & name
+soil_path = control.path('parameter_soil_domain_path')
+soil_name = read_from_control(controlFolder/controlFile,'parameter_soil_tif_name')
+
+# Land class path & name
+land_path = control.path('parameter_land_mode_path')
+land_name = read_from_control(controlFolder/controlFile,'parameter_land_tif_name')
+
+
+# --- Find where the intersections need to go
+# Intersected shapefile paths and names
+intersect_dem_path = control.path('intersect_dem_path')
+intersect_dem_name  = read_from_control(controlFolder/controlFile,'intersect_dem_name')
+intersect_soil_path = control.path('intersect_soil_path')
+intersect_soil_name = read_from_control(controlFolder/controlFile,'intersect_soil_name')
+intersect_land_path = control.path('intersect_land_path')
+intersect_land_name = read_from_control(controlFolder/controlFile,'intersect_land_name')
+
+# Make the folders if they don't exist
+intersect_dem_path.mkdir(parents=True, exist_ok=True)
+intersect_soil_path.mkdir(parents=True, exist_ok=True)
+intersect_land_path.mkdir(parents=True, exist_ok=True)
+
+
+# --- Coverage weight cache
+# The coverage fractions are saved here, and reused when this script (or scripts 1, 2 and 3) is run again with the same
+# catchment and rasters on the same grid (e.g. a different soil or land class raster)
+coverage_cache_path = control.path('intersect_coverage_path')
+
+
+# --- Parallel processing
+# The coverage fractions of the HRUs are found in parallel, with the HRUs split into one group per process.
+# By default this uses the number of CPUs available to a SLURM job (1 outside of SLURM). A different number
+# of processes can be given as a command line argument:
+# python 1_2_3_find_HRU_elevation_soil_and_land_classes.py [number of processes]
+ncpus = process_count(sys.argv)
+
+
+# --- Zonal statistics
+if __name__ == '__main__':
+    start_all = time.time()
+
+    # Load the shapefile
+    gdf = gpd.read_file(catchment_path / catchment_name)
+
+    # Find the coverage fractions once per raster grid
+    rasters = {'dem': dem_path / dem_name, 'soil': soil_path / soil_name, 'land': land_path / land_name}
+    weights_per_grid = {}
+    weights = {}
+    for key, raster in rasters.items():
+        grid = raster_grid(raster)
+        if grid not in weights_per_grid:
+            start = time.time()
+            weights_per_grid[grid] = cached_coverage_weights(gdf, raster, coverage_cache_path, ncpus=ncpus)
+            print('Found coverage fractions on the grid of {} in {:.1f} s'.format(raster.name, time.time() - start))
+        else:
+            print('Using coverage fractions of the same grid for {}'.format(raster.name))
+        weights[key] = weights_per_grid[grid]
+
+    # Mean elevation
+    elev_mean = weights['dem'].mean(weights['dem'].values(rasters['dem']))
+
+    # Soil and land class fractions
+    soil_classes, soil_fractions = weights['soil'].class_fractions(weights['soil'].values(rasters['soil']))
+    land_classes, land_fractions = weights['land'].class_fractions(weights['land'].values(rasters['land']))
+
+    # Save the results in the files made by scripts 1, 2 and 3
+    gdf.assign(elev_mean = elev_mean).to_file(intersect_dem_path / intersect_dem_name)
+    gdf.join(class_fraction_table(soil_classes, soil_fractions, 'USGS', gdf.index)).to_file(intersect_soil_path / intersect_soil_name)
+    gdf.join(class_fraction_table(land_classes, land_fractions, 'IGBP', gdf.index)).to_file(intersect_land_path / intersect_land_name)
+    print('Found elevation, soil and land classes of {} HRUs on {} raster grid(s) with {} process(es) in {:.1f} s'.format(
+          len(gdf), len(weights_per_grid), ncpus, time.time() - start_all))
+
+
+# --- Code provenance
+# Generates a basic log file in the domain folder and copies the control file and itself there.
+
+# Set the log path and file name
+logPath = intersect_dem_path
+log_suffix = '_catchment_dem_soilgrids_modis_intersect_log.txt'
+
+# Create a log folder
+logFolder = '_workflow_log'
+Path( logPath / logFolder ).mkdir(parents=True, exist_ok=True)
+
+# Copy this script
+thisFile = '1_2_3_find_HRU_elevation_soil_and_land_classes.py'
+copyfile(thisFile, logPath / logFolder / thisFile);
+
+# Get current date and time
+now = datetime.now()
+
+# Create a log file
+logFile = now.strftime('%Y%m%d') + log_suffix
+with open( logPath / logFolder / logFile, 'w') as file:
+
+    lines = ['Log generated by ' + thisFile + ' on ' + now.strftime('%Y/%m/%d %H:%M:%S') + '\n',
+             'Found mean HRU elevation and the fractions of soil and land classes within each HRU in one pass.']
+    for txt in lines:
+        file.write(txt)
@@ -1,18 +1,22 @@
 # Intersect catchment with MERIT DEM
-# Finds the mean elevation of each HRU in the model setup with rasterstats.
+# Finds the mean elevation of each HRU in the model setup from exactextract coverage weights (see cwarhm/zonal.py).
 #
 # Note:
 # 1. Find the source catchment shapefile;
 # 2. Copy the source catchment shapefile to the destintion location;
 # 3. Run the zonal statistics algorithm on the copy.
+#
+# The coverage fractions of the DEM cells in each HRU are saved in the cache folder 'intersect_coverage_path'
+# (see cwarhm/zonal.py). Re-running this script with the same catchment and a DEM on
+# the same grid reuses these, so that only the DEM values need to be read.
 
 # modules
 import os
 import geopandas as gpd
 from pathlib import Path
+import sys
 from shutil import copyfile
 from datetime import datetime
-from exactextract import exact_extract
 
 # --- Control file handling
 # Easy access to control file folder
@@ -21,73 +25,27 @@ controlFolder = Path('../../0_control_files')
 # Store the name of the 'active' file in a variable
 controlFile = 'control_active.txt'
 
-# Function to extract a given setting from the control file
-def read_from_control( file, setting ):
-    
-    # Open 'control_active.txt' and ...
-    with open(file) as contents:
-        for line in contents:
-            
-            # ... find the line with the requested setting
-            if setting in line and not line.startswith('#'):
-                break
-    
-    # Extract the setting's value
-    substring = line.split('|',1)[1]      # Remove the setting's name (split into 2 based on '|', keep only 2nd part)
-    substring = substring.split('#',1)[0] # Remove comments, does nothing if no '#' is found
-    substring = substring.strip()         # Remove leading and trailing whitespace, tabs, newlines
-       
-    # Return this value    
-    return substring
-    
-# Function to specify a default path
-def make_default_path(suffix):
-    
-    # Get the root path
-    rootPath = Path( read_from_control(controlFolder/controlFile,'root_path') )
-    
-    # Get the domain folder
-    domainName = read_from_control(controlFolder/controlFile,'domain_name')
-    domainFolder = 'domain_' + domainName
-    
-    # Specify the forcing path
-    defaultPath = rootPath / domainFolder / suffix
-    
-    return defaultPath
+# Shared control file handling (see cwarhm/control.py)
+sys.path.append(str(controlFolder.parent.resolve()))
+from cwarhm.control import read_from_control, load_control
+from cwarhm.zonal import cached_coverage_weights
+control = load_control(controlFolder/controlFile)
     
     
 # --- Find location of shapefile and DEM
 # Catchment shapefile path & name
-catchment_path = read_from_control(controlFolder/controlFile,'catchment_shp_path')
+catchment_path = control.path('catchment_shp_path')
 catchment_name = read_from_control(controlFolder/controlFile,'catchment_shp_name')
-
-# Specify default path if needed
-if catchment_path == 'default':
-    catchment_path = make_default_path('shapefiles/catchment') # outputs a Path()
-else:
-    catchment_path = Path(catchment_path) # make sure a user-specified path is a Path()
     
 # DEM path & name
-dem_path = read_from_control(controlFolder/controlFile,'parameter_dem_tif_path')
+dem_path = control.path('parameter_dem_tif_path')
 dem_name = read_from_control(controlFolder/controlFile,'parameter_dem_tif_name')
-
-# Specify default path if needed
-if dem_path == 'default':
-    dem_path = make_default_path('parameters/dem/5_elevation') # outputs a Path()
-else:
-    dem_path = Path(dem_path) # make sure a user-specified path is a Path()
     
     
 # --- Find where the intersection needs to go
 # Intersected shapefile path and name
-intersect_path = read_from_control(controlFolder/controlFile,'intersect_dem_path')
+intersect_path = control.path('intersect_dem_path')
 intersect_name = read_from_control(controlFolder/controlFile,'intersect_dem_name')
-
-# Specify default path if needed
-if intersect_path == 'default':
-    intersect_path = make_default_path('shapefiles/catchment_intersection/with_dem') # outputs a Path()
-else:
-    intersect_path = Path(intersect_path) # make sure a user-specified path is a Path()
     
 # Make the folder if it doesn't exist
 intersect_path.mkdir(parents=True, exist_ok=True)
@@ -115,8 +73,12 @@ for file in os.listdir(catchment_path):
 gdf = gpd.read_file(intersect_path / intersect_name)
 raster_path = dem_path / dem_name
 
+# Location of the coverage weight cache
+coverage_cache_path = control.path('intersect_coverage_path')
+
 # Calculate zonal statistics
-elev_means = exact_extract(str(raster_path), gdf, 'mean', output='pandas')
+weights = cached_coverage_weights(gdf, raster_path, coverage_cache_path)
+elev_means = weights.mean(weights.values(raster_path))
 
 # Add the mean elevation to the GeoDataFrame
 gdf['elev_mean'] = elev_means
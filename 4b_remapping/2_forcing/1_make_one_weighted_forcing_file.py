@@ -18,6 +18,7 @@ import os
 import glob
 import easymore
 from pathlib import Path
+import sys
 from shutil import rmtree
 from shutil import copyfile
 from datetime import datetime
@@ -30,72 +31,27 @@ controlFolder = Path('../../0_control_files')
 # Store the name of the 'active' file in a variable
 controlFile = 'control_active.txt'
 
-# Function to extract a given setting from the control file
-def read_from_control( file, setting ):
-    
-    # Open 'control_active.txt' and ...
-    with open(file) as contents:
-        for line in contents:
-            
-            # ... find the line with the requested setting
-            if setting in line and not line.startswith('#'):
-                break
-    
-    # Extract the setting's value
-    substring = line.split('|',1)[1]      # Remove the setting's name (split into 2 based on '|', keep only 2nd part)
-    substring = substring.split('#',1)[0] # Remove comments, does nothing if no '#' is found
-    substring = substring.strip()         # Remove leading and trailing whitespace, tabs, newlines
-       
-    # Return this value    
-    return substring
-    
-# Function to specify a default path
-def make_default_path(suffix):
-    
-    # Get the root path
-    rootPath = Path( read_from_control(controlFolder/controlFile,'root_path') )
-    
-    # Get the domain folder
-    domainName = read_from_control(controlFolder/controlFile,'domain_name')
-    domainFolder = 'domain_' + domainName
-    
-    # Specify the forcing path
-    defaultPath = rootPath / domainFolder / suffix
-    
-    return defaultPath
-    
-    
+# Shared control file handling (see cwarhm/control.py)
+sys.path.append(str(controlFolder.parent.resolve()))
+from cwarhm.control import read_from_control, load_control
+from cwarhm.remap import remapped_file_name
+from cwarhm.netcdf_profile import copy_with_profile
+control = load_control(controlFolder/controlFile)
+
+
 # --- Find location of shapefiles
 # Catchment shapefile path & name
-catchment_path = read_from_control(controlFolder/controlFile,'intersect_dem_path')
+catchment_path = control.path('intersect_dem_path')
 catchment_name = read_from_control(controlFolder/controlFile,'intersect_dem_name')
-
-# Specify default path if needed
-if catchment_path == 'default':
-    catchment_path = make_default_path('shapefiles/catchment_intersection/with_dem') # outputs a Path()
-else:
-    catchment_path = Path(catchment_path) # make sure a user-specified path is a Path()
     
 # Forcing shapefile path & name
-forcing_shape_path = read_from_control(controlFolder/controlFile,'forcing_shape_path')
+forcing_shape_path = control.path('forcing_shape_path')
 forcing_shape_name = read_from_control(controlFolder/controlFile,'forcing_shape_name')
-
-# Specify default path if needed
-if forcing_shape_path == 'default':
-    forcing_shape_path = make_default_path('shapefiles/forcing') # outputs a Path()
-else:
-    forcing_shape_path = Path(forcing_shape_path) # make sure a user-specified path is a Path()
     
     
 # --- Find where the intersection needs to go
 # Intersected shapefile path. Name is set by EASYMORE as [prefix]_intersected_shapefile.shp
-intersect_path = read_from_control(controlFolder/controlFile,'intersect_forcing_path')
-
-# Specify default path if needed
-if intersect_path == 'default':
-    intersect_path = make_default_path('shapefiles/catchment_intersection/with_forcing') # outputs a Path()
-else:
-    intersect_path = Path(intersect_path) # make sure a user-specified path is a Path()
+intersect_path = control.path('intersect_forcing_path')
     
 # Make the folder if it doesn't exist
 intersect_path.mkdir(parents=True, exist_ok=True)
@@ -103,13 +59,7 @@ intersect_path.mkdir(parents=True, exist_ok=True)
 
 # --- Find the forcing files (merged ERA5 data)
 # Location of merged ERA5 files
-forcing_merged_path = read_from_control(controlFolder/controlFile,'forcing_merged_path')
-
-# Specify default path if needed
-if forcing_merged_path == 'default':
-    forcing_merged_path = make_default_path('forcing/2_merged_data') # outputs a Path()
-else:
-    forcing_merged_path = Path(forcing_merged_path) # make sure a user-specified path is a Path()
+forcing_merged_path = control.path('forcing_merged_path')
     
 # Find files in folder
 forcing_files = [forcing_merged_path/file for file in os.listdir(forcing_merged_path) if os.path.isfile(forcing_merged_path/file) and file.endswith('.nc')]
@@ -120,13 +70,7 @@ forcing_files.sort()
 
 # --- Find where the temporary EASYMORE files need to go
 # Location for EASYMORE temporary storage
-forcing_easymore_path = read_from_control(controlFolder/controlFile,'forcing_easymore_path')
-
-# Specify default path if needed
-if forcing_easymore_path == 'default':
-    forcing_easymore_path = make_default_path('forcing/3_temp_easymore') # outputs a Path()
-else:
-    forcing_easymore_path = Path(forcing_easymore_path) # make sure a user-specified path is a Path()
+forcing_easymore_path = control.path('forcing_easymore_path')
     
 # Make the folder if it doesn't exist
 forcing_easymore_path.mkdir(parents=True, exist_ok=True)
@@ -134,13 +78,7 @@ forcing_easymore_path.mkdir(parents=True, exist_ok=True)
 
 # --- Find where the area-weighted forcing needs to go
 # Location for EASYMORE forcing output
-forcing_basin_path = read_from_control(controlFolder/controlFile,'forcing_basin_avg_path')
-
-# Specify default path if needed
-if forcing_basin_path == 'default':
-    forcing_basin_path = make_default_path('forcing/3_basin_averaged_data') # outputs a Path()
-else:
-    forcing_basin_path = Path(forcing_basin_path) # make sure a user-specified path is a Path()
+forcing_basin_path = control.path('forcing_basin_avg_path')
     
 # Make the folder if it doesn't exist
 forcing_basin_path.mkdir(parents=True, exist_ok=True)
@@ -211,6 +149,11 @@ esmr.sort_ID = False
 # Note on deprecation warnings: this is a EASYMORE issue that cannot be resolved here. Does not affect current use.
 esmr.nc_remapper()
 
+# Rewrite EASYMORE's uncompressed output with the output profile (see cwarhm/netcdf_profile.py)
+remapped_file = forcing_basin_path / remapped_file_name(esmr.case_name, forcing_files[0])
+copy_with_profile(remapped_file, str(remapped_file) + '.part')
+os.replace(str(remapped_file) + '.part', remapped_file)
+
 
 # --- Move files to prescribed locations
 # Remapping file 
@@ -0,0 +1,185 @@
+# Create all SUMMA-ready forcing files in one pass
+# This script is an alternative to running scripts 2 and 3 in this folder. Instead of first writing area-weighted
+# forcing files to `forcing_basin_avg_path` and then reading these again to apply temperature lapse rates and add
+# `data_step`, it reads each merged ERA5 file once and does all three in one go:
+# 1. Area-weighting of the ERA5 forcing onto the catchment, using the EASYMORE remapping file made by script 1;
+# 2. Applying a temperature lapse rate to `airtemp`, based on the elevation difference between each HRU and the ERA5
+#    grid cell(s) that cover it;
+# 3. Adding the `data_step` variable that SUMMA needs to know the time resolution of the forcing inputs.
+# The final forcing files are written directly to `forcing_summa_path`, with the same names and contents as those
+# made by scripts 2 and 3. Script 1 still needs to be run first, because it creates the remapping and intersection
+# files.
+#
+# Environmental Lapse Rate
+# The temperature lapse rate is assumed to have a constant value of `0.0065` `[K m-1]` (Wallace & Hobbs, 2006, p. 421).
+#
+# Wallace, J., and P. Hobbs (2006), Atmospheric Science: An Introductory Survey, 483 pp., Academic Press, Burlington, Mass
+
+# modules
+import os
+import time
+import multiprocessing as mp
+from pathlib import Path
+import sys
+from shutil import copyfile
+from datetime import datetime
+
+
+# --- Control file handling
+# Easy access to control file folder
+controlFolder = Path('../../0_control_files')
+
+# Store the name of the 'active' file in a variable
+controlFile = 'control_active.txt'
+
+# Shared control file handling (see cwarhm/control.py)
+sys.path.append(str(controlFolder.parent.resolve()))
+from cwarhm.control import read_from_control, load_control
+from cwarhm.remap import Remapper, remapped_file_name
+from cwarhm.parallel import process_count, shard_of
+from cwarhm.lapse import hru_lapse_values
+control = load_control(controlFolder/controlFile)
+
+
+# --- Find where the EASYMORE remapping and intersection files are
+# Intersected shapefile path. Name is set by EASYMORE as [prefix]_intersected_shapefile.shp
+intersect_path = control.path('intersect_forcing_path')
+
+# File names
+domain = read_from_control(controlFolder/controlFile,'domain_name')
+remap_file = domain + '_remapping.csv'
+intersect_name = domain + '_intersected_shapefile.csv' # can also be .shp, but using the .csv is easier on memory
+
+
+# --- Find the forcing files (merged ERA5 data)
+# Location of merged ERA5 files
+forcing_merged_path = control.path('forcing_merged_path')
+
+# Find files in folder
+forcing_files = [forcing_merged_path/file for file in os.listdir(forcing_merged_path) if os.path.isfile(forcing_merged_path/file) and file.endswith('.nc')]
+
+# Sort the files
+forcing_files.sort()
+
+
+# --- Find the time step size of the forcing data
+# Value in control file
+data_step = read_from_control(controlFolder/controlFile,'forcing_time_step_size')
+
+# Convert to int
+data_step = int(data_step)
+
+
+# --- Find where the final forcing needs to go
+# Location for SUMMA-ready files
+forcing_summa_path = control.path('forcing_summa_path')
+
+# Make the folder if it doesn't exist
+forcing_summa_path.mkdir(parents=True, exist_ok=True)
+
+
+# --- Output file settings
+# These match the settings used for EASYMORE in scripts 1 and 2
+author_name = 'SUMMA public workflow scripts'
+license = 'Copernicus data use license: https://cds.climate.copernicus.eu/api/v2/terms/static/licence-to-use-copernicus-products.pdf'
+var_names = ['airpres',
+             'LWRadAtm',
+             'SWRadAtm',
+             'pptrate',
+             'airtemp',
+             'spechum',
+             'windspd'] # variable names of forcing data - hardcoded because we prescribe them during ERA5 merging
+
+
+# --- Parallel processing
+# Forcing files are independent of each other and are processed in parallel, and can be split into shards of
+# consecutive files for a SLURM job array (see cwarhm/parallel.py for the defaults). Command line arguments:
+# python 2_3_remap_lapse_and_datastep_in_one_pass.py [number of processes] [shard index (0-based)] [number of shards]
+ncpus = process_count(sys.argv)
+
+# Find the files in this shard
+shard_files, shard, shards = shard_of(forcing_files, sys.argv)
+
+
+# --- Remapping weights and lapse values
+# Both are found once and shared by all files. With the default way of starting processes on Linux ('fork')
+# the worker processes share these with the main process, instead of each making a copy.
+remapper = Remapper(intersect_path / remap_file)
+
+# Find hruId name in user's shapefile
+hru_ID_name = read_from_control(controlFolder/controlFile,'catchment_shp_hruid')
+gru_ID_name = read_from_control(controlFolder/controlFile,'catchment_shp_gruid')
+
+# Find the lapse values of each HRU, in the HRU order of the remapped files
+# Note that column names are truncated at 10 characters in the ESRI shapefile, but NOT in the .csv we use here
+lapse_values = hru_lapse_values(intersect_path/intersect_name, 'S_1_' + hru_ID_name, 'S_1_' + gru_ID_name) # EASYMORE prefix + user's ID names
+lapse_values = lapse_values.loc[remapper.hru_id].values
+
+
+# --- Processing function
+# Remaps a single file, applies lapse rates and adds data_step; returns the file name, what was done and how long this took [s]
+def make_summa_forcing_file(file):
+
+    start = time.time()
+
+    # Skip existing files, so that an interrupted job can simply be restarted. Files are written under a
+    # temporary name (.nc.part) first, so existing files are always complete.
+    target = forcing_summa_path / remapped_file_name(domain, file)
+    if target.exists():
+        return target.name, 'already exists, skipped', time.time() - start
+
+    remapper.remap_file(file, target, var_names,
+                        dim_name    = 'hru',   # name of the non-time dimension; prescribed by SUMMA
+                        id_name     = 'hruId', # name of the variable associated with the non-time dimension
+                        fill_value  = -9999,
+                        case_name   = domain,
+                        author_name = author_name,
+                        license     = license,
+                        offsets     = {'airtemp': lapse_values}, # lapse values need to be ADDED to ERA5 temperature data
+                        data_step   = data_step)
+
+    return target.name, 'remapped ' + file.name, time.time() - start
+
+# Loop over the files in this shard, in parallel if possible
+if __name__ == '__main__':
+    start_all = time.time()
+    print('Shard {} of {}: {} of {} files'.format(shard+1, shards, len(shard_files), len(forcing_files)))
+    if ncpus > 1:
+        pool = mp.Pool(processes=ncpus)
+        results = pool.imap_unordered(make_summa_forcing_file, shard_files)
+    else:
+        results = map(make_summa_forcing_file, shard_files)
+    for target_name, status, seconds in results:
+        print('{}: {} in {:.1f} s'.format(target_name, status, seconds))
+    if ncpus > 1:
+        pool.close()
+        pool.join()
+    print('Processed {} files with {} process(es) in {:.1f} s'.format(len(shard_files), ncpus, time.time() - start_all))
+
+
+# --- Code provenance
+# Generates a basic log file in the domain folder and copies the control file and itself there.
+
+# Set the log path and file name
+logPath = forcing_summa_path
+log_suffix = '_remap_lapse_and_datastep_in_one_pass.txt'
+
+# Create a log folder
+logFolder = '_workflow_log'
+Path( logPath / logFolder ).mkdir(parents=True, exist_ok=True)
+
+# Copy this script
+thisFile = '2_3_remap_lapse_and_datastep_in_one_pass.py'
+copyfile(thisFile, logPath / logFolder / thisFile);
+
+# Get current date and time
+now = datetime.now()
+
+# Create a log file
+logFile = now.strftime('%Y%m%d') + log_suffix
+with open( logPath / logFolder / logFile, 'w') as file:
+
+    lines = ['Log generated by ' + thisFile + ' on ' + now.strftime('%Y/%m/%d %H:%M:%S') + '\n',
+             'Made SUMMA-ready forcing files from merged ERA5 data: area-weighted, with temperature lapse rate applied and data_step variable added.']
+    for txt in lines:
+        file.write(txt)
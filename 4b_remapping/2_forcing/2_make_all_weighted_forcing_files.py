@@ -11,12 +11,15 @@
 # 2. [This script] Call `nc_remapper()` with intersection `.csv` file and all other forcing `.nc` files.
 # 3. [Follow-up script] Apply lapse rates to temperature variable.
 #
-# Parallelization of step 2 (2nd `nc_remapper()` call) requires an external loop that sends (batches of) the remaining ERA5 raw forcing files to individual processors. As with other steps that may be parallelized, creating code that does this is left to the user.
+# This script remaps the remaining files in parallel (see "Parallel processing" below) and can be split into independent shards, e.g. for a SLURM job array.
 
 # modules
 import os
+import time
+import multiprocessing as mp
 import easymore
 from pathlib import Path
+import sys
 from shutil import rmtree
 from shutil import copyfile
 from datetime import datetime
@@ -29,50 +32,18 @@ controlFolder = Path('../../0_control_files')
 # Store the name of the 'active' file in a variable
 controlFile = 'control_active.txt'
 
-# Function to extract a given setting from the control file
-def read_from_control( file, setting ):
-    
-    # Open 'control_active.txt' and ...
-    with open(file) as contents:
-        for line in contents:
-            
-            # ... find the line with the requested setting
-            if setting in line and not line.startswith('#'):
-                break
-    
-    # Extract the setting's value
-    substring = line.split('|',1)[1]      # Remove the setting's name (split into 2 based on '|', keep only 2nd part)
-    substring = substring.split('#',1)[0] # Remove comments, does nothing if no '#' is found
-    substring = substring.strip()         # Remove leading and trailing whitespace, tabs, newlines
-       
-    # Return this value    
-    return substring
-    
-# Function to specify a default path
-def make_default_path(suffix):
-    
-    # Get the root path
-    rootPath = Path( read_from_control(controlFolder/controlFile,'root_path') )
-    
-    # Get the domain folder
-    domainName = read_from_control(controlFolder/controlFile,'domain_name')
-    domainFolder = 'domain_' + domainName
-    
-    # Specify the forcing path
-    defaultPath = rootPath / domainFolder / suffix
-    
-    return defaultPath
-    
-    
+# Shared control file handling (see cwarhm/control.py)
+sys.path.append(str(controlFolder.parent.resolve()))
+from cwarhm.control import read_from_control, load_control
+from cwarhm.remap import Remapper, remapped_file_name
+from cwarhm.netcdf_profile import copy_with_profile
+from cwarhm.parallel import process_count, shard_of
+control = load_control(controlFolder/controlFile)
+
+
 # --- Find where the EASYMORE restart file is
 # Intersected shapefile path. Name is set by EASYMORE as [prefix]_intersected_shapefile.shp
-intersect_path = read_from_control(controlFolder/controlFile,'intersect_forcing_path')
-
-# Specify default path if needed
-if intersect_path == 'default':
-    intersect_path = make_default_path('shapefiles/catchment_intersection/with_forcing') # outputs a Path()
-else:
-    intersect_path = Path(intersect_path) # make sure a user-specified path is a Path()
+intersect_path = control.path('intersect_forcing_path')
     
 # Remapping filename
 domain = read_from_control(controlFolder/controlFile,'domain_name')
@@ -81,13 +52,7 @@ remap_file = domain + '_remapping.csv'
 
 # --- Find the forcing files (merged ERA5 data)
 # Location of merged ERA5 files
-forcing_merged_path = read_from_control(controlFolder/controlFile,'forcing_merged_path')
-
-# Specify default path if needed
-if forcing_merged_path == 'default':
-    forcing_merged_path = make_default_path('forcing/2_merged_data') # outputs a Path()
-else:
-    forcing_merged_path = Path(forcing_merged_path) # make sure a user-specified path is a Path()
+forcing_merged_path = control.path('forcing_merged_path')
     
 # Find files in folder
 forcing_files = [forcing_merged_path/file for file in os.listdir(forcing_merged_path) if os.path.isfile(forcing_merged_path/file) and file.endswith('.nc')]
@@ -98,18 +63,22 @@ forcing_files.sort()
 
 # --- Find where the area-weighted forcing needs to go
 # Location for SUMMA-ready files
-forcing_basin_path = read_from_control(controlFolder/controlFile,'forcing_basin_avg_path')
-
-# Specify default path if needed
-if forcing_basin_path == 'default':
-    forcing_basin_path = make_default_path('forcing/3_basin_averaged_data') # outputs a Path()
-else:
-    forcing_basin_path = Path(forcing_basin_path) # make sure a user-specified path is a Path()
+forcing_basin_path = control.path('forcing_basin_avg_path')
     
 # Make the folder if it doesn't exist
 forcing_basin_path.mkdir(parents=True, exist_ok=True)
 
 
+# --- Remapping engine
+# 'easymore': call EASYMORE's nc_remapper() for each file. This re-reads the remapping file for every file
+# 'native': remap with the sparse weight matrix in cwarhm/remap.py. The remapping file is read only once, 
+#           and all time steps of a variable are remapped with a few matrix multiplications
+# Both give the same output files. Set with 'forcing_remap_engine' in the control file; 'easymore' if not set.
+remap_engine = control.get('forcing_remap_engine', 'easymore')
+if remap_engine not in ['easymore', 'native']:
+    sys.exit("forcing_remap_engine must be 'easymore' or 'native', found '{}'".format(remap_engine))
+
+
 # --- EASYMORE
 # Initialize an EASYMORE object
 esmr = easymore.easymore()
@@ -159,17 +128,81 @@ esmr.sort_ID = False
 # Flag that we want to skip existing remap files
 esmr.overwrite_existing_remap = False
 
-# --- Run EASYMORE - this can be parallelized for speed ups
-# Loop over the remaining forcing files
-for file in forcing_files[1:]: # skip the first one, as we completed that in the previous script  
-    
-    # ERA5 forcing files to use
-    esmr.source_nc = str(file) # Path() to string
-    
-    # Note on centroid warnings: in this case we use a regular lat/lon grid to represent ERA5 forcing and ...
-    #     centroid estimates without reprojecting are therefore acceptable.
-    # Note on deprecation warnings: this is an EASYMORE issue that cannot be resolved here. Does not affect current use.
-    esmr.nc_remapper()
+# --- Parallel processing
+# Forcing files are independent of each other and are processed in parallel, and can be split into shards of
+# consecutive files for a SLURM job array (see cwarhm/parallel.py for the defaults). Command line arguments:
+# python 2_make_all_weighted_forcing_files.py [number of processes] [shard index (0-based)] [number of shards]
+ncpus = process_count(sys.argv)
+
+# Find the files in this shard. Skip the first file, as we completed that in the previous script
+remaining_files = forcing_files[1:]
+shard_files, shard, shards = shard_of(remaining_files, sys.argv)
+
+
+# --- Run the remapping
+# Read the remapping file once. With the default way of starting processes on Linux ('fork') the worker 
+# processes share this weight matrix with the main process, instead of each making a copy.
+if remap_engine == 'native':
+    remapper = Remapper(esmr.remap_csv)
+
+# Function that remaps a single file; returns the file name, what was done and how long this took [s]
+def remap_forcing_file(file):
+    
+    start = time.time()
+    
+    # Skip existing files, as EASYMORE does with 'overwrite_existing_remap = False'. This makes it possible
+    # to simply restart an interrupted job. Both engines write each file under a temporary name first (the
+    # native engine as .nc.part, EASYMORE in a temporary folder), so existing files are always complete.
+    target = forcing_basin_path / remapped_file_name(esmr.case_name, file)
+    if target.exists():
+        return target.name, 'already exists, skipped', time.time() - start
+    
+    if remap_engine == 'native':
+        remapper.remap_file(file, target, esmr.var_names,
+                            dim_name   = esmr.remapped_dim_id,
+                            id_name    = esmr.remapped_var_id,
+                            fill_value = float(esmr.fill_value_list[0]),
+                            case_name  = esmr.case_name,
+                            author_name= esmr.author_name,
+                            license    = esmr.license)
+    else:
+        # ERA5 forcing files to use
+        esmr.source_nc = str(file) # Path() to string
+        
+        # EASYMORE writes to the final file name directly, without compression; let it write into a temporary
+        # folder of its own, rewrite the file there with the output profile (see cwarhm/netcdf_profile.py), and
+        # move the complete file into place afterwards
+        part_dir = forcing_basin_path / ('_part_' + file.stem)
+        if part_dir.exists():
+            rmtree(part_dir) # left behind by an interrupted run
+        part_dir.mkdir()
+        esmr.output_dir = str(part_dir) + '/'
+        
+        # Note on centroid warnings: in this case we use a regular lat/lon grid to represent ERA5 forcing and ...
+        #     centroid estimates without reprojecting are therefore acceptable.
+        # Note on deprecation warnings: this is an EASYMORE issue that cannot be resolved here. Does not affect current use.
+        esmr.nc_remapper()
+        copy_with_profile(part_dir / target.name, part_dir / (target.name + '.part'))
+        os.replace(part_dir / (target.name + '.part'), target)
+        rmtree(part_dir)
+    
+    return target.name, 'remapped ' + file.name, time.time() - start
+
+# Loop over the files in this shard, in parallel if possible
+if __name__ == '__main__':
+    start_all = time.time()
+    print('Shard {} of {}: {} of {} files'.format(shard+1, shards, len(shard_files), len(remaining_files)))
+    if ncpus > 1:
+        pool = mp.Pool(processes=ncpus)
+        results = pool.imap_unordered(remap_forcing_file, shard_files)
+    else:
+        results = map(remap_forcing_file, shard_files)
+    for target_name, status, seconds in results:
+        print('{}: {} in {:.1f} s'.format(target_name, status, seconds))
+    if ncpus > 1:
+        pool.close()
+        pool.join()
+    print('Processed {} files with {} process(es) in {:.1f} s'.format(len(shard_files), ncpus, time.time() - start_all))
     
     
 # --- Code provenance
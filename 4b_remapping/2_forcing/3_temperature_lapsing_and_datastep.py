@@ -10,10 +10,13 @@
 
 # modules
 import os
+import time
+import hashlib
 import numpy as np
-import xarray as xr
-import pandas as pd
+import netCDF4 as nc4
+import multiprocessing as mp
 from pathlib import Path
+import sys
 from shutil import copyfile
 from datetime import datetime
 
@@ -25,50 +28,18 @@ controlFolder = Path('../../0_control_files')
 # Store the name of the 'active' file in a variable
 controlFile = 'control_active.txt'
 
-# Function to extract a given setting from the control file
-def read_from_control( file, setting ):
-    
-    # Open 'control_active.txt' and ...
-    with open(file) as contents:
-        for line in contents:
-            
-            # ... find the line with the requested setting
-            if setting in line and not line.startswith('#'):
-                break
-    
-    # Extract the setting's value
-    substring = line.split('|',1)[1]      # Remove the setting's name (split into 2 based on '|', keep only 2nd part)
-    substring = substring.split('#',1)[0] # Remove comments, does nothing if no '#' is found
-    substring = substring.strip()         # Remove leading and trailing whitespace, tabs, newlines
-       
-    # Return this value    
-    return substring
-    
-# Function to specify a default path
-def make_default_path(suffix):
-    
-    # Get the root path
-    rootPath = Path( read_from_control(controlFolder/controlFile,'root_path') )
-    
-    # Get the domain folder
-    domainName = read_from_control(controlFolder/controlFile,'domain_name')
-    domainFolder = 'domain_' + domainName
-    
-    # Specify the forcing path
-    defaultPath = rootPath / domainFolder / suffix
-    
-    return defaultPath
-    
+# Shared control file handling (see cwarhm/control.py)
+sys.path.append(str(controlFolder.parent.resolve()))
+from cwarhm.control import read_from_control, load_control
+from cwarhm.netcdf_profile import variable_settings
+from cwarhm.lapse import hru_lapse_values
+from cwarhm.parallel import process_count
+control = load_control(controlFolder/controlFile)
+
 
 # --- Find location of intersection file
 # Intersected shapefile path. Name is set by EASYMORE as [prefix]_intersected_shapefile.shp
-intersect_path = read_from_control(controlFolder/controlFile,'intersect_forcing_path')
-
-# Specify default path if needed
-if intersect_path == 'default':
-    intersect_path = make_default_path('shapefiles/catchment_intersection/with_forcing') # outputs a Path()
-else:
-    intersect_path = Path(intersect_path) # make sure a user-specified path is a Path()
+intersect_path = control.path('intersect_forcing_path')
     
 # Make the file name
 domain = read_from_control(controlFolder/controlFile,'domain_name')
@@ -77,16 +48,11 @@ intersect_name = domain + '_intersected_shapefile.csv' # can also be .shp, but u
 
 # --- Find where the EASYMORE-prepared forcing files are
 # Forcing files as produced by EASYMORE
-forcing_easymore_path = read_from_control(controlFolder/controlFile,'forcing_basin_avg_path')
-
-# Specify default path if needed
-if forcing_easymore_path == 'default':
-    forcing_easymore_path = make_default_path('forcing/3_basin_averaged_data') # outputs a Path()
-else:
-    forcing_easymore_path = Path(forcing_easymore_path) # make sure a user-specified path is a Path()
+forcing_easymore_path = control.path('forcing_basin_avg_path')
     
 # Find the files
 _,_,forcing_files = next(os.walk(forcing_easymore_path))
+forcing_files = [file for file in forcing_files if file.endswith('.nc')] # skips e.g. incomplete '.nc.part' files
 forcing_files.sort() # technically doesn't matter but w/e
 
 # --- Find the time step size of the forcing data
@@ -99,93 +65,155 @@ data_step = int(data_step)
 
 # --- Find where the final forcing needs to go
 # Location for SUMMA-ready files
-forcing_summa_path = read_from_control(controlFolder/controlFile,'forcing_summa_path')
-
-# Specify default path if needed
-if forcing_summa_path == 'default':
-    forcing_summa_path = make_default_path('forcing/4_SUMMA_input') # outputs a Path()
-else:
-    forcing_summa_path = Path(forcing_summa_path) # make sure a user-specified path is a Path()
+forcing_summa_path = control.path('forcing_summa_path')
     
 # Make the folder if it doesn't exist
 forcing_summa_path.mkdir(parents=True, exist_ok=True)
 
 
-# --- Find the area-weighted lapse value for each basin
-# Load the intersection file
-topo_data = pd.read_csv(intersect_path/intersect_name) 
+# --- Number of parallel processes
+# Forcing files are independent of each other and are processed in parallel. By default this uses the number of
+# CPUs available to a SLURM job (1 outside of SLURM). A different number can be given as a command line argument:
+# python 3_temperature_lapsing_and_datastep.py [number of processes]
+ncpus = process_count(sys.argv)
+
 
+# --- Find the area-weighted lapse value for each basin
 # Find hruId name in user's shapefile
 hru_ID_name = read_from_control(controlFolder/controlFile,'catchment_shp_hruid')
 gru_ID_name = read_from_control(controlFolder/controlFile,'catchment_shp_gruid')
 
 # Specify the column names
 # Note that column names are truncated at 10 characters in the ESRI shapefile, but NOT in the .csv we use here
-gru_ID         = 'S_1_' + gru_ID_name # EASYMORE prefix + user's hruId name
-hru_ID         = 'S_1_' + hru_ID_name # EASYMORE prefix + user's hruId name
-forcing_ID     = 'S_2_ID'             # fixed name assigned by EASYMORE
-catchment_elev = 'S_1_elev_mean'      # EASYMORE prefix + name used in catchment+DEM intersection step
-forcing_elev   = 'S_2_elev_m'         # EASYMORE prefix + name used in ERA5 shapefile generation
-weights        = 'weight'             # EASYMORE feature
+gru_ID = 'S_1_' + gru_ID_name # EASYMORE prefix + user's hruId name
+hru_ID = 'S_1_' + hru_ID_name # EASYMORE prefix + user's hruId name
 
-# Define the lapse rate
-lapse_rate = 0.0065 # [K m-1]
-
-# Calculate weighted lapse values for each HRU 
+# Calculate weighted lapse values for each HRU, sorted by and indexed with the hruId (see cwarhm/lapse.py)
 # Note that these lapse values need to be ADDED to ERA5 temperature data
-topo_data['lapse_values'] = topo_data[weights] * lapse_rate * (topo_data[forcing_elev] - topo_data[catchment_elev]) # [K]
-
-# Find the total lapse value per basin; i.e. sum the individual contributions of each HRU+ERA5-grid overlapping part
-# Account for the special case where gru_ID and hru_ID share the same column and thus name
-if gru_ID == hru_ID:
-    lapse_values = topo_data.groupby([hru_ID]).lapse_values.sum().reset_index() # Sort by HRU
-else:
-    lapse_values = topo_data.groupby([gru_ID,hru_ID]).lapse_values.sum().reset_index() # sort by GRU first and HRU second
-
-# Sort and set hruID as the index variable
-lapse_values = lapse_values.sort_values(hru_ID).set_index(hru_ID)
-
-# Close the main file
-del topo_data # hopefully this saves some RAM but this is apparently not so straightforward in Python.. Can't hurt
+lapse_values = hru_lapse_values(intersect_path/intersect_name, hru_ID, gru_ID)
+
+# Lapse values in the HRU order of the forcing files, as float32 to match the temperature data. All forcing files
+# have the same HRU order, so the values are matched to the order only once and then re-used (per process).
+lapse_aligned = {'hruId': None, 'values': None}
+def aligned_lapse_values(hru_ids):
+    if lapse_aligned['hruId'] is None or not np.array_equal(lapse_aligned['hruId'], hru_ids):
+        lapse_aligned['hruId'] = hru_ids
+        lapse_aligned['values'] = lapse_values.loc[hru_ids].values.astype('float32')
+    return lapse_aligned['values']
+
+
+# --- Check if a file has already been processed
+# A SUMMA forcing file is considered complete if it can be opened, has the data_step variable, and has the same
+# number of time steps and the same HRUs (in the same order) as the basin-averaged file it was made from. Files 
+# are only given their final name once they are complete (see below), so this mainly protects against files 
+# that were made from a different version of the basin-averaged data.
+def hru_checksum(dataset):
+    return hashlib.sha1(np.ascontiguousarray(dataset.variables['hruId'][:]).tobytes()).hexdigest()
+
+def is_valid(file):
+    if not os.path.isfile(forcing_summa_path / file):
+        return False
+    try:
+        with nc4.Dataset(forcing_easymore_path / file) as src, nc4.Dataset(forcing_summa_path / file) as dest:
+            src.set_auto_maskandscale(False)
+            dest.set_auto_maskandscale(False)
+            return 'data_step' in dest.variables \
+                   and len(dest.dimensions['time']) == len(src.dimensions['time']) \
+                   and hru_checksum(dest) == hru_checksum(src)
+    except (OSError, KeyError, RuntimeError): # file cannot be read or misses 'time' or 'hruId'
+        return False
+
+
+# --- Function that applies lapse rates and adds the data-step variable to a single file
+# The file is copied one slab of time steps at a time, so that memory use does not depend on the number of time 
+# steps in a file. Lapse values are added to each slab of temperature data through broadcasting. The new file 
+# is written under a temporary name (.nc.part) and renamed once it is complete, so that an interrupted job never
+# leaves an incomplete file with a final file name behind. Returns the file name, what was done, the size of the 
+# new file [bytes] and how long this took [s].
+slab_bytes = 2**26 # ~64 MB per slab
+def lapse_and_datastep(file):
+
+    start = time.time()
+
+    # Skip files that have been processed already
+    if is_valid(file):
+        return file, 'already exists, skipped', 0, time.time() - start
+
+    file_temp = file + '.part'
+    with nc4.Dataset(forcing_easymore_path / file) as src, \
+         nc4.Dataset(forcing_summa_path / file_temp, 'w', format='NETCDF4') as dest:
+
+        # We copy the stored values and attributes as they are
+        src.set_auto_maskandscale(False)
+        dest.set_auto_maskandscale(False)
+
+        # Global attributes and dimensions
+        dest.setncatts({attr: src.getncattr(attr) for attr in src.ncattrs()})
+        for name, dimension in src.dimensions.items():
+            dest.createDimension(name, None if dimension.isunlimited() else len(dimension))
+        n_time = len(src.dimensions['time'])
+
+        # Copy the variables
+        for name, variable in src.variables.items():
+
+            # Forcing variables (time, hru) are compressed and chunked; see cwarhm/netcdf_profile.py 
+            is_forcing = len(variable.dimensions) == 2 and variable.dimensions[0] == 'time'
+            fill_value = variable.getncattr('_FillValue') if '_FillValue' in variable.ncattrs() else False
+            settings = variable_settings(variable.shape, variable.dtype.itemsize) if is_forcing else {}
+            dest.createVariable(name, variable.datatype, variable.dimensions, fill_value=fill_value, **settings)
+            dest[name].setncatts({attr: variable.getncattr(attr) for attr in variable.ncattrs() if attr != '_FillValue'})
+            if not is_forcing:
+                dest[name][:] = variable[:]
+                continue
+
+            # Copy the data slab by slab, adding the lapse values to the temperature data
+            if name == 'airtemp':
+                lapse = aligned_lapse_values(src.variables['hruId'][:])
+            time_slab = max(1, slab_bytes // (variable.dtype.itemsize * variable.shape[1]))
+            for t in range(0, n_time, time_slab):
+                values = variable[t:t+time_slab]
+                if name == 'airtemp':
+                    missing = values == fill_value if fill_value is not False else None
+                    values += lapse # broadcasts (hru,) onto (time,hru)
+                    if missing is not None:
+                        values[missing] = fill_value
+                dest[name][t:t+len(values)] = values
 
-
-# --- Loop over forcing files; apply lapse rates and add data-step variable
-# Initiate the loop
-for file in forcing_files:
-    
-    # Progress
-    print('Starting on ' + file)
-    
-    # load the data
-    with xr.open_dataset(forcing_easymore_path / file) as dat:
-    
-        # --- Temperature lapse rates
-        # Find the lapse rates by matching the HRU order in the forcing file with that in 'lapse_values'
-        lapse_values_sorted = lapse_values['lapse_values'].loc[dat['hruId'].values]
-    
-        # Make a data array of size (nTime,nHru) 
-        addThis = xr.DataArray(np.tile(lapse_values_sorted.values, (len(dat['time']),1)), dims=('time','hru')) 
-    
-        # Get the air temperature variables
-        tmp_longname = dat['airtemp'].long_name
-        tmp_units = dat['airtemp'].units    
-    
-        # Subtract lapse values from existing temperature data
-        dat['airtemp'] = dat['airtemp'] + addThis
-    
-        # Add the attributes back in
-        dat.airtemp.attrs['long_name'] = tmp_longname
-        dat.airtemp.attrs['units'] = tmp_units
-    
         # --- Time step specification 
-        dat['data_step'] = data_step
-        dat.data_step.attrs['long_name'] = 'data step length in seconds'
-        dat.data_step.attrs['units'] = 's'
+        dest.createVariable('data_step', 'i8', ())
+        dest['data_step'].setncattr('long_name', 'data step length in seconds')
+        dest['data_step'].setncattr('units', 's')
+        dest['data_step'].assignValue(data_step)
+
+    # Move the completed file into place
+    os.replace(forcing_summa_path / file_temp, forcing_summa_path / file)
+
+    return file, 'done', os.path.getsize(forcing_summa_path / file), time.time() - start
+
+
+# --- Loop over forcing files; apply lapse rates and add data-step variable, in parallel if possible
+if __name__ == '__main__':
+    start_all = time.time()
+    if ncpus > 1:
+        pool = mp.Pool(processes=ncpus)
+        results = pool.imap_unordered(lapse_and_datastep, forcing_files)
+    else:
+        results = map(lapse_and_datastep, forcing_files)
+    n_done = 0
+    n_bytes = 0
+    for file, status, size, seconds in results:
+        print('{}: {} in {:.1f} s'.format(file, status, seconds))
+        if size > 0:
+            n_done += 1
+            n_bytes += size
+    if ncpus > 1:
+        pool.close()
+        pool.join()
+    seconds_all = max(time.time() - start_all, 1e-6)
+    print('Processed {} files ({} skipped) with {} process(es) in {:.1f} s: {:.2f} files/s, {:.1f} MB/s written'.format(
+          n_done, len(forcing_files) - n_done, ncpus, seconds_all, n_done / seconds_all, n_bytes / 2**20 / seconds_all))
+
     
-        # --- Save to file in new location
-        dat.to_netcdf(forcing_summa_path/file) 
-        
-        
 # --- Code provenance
 # Generates a basic log file in the domain folder and copies the control file and itself there.
 
@@ -10,6 +10,7 @@ import numpy as np
 import xarray as xr
 import netCDF4 as nc4
 from pathlib import Path
+import sys
 from shutil import copyfile
 from datetime import datetime
 
@@ -21,50 +22,15 @@ controlFolder = Path('../../../0_control_files')
 # Store the name of the 'active' file in a variable
 controlFile = 'control_active.txt'
 
-# Function to extract a given setting from the control file
-def read_from_control( file, setting ):
-    
-    # Open 'control_active.txt' and ...
-    with open(file) as contents:
-        for line in contents:
-            
-            # ... find the line with the requested setting
-            if setting in line and not line.startswith('#'):
-                break
-    
-    # Extract the setting's value
-    substring = line.split('|',1)[1]      # Remove the setting's name (split into 2 based on '|', keep only 2nd part)
-    substring = substring.split('#',1)[0] # Remove comments, does nothing if no '#' is found
-    substring = substring.strip()         # Remove leading and trailing whitespace, tabs, newlines
-       
-    # Return this value    
-    return substring
-    
-# Function to specify a default path
-def make_default_path(suffix):
-    
-    # Get the root path
-    rootPath = Path( read_from_control(controlFolder/controlFile,'root_path') )
-    
-    # Get the domain folder
-    domainName = read_from_control(controlFolder/controlFile,'domain_name')
-    domainFolder = 'domain_' + domainName
-    
-    # Specify the forcing path
-    defaultPath = rootPath / domainFolder / suffix
-    
-    return defaultPath
-    
-    
+# Shared control file handling (see cwarhm/control.py)
+sys.path.append(str(controlFolder.parent.resolve()))
+from cwarhm.control import read_from_control, load_control
+control = load_control(controlFolder/controlFile)
+
+
 # --- Find forcing location and an example file
 # Forcing path
-forcing_path = read_from_control(controlFolder/controlFile,'forcing_summa_path')
-
-# Specify default path if needed
-if forcing_path == 'default':
-    forcing_path = make_default_path('forcing/4_SUMMA_input') # outputs a Path()
-else:
-    forcing_path = Path(forcing_path) # make sure a user-specified path is a Path()
+forcing_path = control.path('forcing_summa_path')
     
 # Find a list of forcing files
 _,_,forcing_files = next(os.walk(forcing_path))
@@ -75,14 +41,8 @@ forcing_name = forcing_files[0]
 
 # --- Find where the trial parameter file needs to go
 # Trial parameter path & name
-parameter_path = read_from_control(controlFolder/controlFile,'settings_summa_path')
+parameter_path = control.path('settings_summa_path')
 parameter_name = read_from_control(controlFolder/controlFile,'settings_summa_trialParams')
-
-# Specify default path if needed
-if parameter_path == 'default':
-    parameter_path = make_default_path('settings/SUMMA') # outputs a Path()
-else:
-    parameter_path = Path(parameter_path) # make sure a user-specified path is a Path()
     
 # Make the folder if it doesn't exist
 parameter_path.mkdir(parents=True, exist_ok=True)
@@ -33,11 +33,13 @@
 
 # modules
 import os
+import numpy as np
 import pandas as pd
 import xarray as xr
 import netCDF4 as nc4
 import geopandas as gpd
 from pathlib import Path
+import sys
 from shutil import copyfile
 from datetime import datetime
 
@@ -49,51 +51,16 @@ controlFolder = Path('../../../0_control_files')
 # Store the name of the 'active' file in a variable
 controlFile = 'control_active.txt'
 
-# Function to extract a given setting from the control file
-def read_from_control( file, setting ):
-    
-    # Open 'control_active.txt' and ...
-    with open(file) as contents:
-        for line in contents:
-            
-            # ... find the line with the requested setting
-            if setting in line and not line.startswith('#'):
-                break
-    
-    # Extract the setting's value
-    substring = line.split('|',1)[1]      # Remove the setting's name (split into 2 based on '|', keep only 2nd part)
-    substring = substring.split('#',1)[0] # Remove comments, does nothing if no '#' is found
-    substring = substring.strip()         # Remove leading and trailing whitespace, tabs, newlines
-       
-    # Return this value    
-    return substring
-    
-# Function to specify a default path
-def make_default_path(suffix):
-    
-    # Get the root path
-    rootPath = Path( read_from_control(controlFolder/controlFile,'root_path') )
-    
-    # Get the domain folder
-    domainName = read_from_control(controlFolder/controlFile,'domain_name')
-    domainFolder = 'domain_' + domainName
-    
-    # Specify the forcing path
-    defaultPath = rootPath / domainFolder / suffix
-    
-    return defaultPath
-    
-    
+# Shared control file handling (see cwarhm/control.py)
+sys.path.append(str(controlFolder.parent.resolve()))
+from cwarhm.control import read_from_control, load_control
+control = load_control(controlFolder/controlFile)
+
+
 # --- Find shapefile location and name
 # Catchment shapefile path & name
-catchment_path = read_from_control(controlFolder/controlFile,'catchment_shp_path')
+catchment_path = control.path('catchment_shp_path')
 catchment_name = read_from_control(controlFolder/controlFile,'catchment_shp_name')
-
-# Specify default path if needed
-if catchment_path == 'default':
-    catchment_path = make_default_path('shapefiles/catchment') # outputs a Path()
-else:
-    catchment_path = Path(catchment_path) # make sure a user-specified path is a Path()"
     
 # Variable names used in shapefile
 catchment_hruId_var = read_from_control(controlFolder/controlFile,'catchment_shp_hruid')
@@ -105,13 +72,7 @@ catchment_lon_var = read_from_control(controlFolder/controlFile,'catchment_shp_l
 
 # --- Find forcing location and an example file
 # Forcing path
-forcing_path = read_from_control(controlFolder/controlFile,'forcing_summa_path')
-
-# Specify default path if needed
-if forcing_path == 'default':
-    forcing_path = make_default_path('forcing/4_SUMMA_input') # outputs a Path()
-else:
-    forcing_path = Path(forcing_path) # make sure a user-specified path is a Path()
+forcing_path = control.path('forcing_summa_path')
     
 # Find a list of forcing files
 _,_,forcing_files = next(os.walk(forcing_path))
@@ -125,14 +86,8 @@ forcing_measurement_height = float(read_from_control(controlFolder/controlFile,'
 
 # --- Find where the attributes need to go
 # Attribute path & name
-attribute_path = read_from_control(controlFolder/controlFile,'settings_summa_path')
+attribute_path = control.path('settings_summa_path')
 attribute_name = read_from_control(controlFolder/controlFile,'settings_summa_attributes')
-
-# Specify default path if needed
-if attribute_path == 'default':
-    attribute_path = make_default_path('settings/SUMMA') # outputs a Path()
-else:
-    attribute_path = Path(attribute_path) # make sure a user-specified path is a Path()
     
 # Make the folder if it doesn't exist
 attribute_path.mkdir(parents=True, exist_ok=True)
@@ -254,40 +209,33 @@ with nc4.Dataset(attribute_path/attribute_name, "w", format="NETCDF4") as att:
     att[var].setncattr('units', 'm')
     att[var].setncattr('long_name', 'Measurement height above bare ground')
     
-    # Progress
-    progress = 0
-    
     # GRU variable
-    for idx in range(0,num_gru):
-        att['gruId'][idx] = gru_ids[idx]
+    att['gruId'][:] = gru_ids
     
-    # HRU variables; due to pre-sorting, these are already in the same order as the forcing files
-    for idx in range(0,num_hru):
-        
-        # Fill values from shapefile
-        att['hruId'][idx]     = shp.iloc[idx][catchment_hruId_var]
-        att['HRUarea'][idx]   = shp.iloc[idx][catchment_area_var]
-        att['latitude'][idx]  = shp.iloc[idx][catchment_lat_var]
-        att['longitude'][idx] = shp.iloc[idx][catchment_lon_var]
-        att['hru2gruId'][idx] = shp.iloc[idx][catchment_gruId_var]
-        
-        # Constants
-        att['tan_slope'][idx]      = 0.1                         # Only used in qbaseTopmodel modelling decision
-        att['contourLength'][idx]  = 30                          # Only used in qbaseTopmodel modelling decision
-        att['slopeTypeIndex'][idx] = 1                           # Needs to be set but not used
-        att['mHeight'][idx]        = forcing_measurement_height  # Forcing data height; used in some scaling equations       
-        att['downHRUindex'][idx]   = 0   # All HRUs modeled as independent columns; optionally changed when elevation is added to attributes.nc
-        
-        # Placeholders to be filled later
-        att['elevation'][idx]     = -999
-        att['soilTypeIndex'][idx] = -999
-        att['vegTypeIndex'][idx]  = -999
-        
-       # Show a progress report
-        print(str(progress+1) + ' out of ' + str(num_hru) + ' HRUs completed.')
-        
-        # Increment the counter
-        progress += 1
+    # HRU variables; due to pre-sorting, these are already in the same order as the forcing files.
+    # Each variable is written with a single array assignment.
+    
+    # Fill values from shapefile
+    att['hruId'][:]     = shp[catchment_hruId_var].values
+    att['HRUarea'][:]   = shp[catchment_area_var].values
+    att['latitude'][:]  = shp[catchment_lat_var].values
+    att['longitude'][:] = shp[catchment_lon_var].values
+    att['hru2gruId'][:] = shp[catchment_gruId_var].values
+    
+    # Constants
+    att['tan_slope'][:]      = np.full(num_hru, 0.1)                         # Only used in qbaseTopmodel modelling decision
+    att['contourLength'][:]  = np.full(num_hru, 30)                          # Only used in qbaseTopmodel modelling decision
+    att['slopeTypeIndex'][:] = np.full(num_hru, 1)                           # Needs to be set but not used
+    att['mHeight'][:]        = np.full(num_hru, forcing_measurement_height)  # Forcing data height; used in some scaling equations
+    att['downHRUindex'][:]   = np.full(num_hru, 0)   # All HRUs modeled as independent columns; optionally changed when elevation is added to attributes.nc
+    
+    # Placeholders to be filled later
+    att['elevation'][:]     = np.full(num_hru, -999)
+    att['soilTypeIndex'][:] = np.full(num_hru, -999)
+    att['vegTypeIndex'][:]  = np.full(num_hru, -999)
+    
+# Show a progress report
+print('Initialized attributes of ' + str(num_hru) + ' HRUs in ' + str(num_gru) + ' GRUs.')
         
         
 # --- Code provenance
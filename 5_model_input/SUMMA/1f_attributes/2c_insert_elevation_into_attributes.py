@@ -9,6 +9,7 @@ import numpy as np
 import netCDF4 as nc4
 import geopandas as gpd
 from pathlib import Path
+import sys
 from shutil import copyfile
 from datetime import datetime
 
@@ -20,51 +21,17 @@ controlFolder = Path('../../../0_control_files')
 # Store the name of the 'active' file in a variable
 controlFile = 'control_active.txt'
 
-# Function to extract a given setting from the control file
-def read_from_control( file, setting ):
-    
-    # Open 'control_active.txt' and ...
-    with open(file) as contents:
-        for line in contents:
-            
-            # ... find the line with the requested setting
-            if setting in line and not line.startswith('#'):
-                break
-    
-    # Extract the setting's value
-    substring = line.split('|',1)[1]      # Remove the setting's name (split into 2 based on '|', keep only 2nd part)
-    substring = substring.split('#',1)[0] # Remove comments, does nothing if no '#' is found
-    substring = substring.strip()         # Remove leading and trailing whitespace, tabs, newlines
-       
-    # Return this value    
-    return substring
-    
-# Function to specify a default path
-def make_default_path(suffix):
-    
-    # Get the root path
-    rootPath = Path( read_from_control(controlFolder/controlFile,'root_path') )
-    
-    # Get the domain folder
-    domainName = read_from_control(controlFolder/controlFile,'domain_name')
-    domainFolder = 'domain_' + domainName
-    
-    # Specify the forcing path
-    defaultPath = rootPath / domainFolder / suffix
-    
-    return defaultPath
-    
-    
+# Shared control file handling (see cwarhm/control.py)
+sys.path.append(str(controlFolder.parent.resolve()))
+from cwarhm.control import read_from_control, load_control
+from cwarhm.attributes import hru_table, down_hru_index
+control = load_control(controlFolder/controlFile)
+
+
 # --- Find shapefile location and name
 # Path to and name of shapefile with intersection between catchment and soil classes
-intersect_path = read_from_control(controlFolder/controlFile,'intersect_dem_path')
+intersect_path = control.path('intersect_dem_path')
 intersect_name = read_from_control(controlFolder/controlFile,'intersect_dem_name')
-
-# Specify default path if needed
-if intersect_path == 'default':
-    intersect_path = make_default_path('shapefiles/catchment_intersection/with_dem') # outputs a Path()
-else:
-    intersect_path = Path(intersect_path) # make sure a user-specified path is a Path()
     
 # Variable names used in shapefile
 intersect_hruId_var = read_from_control(controlFolder/controlFile,'catchment_shp_hruid')
@@ -73,14 +40,8 @@ intersect_gruId_var = read_from_control(controlFolder/controlFile,'catchment_shp
 
 # --- Find where the attributes file is
 # Attribute path & name
-attribute_path = read_from_control(controlFolder/controlFile,'settings_summa_path')
+attribute_path = control.path('settings_summa_path')
 attribute_name = read_from_control(controlFolder/controlFile,'settings_summa_attributes')
-
-# Specify default path if needed
-if attribute_path == 'default':
-    attribute_path = make_default_path('settings/SUMMA') # outputs a Path()
-else:
-    attribute_path = Path(attribute_path) # make sure a user-specified path is a Path()
     
     
 # --- Open the shapefile
@@ -98,67 +59,24 @@ do_downHRUindex = read_from_control(controlFolder/controlFile,'settings_summa_co
 # Find the downHRUindex value if requested
 if do_downHRUindex.lower() == 'yes':
     
-    # Find the unique GRU IDs
-    gru_ids = shp[intersect_gruId_var].unique()
-    
-    # Make hruId the index
-    shp.set_index(intersect_hruId_var, inplace=True)
-    
-    # Loop over the GRUs
-    for gru_id in gru_ids:
-    
-        # Select only the GRU we're currently working on
-        gru_mask = (shp[intersect_gruId_var] == gru_id)
-    
-        # Find the soring order of HRUs in this GRU based on their elevations
-        tmp_sort = shp[gru_mask]['elev_mean'].argsort()
-    
-        # Loop over the HRUs in this GRU and set their downHRUindex in the shapefile
-        HRUs_seen = 0
-        last_HRU = 0
-        for HRU,order in tmp_sort.iteritems():
-            if order == 0: 
-                # most downstream HRU
-                print('Filling downHRUindex of HRU {} with HRU {}'.format(last_HRU,HRU)) 
-                print('Filling downHRUindex of HRU {} with HRU {}'.format(HRU,0)) 
-                if last_HRU != 0: # If there are more HRUs in this GRU ...
-                    shp.at[last_HRU, 'downHRUindex'] = int(HRU) # fill the second-to last and also ...
-                shp.at[HRU,      'downHRUindex'] = 0   # fill the last (possibly only) HRU
-            elif HRUs_seen > 0:
-                # not the first iteration
-                print('Filling downHRUindex of HRU {} with HRU {}'.format(last_HRU,HRU))        
-                shp.at[last_HRU, 'downHRUindex'] = int(HRU)
-            HRUs_seen += 1
-            last_HRU = HRU
-            
-    # Reset the index
-    shp.reset_index(inplace=True)
+    # Within each GRU, each HRU drains to the HRU with the next-lower elevation; the lowest HRU is the outlet (0)
+    shp['downHRUindex'] = down_hru_index(shp, intersect_hruId_var, intersect_gruId_var, 'elev_mean')
     
     
 # --- Open the attributes file and fill the placeholder values in the attributes file
 # Open the netcdf file for reading+writing
 with nc4.Dataset(attribute_path/attribute_name, "r+") as att:
     
-    # Loop over the HRUs in the attributes
-    for idx in range(0,len(att['hruId'])):
-        
-        # Find the HRU ID (attributes file) at this index
-        attribute_hru = att['hruId'][idx]
+    # Reorder the shapefile to the HRU order of the attributes file
+    shp = hru_table(shp, intersect_hruId_var, att['hruId'][:])
+    
+    # Replace the values
+    att['elevation'][:] = shp['elev_mean'].values
+    print('Replaced elevation at {} HRUs'.format(len(shp)))
     
-        # Find the row in the shapefile that contains info for this HRU
-        shp_mask = (shp[intersect_hruId_var].astype(int) == attribute_hru)
-        
-        # Find the elevation & downHRUindex
-        tmp_elev = shp['elev_mean'][shp_mask].values[0]
-        tmp_down = shp['downHRUindex'][shp_mask].values[0]
-        
-        # Replace the value
-        print('Replacing elevation {} [m] with {} [m] at HRU {}'.format(att['elevation'][idx],tmp_elev,attribute_hru))
-        att['elevation'][idx] = tmp_elev
-        
-        if do_downHRUindex.lower() == 'yes':
-            print('Replacing downHRUindex {} with {} at HRU {}'.format(att['downHRUindex'][idx],tmp_down,attribute_hru))
-            att['downHRUindex'][idx] = tmp_down
+    if do_downHRUindex.lower() == 'yes':
+        att['downHRUindex'][:] = shp['downHRUindex'].values
+        print('Replaced downHRUindex at {} HRUs'.format(len(shp)))
             
             
 # --- Code provenance
@@ -4,6 +4,7 @@
 # modules
 import os
 from pathlib import Path
+import sys
 from shutil import copyfile
 from datetime import datetime
 
@@ -15,41 +16,12 @@ controlFolder = Path('../../../0_control_files')
 # Store the name of the 'active' file in a variable
 controlFile = 'control_active.txt'
 
-# Function to extract a given setting from the control file
-def read_from_control( file, setting ):
-    
-    # Open 'control_active.txt' and ...
-    with open(file) as contents:
-        for line in contents:
-            
-            # ... find the line with the requested setting
-            if setting in line and not line.startswith('#'):
-                break
-    
-    # Extract the setting's value
-    substring = line.split('|',1)[1]      # Remove the setting's name (split into 2 based on '|', keep only 2nd part)
-    substring = substring.split('#',1)[0] # Remove comments, does nothing if no '#' is found
-    substring = substring.strip()         # Remove leading and trailing whitespace, tabs, newlines
-       
-    # Return this value    
-    return substring
-    
-# Function to specify a default path
-def make_default_path(suffix):
-    
-    # Get the root path
-    rootPath = Path( read_from_control(controlFolder/controlFile,'root_path') )
-    
-    # Get the domain folder
-    domainName = read_from_control(controlFolder/controlFile,'domain_name')
-    domainFolder = 'domain_' + domainName
-    
-    # Specify the forcing path
-    defaultPath = rootPath / domainFolder / suffix
-    
-    return defaultPath
-    
-    
+# Shared control file handling (see cwarhm/control.py)
+sys.path.append(str(controlFolder.parent.resolve()))
+from cwarhm.control import load_control
+control = load_control(controlFolder/controlFile)
+
+
 # --- Define where the base settings are
 # Base settings
 base_settings_path = Path('../0_base_settings')
@@ -57,13 +29,7 @@ base_settings_path = Path('../0_base_settings')
 
 # --- Find where the settings need to go
 # Settings path 
-settings_path = read_from_control(controlFolder/controlFile,'settings_mizu_path')
-
-# Specify default path if needed
-if settings_path == 'default':
-    settings_path = make_default_path('settings/mizuRoute') # outputs a Path()
-else:
-    settings_path = Path(settings_path) # make sure a user-specified path is a Path()
+settings_path = control.path('settings_mizu_path')
     
 # Make the folder if it doesn't exist
 settings_path.mkdir(parents=True, exist_ok=True)
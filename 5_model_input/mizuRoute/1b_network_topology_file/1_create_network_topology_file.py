@@ -9,6 +9,7 @@ import pandas as pd
 import netCDF4 as nc4
 import geopandas as gpd
 from pathlib import Path
+import sys
 from shutil import copyfile
 from datetime import datetime
 
@@ -20,51 +21,16 @@ controlFolder = Path('../../../0_control_files')
 # Store the name of the 'active' file in a variable
 controlFile = 'control_active.txt'
 
-# Function to extract a given setting from the control file
-def read_from_control( file, setting ):
-    
-    # Open 'control_active.txt' and ...
-    with open(file) as contents:
-        for line in contents:
-            
-            # ... find the line with the requested setting
-            if setting in line and not line.startswith('#'):
-                break
-    
-    # Extract the setting's value
-    substring = line.split('|',1)[1]      # Remove the setting's name (split into 2 based on '|', keep only 2nd part)
-    substring = substring.split('#',1)[0] # Remove comments, does nothing if no '#' is found
-    substring = substring.strip()         # Remove leading and trailing whitespace, tabs, newlines
-       
-    # Return this value    
-    return substring
-    
-# Function to specify a default path
-def make_default_path(suffix):
-    
-    # Get the root path
-    rootPath = Path( read_from_control(controlFolder/controlFile,'root_path') )
-    
-    # Get the domain folder
-    domainName = read_from_control(controlFolder/controlFile,'domain_name')
-    domainFolder = 'domain_' + domainName
-    
-    # Specify the forcing path
-    defaultPath = rootPath / domainFolder / suffix
-    
-    return defaultPath
-    
-    
+# Shared control file handling (see cwarhm/control.py)
+sys.path.append(str(controlFolder.parent.resolve()))
+from cwarhm.control import read_from_control, load_control
+control = load_control(controlFolder/controlFile)
+
+
 # --- Find location of river network shapefile
 # River network shapefile path & name
-river_network_path = read_from_control(controlFolder/controlFile,'river_network_shp_path')
+river_network_path = control.path('river_network_shp_path')
 river_network_name = read_from_control(controlFolder/controlFile,'river_network_shp_name')
-
-# Specify default path if needed
-if river_network_path == 'default':
-    river_network_path = make_default_path('shapefiles/river_network') # outputs a Path()
-else:
-    river_network_path = Path(river_network_path) # make sure a user-specified path is a Path()
     
 # Find the field names we're after
 river_seg_id      = read_from_control(controlFolder/controlFile,'river_network_shp_segid')
@@ -75,14 +41,8 @@ river_length      = read_from_control(controlFolder/controlFile,'river_network_s
 
 # --- Find location of river basin shapefile (routing catchments)
 # River network shapefile path & name
-river_basin_path = read_from_control(controlFolder/controlFile,'river_basin_shp_path')
+river_basin_path = control.path('river_basin_shp_path')
 river_basin_name = read_from_control(controlFolder/controlFile,'river_basin_shp_name')
-
-# Specify default path if needed
-if river_basin_path == 'default':
-    river_basin_path = make_default_path('shapefiles/river_basins') # outputs a Path()
-else:
-    river_basin_path = Path(river_basin_path) # make sure a user-specified path is a Path()
     
 # Find the field names we're after
 basin_hru_id     = read_from_control(controlFolder/controlFile,'river_basin_shp_rm_hruid')
@@ -92,14 +52,8 @@ basin_hru_to_seg = read_from_control(controlFolder/controlFile,'river_basin_shp_
 
 # --- Find where the topology file needs to go
 # Topology .nc path and name
-topology_path = read_from_control(controlFolder/controlFile,'settings_mizu_path')
+topology_path = control.path('settings_mizu_path')
 topology_name = read_from_control(controlFolder/controlFile,'settings_mizu_topology')
-
-# Specify default path if needed
-if topology_path == 'default':
-    topology_path = make_default_path('settings/mizuRoute') # outputs a Path()
-else:
-    topology_path = Path(topology_path) # make sure a user-specified path is a Path()
     
 # Make the folder if it doesn't exist
 topology_path.mkdir(parents=True, exist_ok=True)
@@ -9,6 +9,7 @@ import pandas as pd
 import netCDF4 as nc4
 import geopandas as gpd
 from pathlib import Path
+import sys
 from shutil import copyfile
 import easymore.easymore as esmr
 from datetime import datetime
@@ -21,41 +22,12 @@ controlFolder = Path('../../../0_control_files')
 # Store the name of the 'active' file in a variable
 controlFile = 'control_active.txt'
 
-# Function to extract a given setting from the control file
-def read_from_control( file, setting ):
-    
-    # Open 'control_active.txt' and ...
-    with open(file) as contents:
-        for line in contents:
-            
-            # ... find the line with the requested setting
-            if setting in line and not line.startswith('#'):
-                break
-    
-    # Extract the setting's value
-    substring = line.split('|',1)[1]      # Remove the setting's name (split into 2 based on '|', keep only 2nd part)
-    substring = substring.split('#',1)[0] # Remove comments, does nothing if no '#' is found
-    substring = substring.strip()         # Remove leading and trailing whitespace, tabs, newlines
-       
-    # Return this value    
-    return substring
-    
-# Function to specify a default path
-def make_default_path(suffix):
-    
-    # Get the root path
-    rootPath = Path( read_from_control(controlFolder/controlFile,'root_path') )
-    
-    # Get the domain folder
-    domainName = read_from_control(controlFolder/controlFile,'domain_name')
-    domainFolder = 'domain_' + domainName
-    
-    # Specify the forcing path
-    defaultPath = rootPath / domainFolder / suffix
-    
-    return defaultPath
-    
-    
+# Shared control file handling (see cwarhm/control.py)
+sys.path.append(str(controlFolder.parent.resolve()))
+from cwarhm.control import read_from_control, load_control
+control = load_control(controlFolder/controlFile)
+
+
 # --- Check if remapping is needed
 # Get the remap flag
 do_remap = read_from_control(controlFolder/controlFile,'river_basin_needs_remap')
@@ -68,14 +40,8 @@ if do_remap.lower() != 'yes':
 
 # --- Find location of hydrologic model (HM) catchment shapefile
 # HM catchment shapefile path & name
-hm_catchment_path = read_from_control(controlFolder/controlFile,'catchment_shp_path')
+hm_catchment_path = control.path('catchment_shp_path')
 hm_catchment_name = read_from_control(controlFolder/controlFile,'catchment_shp_name')
-
-# Specify default path if needed
-if hm_catchment_path == 'default':
-    hm_catchment_path = make_default_path('shapefiles/catchment') # outputs a Path()
-else:
-    hm_catchment_path = Path(hm_catchment_path) # make sure a user-specified path is a Path()
     
 # Find the fields we're interested in
 hm_shp_gru_id = read_from_control(controlFolder/controlFile,'catchment_shp_gruid')
@@ -83,14 +49,8 @@ hm_shp_gru_id = read_from_control(controlFolder/controlFile,'catchment_shp_gruid
 
 # --- Find location of routing model (RM) catchment shapefile
 # Routing model catchment shapefile path & name
-rm_catchment_path = read_from_control(controlFolder/controlFile,'river_basin_shp_path')
+rm_catchment_path = control.path('river_basin_shp_path')
 rm_catchment_name = read_from_control(controlFolder/controlFile,'river_basin_shp_name')
-
-# Specify default path if needed
-if rm_catchment_path == 'default':
-    rm_catchment_path = make_default_path('shapefiles/river_basins') # outputs a Path()
-else:
-    rm_catchment_path = Path(rm_catchment_path) # make sure a user-specified path is a Path()
     
 # Find the fields we're interested in
 rm_shp_hru_id = read_from_control(controlFolder/controlFile,'river_basin_shp_rm_hruid')
@@ -98,14 +58,8 @@ rm_shp_hru_id = read_from_control(controlFolder/controlFile,'river_basin_shp_rm_
 
 # --- Find where the intersection needs to go
 # Intersected shapefile path. Name is set by EASYMORE as [prefix]_intersected_shapefile.shp
-intersect_path = read_from_control(controlFolder/controlFile,'intersect_routing_path')
+intersect_path = control.path('intersect_routing_path')
 intersect_name = read_from_control(controlFolder/controlFile,'intersect_routing_name')
-
-# Specify default path if needed
-if intersect_path == 'default':
-    intersect_path = make_default_path('shapefiles/catchment_intersection/with_routing') # outputs a Path()
-else:
-    intersect_path = Path(intersect_path) # make sure a user-specified path is a Path()
     
 # Make the folder if it doesn't exist
 intersect_path.mkdir(parents=True, exist_ok=True)
@@ -113,14 +67,8 @@ intersect_path.mkdir(parents=True, exist_ok=True)
 
 # --- Find where the remapping file needs to go
 # Remap .nc path and name
-remap_path = read_from_control(controlFolder/controlFile,'settings_mizu_path')
+remap_path = control.path('settings_mizu_path')
 remap_name = read_from_control(controlFolder/controlFile,'settings_mizu_remap')
-
-# Specify default path if needed
-if remap_path == 'default':
-    remap_path = make_default_path('settings/mizuRoute') # outputs a Path()
-else:
-    remap_path = Path(remap_path) # make sure a user-specified path is a Path()
     
 # Make the folder if it doesn't exist
 remap_path.mkdir(parents=True, exist_ok=True)
@@ -4,6 +4,7 @@
 # modules
 import os
 from pathlib import Path
+import sys
 from shutil import copyfile
 from datetime import datetime
 
@@ -15,51 +16,16 @@ controlFolder = Path('../../../0_control_files')
 # Store the name of the 'active' file in a variable
 controlFile = 'control_active.txt'
 
-# Function to extract a given setting from the control file
-def read_from_control( file, setting ):
-    
-    # Open 'control_active.txt' and ...
-    with open(file) as contents:
-        for line in contents:
-            
-            # ... find the line with the requested setting
-            if setting in line and not line.startswith('#'):
-                break
-    
-    # Extract the setting's value
-    substring = line.split('|',1)[1]      # Remove the setting's name (split into 2 based on '|', keep only 2nd part)
-    substring = substring.split('#',1)[0] # Remove comments, does nothing if no '#' is found
-    substring = substring.strip()         # Remove leading and trailing whitespace, tabs, newlines
-       
-    # Return this value    
-    return substring
-    
-# Function to specify a default path
-def make_default_path(suffix):
-    
-    # Get the root path
-    rootPath = Path( read_from_control(controlFolder/controlFile,'root_path') )
-    
-    # Get the domain folder
-    domainName = read_from_control(controlFolder/controlFile,'domain_name')
-    domainFolder = 'domain_' + domainName
-    
-    # Specify the forcing path
-    defaultPath = rootPath / domainFolder / suffix
-    
-    return defaultPath
-    
-    
+# Shared control file handling (see cwarhm/control.py)
+sys.path.append(str(controlFolder.parent.resolve()))
+from cwarhm.control import read_from_control, load_control
+control = load_control(controlFolder/controlFile)
+
+
 # --- Find where the control file needs to go
 # Forcing file list path & name
-control_path = read_from_control(controlFolder/controlFile,'settings_mizu_path')
+control_path = control.path('settings_mizu_path')
 control_name = read_from_control(controlFolder/controlFile,'settings_mizu_control_file')
-
-# Specify default path if needed
-if control_path == 'default':
-    control_path = make_default_path('settings/mizuRoute') # outputs a Path()
-else:
-    control_path = Path(control_path) # make sure a user-specified path is a Path()
     
 # Make the folder if it doesn't exist
 control_path.mkdir(parents=True, exist_ok=True)
@@ -72,33 +38,15 @@ experiment_id = read_from_control(controlFolder/controlFile,'experiment_id')
 
 # Paths - settings folder
 # -----------------------
-path_to_settings = read_from_control(controlFolder/controlFile,'settings_mizu_path')
-
-# Specify default path if needed
-if path_to_settings == 'default':
-    path_to_settings = make_default_path('settings/mizuRoute') # outputs a Path()
-else:
-    path_to_settings = Path(path_to_settings) # make sure a user-specified path is a Path()
+path_to_settings = control.path('settings_mizu_path')
     
 # Paths - SUMMA output/mizuRoute input folder
 # -------------------------------------------
-path_to_input = read_from_control(controlFolder/controlFile,'experiment_output_summa')
-
-# Specify default path if needed
-if path_to_input == 'default':  
-    path_to_input = make_default_path('simulations/' + experiment_id + '/SUMMA') # outputs a Path()
-else:
-    path_to_input = Path(path_to_input) # make sure a user-specified path is a Path()   
+path_to_input = control.path('experiment_output_summa')
 
 # Paths - mizuRoute output folder
 # -------------------------------
-path_to_output = read_from_control(controlFolder/controlFile,'experiment_output_mizuRoute')
-
-# Specify default path if needed
-if path_to_output == 'default':  
-    path_to_output = make_default_path('simulations/' + experiment_id + '/mizuRoute') # outputs a Path()
-else:
-    path_to_output = Path(path_to_output) # make sure a user-specified path is a Path()
+path_to_output = control.path('experiment_output_mizuRoute')
     
 # Make the folder if it doesn't exist
 path_to_output.mkdir(parents=True, exist_ok=True)
@@ -0,0 +1,56 @@
+'''
+Functions for filling SUMMA's attributes .nc file from the catchment intersection shapefiles.
+
+The intersection shapefiles contain one row per HRU, but not necessarily in the HRU order of the attributes
+file. Instead of searching the shapefile for each HRU in the attributes file, the shapefile is reordered
+once to the attributes' hruId order (hru_table()), after which each attribute is a column (or a set of
+columns) that can be written to the attributes file in one go.
+
+Usage:
+    from cwarhm.attributes import hru_table, class_histogram
+    table = hru_table(shp, 'HRU_ID', att['hruId'][:])
+    hist = class_histogram(table, 'USGS', range(0,13)) # (HRU x class) array
+    shp['downHRUindex'] = down_hru_index(shp, 'HRU_ID', 'GRU_ID')
+'''
+
+import numpy as np
+
+
+def hru_table(shp, hru_id_var, hru_ids):
+
+    '''Returns the rows of (Geo)DataFrame 'shp' in the order of 'hru_ids', using column 'hru_id_var' (converted
+    to int) as the HRU ID. If an HRU ID occurs more than once in 'shp', the first row is used. Raises a
+    ValueError if any of the HRU IDs is missing from 'shp'.'''
+
+    table = shp.set_index(shp[hru_id_var].astype(int).values)
+    table = table[~table.index.duplicated(keep='first')]
+    hru_ids = np.asarray(hru_ids).astype(int)
+    missing = ~np.isin(hru_ids, table.index.values)
+    if missing.any():
+        raise ValueError('{} HRU(s) not found in the shapefile, e.g. hruId {}'.format(missing.sum(), hru_ids[missing][:5].tolist()))
+    return table.loc[hru_ids]
+
+
+def class_histogram(table, prefix, classes):
+
+    '''Returns a (HRU x class) float array with the values of columns '[prefix]_[class]' of 'table' for each
+    class in 'classes'. Classes without a column in 'table' are 0.'''
+
+    hist = np.zeros((len(table), len(classes)))
+    for i, c in enumerate(classes):
+        column = '{}_{}'.format(prefix, c)
+        if column in table.columns:
+            hist[:,i] = table[column].values
+    return hist
+
+
+def down_hru_index(shp, hru_id_var, gru_id_var, elev_var='elev_mean'):
+
+    '''Returns the downHRUindex of each row of 'shp': the ID of the HRU with the next-lower mean elevation in
+    the same GRU, or 0 for the lowest HRU in each GRU (the GRU outlet). HRUs with equal elevations are ordered
+    as in 'shp'. All GRUs are handled at once by sorting the HRUs by GRU and elevation and shifting the HRU IDs
+    by one place within each GRU.'''
+
+    ordered = shp[[hru_id_var, gru_id_var, elev_var]].sort_values([gru_id_var, elev_var], kind='mergesort')
+    down = ordered.groupby(gru_id_var, sort=False)[hru_id_var].shift(1).fillna(0).astype(int)
+    return down.reindex(shp.index).values
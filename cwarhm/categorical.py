@@ -0,0 +1,41 @@
+'''
+Functions for categorical rasters, such as land and soil classes.
+
+Usage:
+    from cwarhm.categorical import mode_of_classes
+    mode = mode_of_classes(land_use_classes, axis=0) # e.g. [year,row,col] -> [row,col]
+'''
+
+import numpy as np
+
+
+def mode_of_classes(classes, axis=0):
+
+    '''Returns the most common class along 'axis' of an array of integer classes (e.g. the land class of each
+    pixel in each year). Ties are broken in favour of the smallest class, which gives the same result as
+    scipy.stats.mode().
+
+    Intended for arrays with few distinct classes, such as the 17 IGBP classes plus a fill value. For each
+    distinct class, the number of layers along 'axis' that contain this class is counted for every pixel; the
+    class with the highest count is then selected with argmax(). This needs memory for one count per distinct
+    class per pixel.'''
+
+    classes = np.moveaxis(np.asarray(classes), axis, 0)
+    n_layers = classes.shape[0]
+
+    # Find the distinct classes, in ascending order. For 8-bit classes a presence table avoids sorting
+    if classes.dtype in (np.uint8, np.int8):
+        present = np.zeros(256, dtype=bool)
+        present[classes.reshape(-1).view(np.uint8)] = True
+        values = np.sort(np.flatnonzero(present).astype(np.uint8).view(classes.dtype)) # sort() puts negative int8 first
+    else:
+        values = np.unique(classes)
+
+    # Count how often each class occurs at each pixel
+    count_type = np.uint8 if n_layers < 256 else np.uint16 if n_layers < 65536 else np.uint32
+    counts = np.empty((len(values),) + classes.shape[1:], dtype=count_type)
+    for i, value in enumerate(values):
+        np.add.reduce((classes == value).view(np.uint8), axis=0, dtype=count_type, out=counts[i])
+
+    # Most common class; argmax() returns the first maximum, i.e. the smallest class in case of a tie
+    return values[np.argmax(counts, axis=0)]
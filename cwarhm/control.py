@@ -0,0 +1,230 @@
+'''
+Control file handling shared by the workflow scripts.
+
+Reads `control_active.txt` once into an immutable mapping of setting names to values. The value of every
+path setting that is set to 'default' is resolved into the default location inside the domain folder when
+the file is parsed, so that scripts only need dictionary lookups afterwards. Parsed files are cached per
+process and re-read only when the file on disk changes, which allows multiple workflow steps to be run
+from the same Python interpreter.
+
+Usage:
+    from cwarhm.control import load_control
+    control = load_control(controlFolder/controlFile)
+    forcing_merged_path = control.path('forcing_merged_path')
+    years = control.get_int_list('forcing_raw_time')
+'''
+
+import os
+from pathlib import Path
+from types import MappingProxyType
+from collections.abc import Mapping
+
+# Default locations of path settings, relative to 'root_path/domain_[name]'.
+# These match the folder structure listed at the bottom of the control files.
+DEFAULT_DOMAIN_PATHS = {
+    'catchment_shp_path':          'shapefiles/catchment',
+    'river_network_shp_path':      'shapefiles/river_network',
+    'river_basin_shp_path':        'shapefiles/river_basins',
+    'forcing_shape_path':          'shapefiles/forcing',
+    'forcing_geo_path':            'forcing/0_geopotential',
+    'forcing_raw_path':            'forcing/1_ERA5_raw_data',
+    'forcing_merged_path':         'forcing/2_merged_data',
+    'forcing_easymore_path':       'forcing/3_temp_easymore',
+    'forcing_basin_avg_path':      'forcing/3_basin_averaged_data',
+    'forcing_summa_path':          'forcing/4_SUMMA_input',
+    'parameter_dem_raw_path':      'parameters/dem/1_MERIT_raw_data',
+    'parameter_dem_unpack_path':   'parameters/dem/2_MERIT_hydro_unpacked_data',
+    'parameter_dem_vrt1_path':     'parameters/dem/3_vrt',
+    'parameter_dem_vrt2_path':     'parameters/dem/4_domain_vrt',
+    'parameter_dem_tif_path':      'parameters/dem/5_elevation',
+    'parameter_soil_raw_path':     'parameters/soilclass/1_soil_classes_global',
+    'parameter_soil_domain_path':  'parameters/soilclass/2_soil_classes_domain',
+    'parameter_land_raw_path':     'parameters/landclass/1_MODIS_raw_data',
+    'parameter_land_vrt1_path':    'parameters/landclass/2_vrt_native_crs',
+    'parameter_land_vrt2_path':    'parameters/landclass/3_vrt_epsg_4326',
+    'parameter_land_vrt3_path':    'parameters/landclass/4_domain_vrt_epsg_4326',
+    'parameter_land_vrt4_path':    'parameters/landclass/5_multiband_domain_vrt_epsg_4326',
+    'parameter_land_tif_path':     'parameters/landclass/6_tif_multiband',
+    'parameter_land_mode_path':    'parameters/landclass/7_mode_land_class',
+    'intersect_dem_path':          'shapefiles/catchment_intersection/with_dem',
+    'intersect_soil_path':         'shapefiles/catchment_intersection/with_soilgrids',
+    'intersect_land_path':         'shapefiles/catchment_intersection/with_modis',
+    'intersect_coverage_path':     'shapefiles/catchment_intersection/coverage_weights',
+    'intersect_forcing_path':      'shapefiles/catchment_intersection/with_forcing',
+    'intersect_routing_path':      'shapefiles/catchment_intersection/with_routing',
+    'settings_summa_path':         'settings/SUMMA',
+    'settings_mizu_path':          'settings/mizuRoute',
+    'experiment_output_summa':     'simulations/{experiment_id}/SUMMA',
+    'experiment_output_mizuRoute': 'simulations/{experiment_id}/mizuRoute',
+    'experiment_log_summa':        'simulations/{experiment_id}/SUMMA/SUMMA_logs',
+    'experiment_log_mizuroute':    'simulations/{experiment_id}/mizuRoute/mizuRoute_logs',
+    'visualization_folder':        'visualization',
+}
+
+# Default locations of path settings, relative to 'root_path'
+DEFAULT_ROOT_PATHS = {
+    'install_path_summa':     'installs/summa',
+    'install_path_mizuroute': 'installs/mizuRoute',
+}
+
+# Default locations of path settings, relative to the repository (i.e. the parent of the control file folder)
+DEFAULT_REPO_PATHS = {
+    'parameter_land_list_path': '3b_parameters/MODIS_MCD12Q1_V6/1_download',
+}
+
+# Cache of parsed control files: {resolved file name: (modification time, ControlSettings)}
+_cache = {}
+
+
+def parse_control_file(file):
+
+    '''Reads a control file and returns a {setting: value} dictionary of the raw (string) setting values.
+
+    Follows the same rules as the `read_from_control()` functions in the individual scripts: lines
+    starting with '#' are skipped, the setting name is everything before the first '|', the value
+    is everything after it up to the first '#'. Only the first occurrence of a setting is kept.'''
+
+    settings = {}
+    with open(file) as contents:
+        for line in contents:
+
+            # Skip comments and anything that does not look like a setting (e.g. the folder structure example)
+            if line.startswith('#') or '|' not in line:
+                continue
+            name, value = line.split('|',1)
+            name = name.strip()
+            if not name.isidentifier():
+                continue
+
+            # Extract the setting's value
+            value = value.split('#',1)[0] # Remove comments, does nothing if no '#' is found
+            value = value.strip()         # Remove leading and trailing whitespace, tabs, newlines
+            settings.setdefault(name, value)
+
+    return settings
+
+
+class ControlSettings(Mapping):
+
+    '''Immutable view of a parsed control file. Indexing returns the raw string value of a setting;
+    the `path()` and `get_*()` methods return resolved paths and typed values.'''
+
+    def __init__(self, settings, file=None):
+
+        self.file = Path(file) if file is not None else None
+        self._settings = MappingProxyType(dict(settings))
+        self._paths = MappingProxyType(self._resolve_paths())
+
+    def _resolve_paths(self):
+
+        # Folders that default paths are relative to. Missing settings simply mean no defaults can be made.
+        root_path = Path(self._settings['root_path']) if 'root_path' in self._settings else None
+        domain_path = None
+        if root_path is not None and 'domain_name' in self._settings:
+            domain_path = root_path / ('domain_' + self._settings['domain_name'])
+        repo_path = self.file.parent.parent if self.file is not None else None
+
+        paths = {}
+        for name, value in self._settings.items():
+            if value != 'default':
+                if name.endswith('_path') or name in DEFAULT_DOMAIN_PATHS:
+                    paths[name] = Path(value) # make sure a user-specified path is a Path()
+            elif name in DEFAULT_DOMAIN_PATHS and domain_path is not None:
+                try:
+                    paths[name] = domain_path / DEFAULT_DOMAIN_PATHS[name].format(**self._settings)
+                except KeyError:
+                    pass # e.g. 'experiment_id' is not specified; no default can be made
+            elif name in DEFAULT_ROOT_PATHS and root_path is not None:
+                paths[name] = root_path / DEFAULT_ROOT_PATHS[name]
+            elif name in DEFAULT_REPO_PATHS and repo_path is not None:
+                paths[name] = repo_path / DEFAULT_REPO_PATHS[name]
+
+        # Domain folders that were added to the workflow after a control file was made use their default location
+        for name, suffix in DEFAULT_DOMAIN_PATHS.items():
+            if name not in self._settings and domain_path is not None and '{' not in suffix:
+                paths[name] = domain_path / suffix
+        return paths
+
+    # --- Mapping interface
+    def __getitem__(self, name):
+        try:
+            return self._settings[name]
+        except KeyError:
+            raise KeyError('Setting {} not found in control file {}'.format(name, self.file)) from None
+
+    def __iter__(self):
+        return iter(self._settings)
+
+    def __len__(self):
+        return len(self._settings)
+
+    def __repr__(self):
+        return 'ControlSettings({})'.format(self.file)
+
+    # --- Typed access
+    @property
+    def paths(self):
+        '''Read-only {setting: Path} mapping of all path settings, with 'default' already resolved.'''
+        return self._paths
+
+    def path(self, name):
+        '''Returns a path setting as a Path(), with 'default' resolved to the default location.'''
+        if name not in self._paths:
+            raise KeyError('Setting {} is not a path or has no default location; value is "{}"'.format(name, self[name]))
+        return self._paths[name]
+
+    def default_path(self, suffix):
+        '''Returns 'root_path/domain_[name]/suffix' as a Path().'''
+        return Path(self['root_path']) / ('domain_' + self['domain_name']) / suffix
+
+    def get_int(self, name):
+        return int(self[name])
+
+    def get_float(self, name):
+        return float(self[name])
+
+    def get_bool(self, name):
+        '''Interprets "yes"/"no" flags.'''
+        value = self[name].lower()
+        if value not in ('yes', 'no'):
+            raise ValueError('Setting {} must be "yes" or "no", found "{}"'.format(name, self[name]))
+        return value == 'yes'
+
+    def get_list(self, name, sep=','):
+        return [item.strip() for item in self[name].split(sep)]
+
+    def get_int_list(self, name, sep=','):
+        return [int(item) for item in self.get_list(name, sep)]
+
+    def get_float_list(self, name, sep=','):
+        return [float(item) for item in self.get_list(name, sep)]
+
+
+def load_control(file):
+
+    '''Returns the ControlSettings for a control file. The file is parsed only once per process,
+    unless it is modified on disk in the meantime.'''
+
+    key = os.path.abspath(file)
+    mtime = os.stat(key).st_mtime_ns
+    cached = _cache.get(key)
+    if cached is None or cached[0] != mtime:
+        cached = (mtime, ControlSettings(parse_control_file(key), file=key))
+        _cache[key] = cached
+    return cached[1]
+
+
+def clear_cache():
+    '''Forgets all parsed control files.'''
+    _cache.clear()
+
+
+# --- Drop-in replacements for the per-script functions
+def read_from_control(file, setting):
+    '''Returns a setting's value as a string. Same behaviour as the per-script `read_from_control()`.'''
+    return load_control(file)[setting]
+
+
+def make_default_path(file, suffix):
+    '''Returns 'root_path/domain_[name]/suffix' as a Path(), using the settings in `file`.'''
+    return load_control(file).default_path(suffix)
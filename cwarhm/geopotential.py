@@ -0,0 +1,30 @@
+'''
+Elevation of ERA5 grid cells from the ERA5 geopotential file.
+
+As per the ERA5 docs, geopotential [m^2 s^-2] divided by g = 9.80665 [m s^-2] gives the ERA5 surface elevation
+[m]. Source: https://confluence.ecmwf.int/display/CKB/ERA5%3A+surface+elevation+and+orography
+
+Usage:
+    from cwarhm.geopotential import cell_elevation
+    geo = xr.open_dataset(geoPath / geoName).isel(time=0)
+    shp['elev_m'] = cell_elevation(geo['z'], shp['lat'].values, shp['lon'].values)
+'''
+
+import xarray as xr
+
+# Gravitational acceleration [m s-2]
+G = 9.80665
+
+
+def cell_elevation(z, lat, lon):
+
+    '''Returns the elevation [m] of each grid cell with center coordinates 'lat' and 'lon' (1D arrays of equal
+    length), from geopotential DataArray 'z' with dimensions 'latitude' and 'longitude'. All cells are selected
+    at once: indexing with two arrays that share the dimension 'cell' selects one (latitude, longitude) point per
+    cell, instead of the full lat x lon block. Coordinates must match those of 'z' exactly (KeyError otherwise).
+    If 'z' has other dimensions, the first value along them is used.'''
+
+    cell_lat = xr.DataArray(lat, dims='cell')
+    cell_lon = xr.DataArray(lon, dims='cell')
+    elev = z.sel(latitude=cell_lat, longitude=cell_lon).transpose('cell', ...).values / G
+    return elev.reshape(len(elev), -1)[:,0]
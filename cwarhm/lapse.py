@@ -0,0 +1,45 @@
+'''
+Temperature lapse correction per HRU, based on the intersection of the catchment and forcing shapefiles.
+
+The lapse value of an HRU is the area-weighted sum, over all forcing grid cells that overlap the HRU, of
+lapse_rate * (elevation of the grid cell - mean elevation of the HRU). These values need to be ADDED to
+the forcing temperature. The lapse rate is a global average value (Wallace & Hobbs, 2006, p. 421).
+
+Usage:
+    from cwarhm.lapse import hru_lapse_values
+    lapse_values = hru_lapse_values(intersect_path/intersect_name, 'S_1_HRU_ID', 'S_1_GRU_ID')
+    airtemp_offset = lapse_values.loc[hru_ids].values # in the HRU order of a forcing file
+'''
+
+import pandas as pd
+
+# Environmental lapse rate [K m-1]
+LAPSE_RATE = 0.0065
+
+# Column names in the intersection .csv made by EASYMORE
+CATCHMENT_ELEV = 'S_1_elev_mean' # EASYMORE prefix + name used in catchment+DEM intersection step
+FORCING_ELEV   = 'S_2_elev_m'    # EASYMORE prefix + name used in ERA5 shapefile generation
+WEIGHTS        = 'weight'        # EASYMORE feature
+
+
+def hru_lapse_values(intersect_csv, hru_ID, gru_ID, lapse_rate=LAPSE_RATE):
+
+    '''Returns a pandas Series of the lapse value [K] of each HRU, indexed by HRU ID and sorted by it.
+    'hru_ID' and 'gru_ID' are the names of the HRU and GRU ID columns in the intersection file.'''
+
+    # Only the columns we need; the intersection file can be large
+    columns = list(dict.fromkeys([hru_ID, gru_ID, CATCHMENT_ELEV, FORCING_ELEV, WEIGHTS]))
+    topo_data = pd.read_csv(intersect_csv, usecols=columns)
+
+    # Weighted lapse value of each part of an HRU that overlaps a forcing grid cell
+    topo_data['lapse_values'] = topo_data[WEIGHTS] * lapse_rate * (topo_data[FORCING_ELEV] - topo_data[CATCHMENT_ELEV]) # [K]
+
+    # Find the total lapse value per basin; i.e. sum the individual contributions of each HRU+ERA5-grid overlapping part
+    # Account for the special case where gru_ID and hru_ID share the same column and thus name
+    if gru_ID == hru_ID:
+        lapse_values = topo_data.groupby([hru_ID]).lapse_values.sum().reset_index()
+    else:
+        lapse_values = topo_data.groupby([gru_ID,hru_ID]).lapse_values.sum().reset_index()
+
+    # Sort and set hruID as the index variable
+    return lapse_values.sort_values(hru_ID).set_index(hru_ID)['lapse_values']
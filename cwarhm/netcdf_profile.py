@@ -0,0 +1,94 @@
+'''
+Compression and chunking settings for the forcing .nc files written by the workflow.
+
+SUMMA reads its forcing one time step at a time, for all HRUs at once. The remapping steps read the merged ERA5
+data in the same way: one time step for the full grid. Chunks therefore span the full spatial extent of a file
+and as many time steps as fit in a target chunk size, so that a single time step is never spread over more than
+one chunk. Data are compressed with zlib after a byte shuffle, which works well for smooth float32 fields.
+
+Usage with netCDF4:
+    dest.createVariable(name, 'f4', ('time','latitude','longitude'), fill_value=False,
+                        **variable_settings((n_time, n_lat, n_lon)))
+Usage with xarray:
+    dat.to_netcdf(file, encoding=xarray_encoding(dat))
+Files written by other code (e.g. EASYMORE) can be rewritten with the profile:
+    copy_with_profile(easymore_file, dest_file)
+'''
+
+import numpy as np
+import netCDF4 as nc4
+
+# Compression settings
+ZLIB = True        # compress data with zlib
+COMPLEVEL = 4      # zlib compression level (1-9). Higher levels give little extra compression for much more time
+SHUFFLE = True     # byte shuffle before compression; improves compression of floating point data
+
+# Chunk settings
+TARGET_CHUNK_BYTES = 2**20 # ~1 MB per chunk
+TIME_DIM = 'time'
+
+
+def time_chunk_length(space_shape, itemsize=4, n_time=None):
+
+    '''Number of time steps per chunk: as many full spatial fields as fit in TARGET_CHUNK_BYTES (at least 1).'''
+
+    field_bytes = itemsize * int(np.prod(space_shape)) if len(space_shape) > 0 else itemsize
+    length = max(1, TARGET_CHUNK_BYTES // max(1, field_bytes))
+    if n_time is not None and n_time > 0:
+        length = min(length, n_time)
+    return length
+
+
+def variable_settings(shape, itemsize=4):
+
+    '''Returns netCDF4 createVariable() keyword arguments for a variable with dimensions (time, ...) of the given
+    shape. Use 0 or None as the time length for unlimited dimensions that are still empty.'''
+
+    n_time, space_shape = shape[0], tuple(shape[1:])
+    chunks = (time_chunk_length(space_shape, itemsize, n_time),) + tuple(max(1, n) for n in space_shape)
+    return {'zlib': ZLIB, 'complevel': COMPLEVEL, 'shuffle': SHUFFLE, 'chunksizes': chunks}
+
+
+def xarray_encoding(dat, variables=None):
+
+    '''Returns an xarray 'encoding' dictionary that applies the output profile to all variables in a Dataset
+    that have a time dimension (or to 'variables' only, if given). Other variables keep their current encoding.'''
+
+    encoding = {}
+    for name in (variables if variables is not None else dat.data_vars):
+        var = dat[name]
+        if TIME_DIM not in var.dims or var.dims[0] != TIME_DIM:
+            continue
+        settings = variable_settings(var.shape, var.dtype.itemsize)
+        encoding[name] = {'zlib': settings['zlib'], 'complevel': settings['complevel'],
+                          'shuffle': settings['shuffle'], 'chunksizes': settings['chunksizes']}
+    return encoding
+
+
+def copy_with_profile(source, dest, slab_bytes=2**26):
+
+    '''Copies netCDF file 'source' to 'dest' (NETCDF4 format), applying the profile to all variables with a time
+    dimension first and at least one other dimension. Stored values, fill values and attributes are copied as
+    they are. Data are copied in slabs of time steps of about 'slab_bytes' per variable.'''
+
+    with nc4.Dataset(source) as src, nc4.Dataset(dest, 'w', format='NETCDF4') as des:
+        src.set_auto_maskandscale(False)
+        des.set_auto_maskandscale(False)
+        des.setncatts({attr: src.getncattr(attr) for attr in src.ncattrs()})
+        for name, dimension in src.dimensions.items():
+            des.createDimension(name, None if dimension.isunlimited() else len(dimension))
+
+        for name, variable in src.variables.items():
+            in_profile = len(variable.dimensions) > 1 and variable.dimensions[0] == TIME_DIM
+            fill_value = variable.getncattr('_FillValue') if '_FillValue' in variable.ncattrs() else False
+            settings = variable_settings(variable.shape, variable.dtype.itemsize) if in_profile else {}
+            des.createVariable(name, variable.datatype, variable.dimensions, fill_value=fill_value, **settings)
+            des[name].setncatts({attr: variable.getncattr(attr) for attr in variable.ncattrs() if attr != '_FillValue'})
+            if not in_profile:
+                des[name][:] = variable[:]
+                continue
+            field_bytes = variable.dtype.itemsize * int(np.prod(variable.shape[1:]))
+            time_slab = max(1, slab_bytes // max(1, field_bytes))
+            for t in range(0, variable.shape[0], time_slab):
+                values = variable[t:t+time_slab]
+                des[name][t:t+len(values)] = values
@@ -0,0 +1,47 @@
+'''
+Number of processes and job-array shards for workflow steps that process many independent files.
+
+By default, the number of processes is the number of CPUs available to a SLURM job (1 outside of SLURM) and
+the shard is set by the task ID of a SLURM job array (one shard per array task; all files outside of a job
+array). Different values can be given as command line arguments:
+    python [script] [number of processes] [shard index (0-based)] [number of shards]
+
+Usage:
+    from cwarhm.parallel import process_count, shard_of
+    ncpus = process_count(sys.argv)
+    shard_files, shard, shards = shard_of(forcing_files, sys.argv)
+'''
+
+import os
+
+
+def process_count(argv, position=1):
+
+    '''Returns the number of processes: argv[position] if given, otherwise $SLURM_CPUS_PER_TASK, otherwise 1.'''
+
+    if len(argv) > position:
+        return int(argv[position])
+    return int(os.environ.get('SLURM_CPUS_PER_TASK',default=1))
+
+
+def shard_of(files, argv):
+
+    '''Splits 'files' into shards of consecutive files and returns (files in this shard, shard index, number of
+    shards). The shard is set by argv[2] and argv[3] if given, otherwise by the task ID of a SLURM job array,
+    otherwise all files are in a single shard.'''
+
+    if len(argv) > 3:
+        shard  = int(argv[2])
+        shards = int(argv[3])
+    elif 'SLURM_ARRAY_TASK_ID' in os.environ and 'SLURM_ARRAY_TASK_COUNT' in os.environ:
+        shard  = int(os.environ['SLURM_ARRAY_TASK_ID']) - int(os.environ.get('SLURM_ARRAY_TASK_MIN',default=0))
+        shards = int(os.environ['SLURM_ARRAY_TASK_COUNT'])
+    else:
+        shard  = 0
+        shards = 1
+    if not 0 <= shard < shards:
+        raise ValueError('Shard index {} is not in the range 0 to {}'.format(shard, shards-1))
+
+    start = len(files) * shard // shards
+    end   = len(files) * (shard+1) // shards
+    return files[start:end], shard, shards
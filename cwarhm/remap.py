@@ -0,0 +1,169 @@
+'''
+Area-weighted remapping of gridded forcing data onto HRUs, using the remapping file made by EASYMORE.
+
+EASYMORE's `nc_remapper()` re-reads the remapping .csv file for every forcing file it processes and computes
+the weighted average of each HRU with a pandas groupby for every individual time step. Here, the remapping
+file is read once into a sparse (HRU x grid cell) weight matrix. Remapping a block of time steps of one
+variable is then a single sparse matrix multiplication. Only the part of the source grid that contains cells
+with a non-zero weight is read from the forcing files.
+
+The output files are laid out as EASYMORE's: dimensions (time, hru), the same file names, HRU order (by the
+'order_t' column in the remapping file), variables and attributes. Data variables are compressed and chunked
+according to the output profile in cwarhm/netcdf_profile.py.
+
+Temperature lapse values and SUMMA's 'data_step' can be added while remapping, so that SUMMA-ready forcing can
+be made from the merged forcing in a single pass.
+
+Usage:
+    from cwarhm.remap import Remapper, remapped_file_name
+    remapper = Remapper(intersect_path / (domain + '_remapping.csv'))
+    target = forcing_basin_path / remapped_file_name(domain, source)
+    remapper.remap_file(source, target, ['airpres','airtemp'], case_name=domain)
+'''
+
+import os
+import time
+import numpy as np
+import pandas as pd
+import netCDF4 as nc4
+from scipy import sparse
+from .netcdf_profile import variable_settings
+
+# Size of the source data read in one go, per variable [bytes]
+SLAB_BYTES = 2**26 # 64 MB
+
+
+def remapped_file_name(case_name, source_nc, time_name='time'):
+
+    '''Returns the name EASYMORE gives the remapped version of 'source_nc': [case]_remapped_[first time step].nc'''
+
+    with nc4.Dataset(source_nc) as src:
+        time_var = src.variables[time_name]
+        first = nc4.num2date(time_var[0], units=time_var.units, calendar=getattr(time_var, 'calendar', 'standard'))
+    return case_name + '_remapped_' + first.strftime('%Y-%m-%d-%H-%M-%S') + '.nc'
+
+
+class Remapper:
+
+    '''Sparse weight matrix that maps grid cells of a (time, latitude, longitude) forcing grid onto HRUs.
+
+    The remapping file must contain the EASYMORE columns 'ID_t', 'lat_t', 'lon_t' and 'order_t' (target
+    HRUs), 'rows' and 'cols' (indices of the source grid cell in the latitude and longitude dimensions)
+    and 'weight' (area fraction of the HRU covered by the source cell).'''
+
+    def __init__(self, remap_csv):
+
+        remap = pd.read_csv(remap_csv)
+
+        # Target HRUs, in the order EASYMORE writes them
+        targets = remap.groupby('order_t', sort=True)[['ID_t','lat_t','lon_t']].first()
+        self.hru_id  = targets['ID_t'].values
+        self.hru_lat = targets['lat_t'].values
+        self.hru_lon = targets['lon_t'].values
+        hru_index = np.searchsorted(targets.index.values, remap['order_t'].values)
+
+        # Source cells with a non-zero weight, and the smallest window of the grid that contains them all
+        rows = remap['rows'].values.astype(int)
+        cols = remap['cols'].values.astype(int)
+        self.window = (slice(rows.min(), rows.max()+1), slice(cols.min(), cols.max()+1))
+        n_cols = cols.max() - cols.min() + 1
+        cells, cell_index = np.unique((rows - rows.min()) * n_cols + (cols - cols.min()), return_inverse=True)
+        self.cell_rows, self.cell_cols = np.divmod(cells, n_cols) # indices inside the window
+
+        # Weights: duplicate (HRU, cell) pairs are summed, as in EASYMORE
+        self.weights = sparse.csr_matrix((remap['weight'].values, (hru_index, cell_index)),
+                                         shape=(len(self.hru_id), len(cells)))
+
+    @property
+    def n_hru(self):
+        return self.weights.shape[0]
+
+    def apply(self, values, offset=None):
+
+        '''Remaps a (time, window rows, window cols) block of source data to (time, hru). Missing values
+        (masked or NaN) count as zero, which matches EASYMORE's summation of weighted values. 'offset' is
+        an optional per-HRU value that is added to the remapped values of every time step.'''
+
+        values = np.ma.filled(values, np.nan)[:, self.cell_rows, self.cell_cols]
+        values = np.nan_to_num(values, copy=False, nan=0.0)
+        remapped = (self.weights @ values.T).T
+        if offset is not None:
+            remapped += offset
+        return remapped
+
+    def slab_length(self, itemsize=4):
+
+        '''Number of time steps to read at once, so that a block of source data is about SLAB_BYTES.'''
+
+        window_bytes = itemsize * (self.window[0].stop - self.window[0].start) * (self.window[1].stop - self.window[1].start)
+        return max(1, SLAB_BYTES // window_bytes)
+
+    def remap_file(self, source_nc, target_nc, var_names, time_name='time', dim_name='hru', id_name='hruId',
+                   fill_value=-9999, case_name='', author_name='', license='', offsets=None, data_step=None):
+
+        '''Writes the remapped 'var_names' from 'source_nc' to 'target_nc', as (time, hru) float32 variables.
+        The file is written under a temporary name first and only renamed to 'target_nc' once it is complete.
+
+        'offsets' optionally maps variable names to per-HRU values (in the order of 'hru_id') that are added
+        to the remapped data, e.g. temperature lapse values. If 'data_step' [s] is given, it is stored as the
+        scalar variable 'data_step' that SUMMA needs.'''
+
+        offsets = {} if offsets is None else offsets
+
+        target_temp = str(target_nc) + '.part'
+        with nc4.Dataset(source_nc) as src, nc4.Dataset(target_temp, 'w', format='NETCDF4') as des:
+
+            # Dimensions
+            src_time = src.variables[time_name]
+            n_time = len(src_time)
+            des.createDimension(dim_name, self.n_hru)
+            des.createDimension('time', None)
+
+            # Time, as EASYMORE: float times stay 'f8', integer times become 'i4'
+            time_varid = des.createVariable('time', 'i4' if 'int' in str(src_time.dtype) else 'f8', ('time',))
+            time_varid.long_name = time_name
+            time_varid.units = src_time.units
+            time_varid.calendar = getattr(src_time, 'calendar', 'standard')
+            time_varid.standard_name = time_name
+            time_varid.axis = 'T'
+            time_varid[:] = src_time[:]
+
+            # HRU ID and location
+            for name, values, long_name, units in [('latitude', self.hru_lat, 'latitude', 'degrees_north'),
+                                                   ('longitude', self.hru_lon, 'longitude', 'degrees_east'),
+                                                   (id_name, self.hru_id, 'shape ID', '1')]:
+                varid = des.createVariable(name, 'f8', (dim_name,))
+                varid.long_name = long_name
+                varid.units = units
+                if name != id_name:
+                    varid.standard_name = name
+                varid[:] = values
+
+            # General attributes
+            des.Conventions = 'CF-1.6'
+            des.Author = 'The data were written by ' + author_name
+            des.License = license
+            des.History = 'Created ' + time.ctime(time.time())
+            des.Source = 'Case: ' + case_name + '; remapped with cwarhm/remap.py using a remapping file made by EASYMORE (https://github.com/ShervanGharari/EASYMORE).'
+
+            # Forcing variables, one slab of time steps at a time
+            slab = self.slab_length()
+            for name in var_names:
+                src_var = src.variables[name]
+                varid = des.createVariable(name, 'f4', ('time', dim_name), fill_value=fill_value,
+                                           **variable_settings((n_time, self.n_hru)))
+                for attr in ['long_name', 'units']:
+                    if attr in src_var.ncattrs():
+                        varid.setncattr(attr, src_var.getncattr(attr))
+                for t in range(0, n_time, slab):
+                    t_end = min(t+slab, n_time) # 'time' is unlimited, so we need to be exact
+                    varid[t:t_end] = self.apply(src_var[t:t_end, self.window[0], self.window[1]], offsets.get(name))
+
+            # Time step size
+            if data_step is not None:
+                varid = des.createVariable('data_step', 'i8', ())
+                varid.long_name = 'data step length in seconds'
+                varid.units = 's'
+                varid.assignValue(data_step)
+
+        os.replace(target_temp, target_nc)
@@ -0,0 +1,388 @@
+'''
+Runs the workflow steps in dependency order from a single Python process, skipping steps that are up to date.
+
+Each workflow script is a step with the upstream steps it depends on and the control file path settings it
+writes to. The control file settings a step reads are found by scanning the script itself, so they do not
+need to be listed here. A step's hash combines:
+- the contents of the script;
+- the values of the control file settings the script reads (plus 'root_path' and 'domain_name');
+- the contents of any user-provided input files listed for the step;
+- the hashes of all upstream steps.
+After a step completes successfully its hash is stored in 'root_path/domain_[name]/_workflow_runner'. A step
+is re-run only if its hash changed or one of its outputs is missing. Changing e.g. 'settings_summa_trialParam_1'
+thus only re-runs '1_create_trialParams.py' and the steps that depend on it.
+
+Each script is run as a separate process (Python scripts with the same Python interpreter as the runner, Bash
+scripts with `bash`), from inside its own folder because the scripts use relative paths to find the control file.
+Separate processes are needed because many scripts start worker processes with `multiprocessing`, which only
+works from a script that is run as the main program.
+
+Some steps are alternatives to one or more other steps (e.g. '1_2_3_find_HRU_elevation_soil_and_land_classes.py'
+instead of the three separate topo scripts). Alternatives are only run when selected with '--use' or given as a
+target; they then take the place of the steps they replace, including as upstream step of later steps.
+
+Not included: `1_folder_prep/make_folder_structure.py` (it overwrites `control_active.txt`, which this runner
+reads) and `6_model_runs/1_run_summa_as_array.sh` (needs GRU arguments; use the scheduler instead).
+
+Usage (from the repository root):
+    python -m cwarhm.runner --list                    # show all steps and whether they are up to date
+    python -m cwarhm.runner                           # run everything that is out of date
+    python -m cwarhm.runner 1_create_trialParams.py   # run this step and any out-of-date upstream steps
+    python -m cwarhm.runner --dry-run                 # only show what would be run
+    python -m cwarhm.runner --force 1_create_coldState.py
+    python -m cwarhm.runner --use 2_3_remap_lapse_and_datastep_in_one_pass.py  # run everything, with this alternative
+'''
+
+import re
+import sys
+import json
+import time
+import hashlib
+import argparse
+import subprocess
+from pathlib import Path
+from datetime import datetime
+
+# Make 'cwarhm' importable when this file is run directly
+repo_path = Path(__file__).resolve().parent.parent
+if str(repo_path) not in sys.path:
+    sys.path.insert(0, str(repo_path))
+from cwarhm.control import load_control
+
+# Folder inside the domain folder where the step hashes are stored
+stamp_folder = '_workflow_runner'
+
+
+class Step:
+
+    '''A single workflow script, the steps it requires, the path settings it writes to and, for alternative
+    steps, the steps it can be used instead of.'''
+
+    def __init__(self, script, requires=(), outputs=(), files=(), replaces=()):
+        self.script = script                # relative to the repository root
+        self.requires = tuple(requires)     # names of upstream steps
+        self.outputs = tuple(outputs)       # path settings that must exist after the step ran
+        self.files = tuple(files)           # (path setting, name setting) of user-provided inputs to hash
+        self.replaces = tuple(replaces)     # names of the steps this alternative step is used instead of
+        self.name = Path(script).name
+
+    def __repr__(self):
+        return 'Step({})'.format(self.script)
+
+
+# --- Workflow definition
+STEPS = [
+    # Installs
+    Step('2_install/1a_clone_summa.sh', outputs=['install_path_summa']),
+    Step('2_install/1b_compile_summa.sh', requires=['1a_clone_summa.sh'], outputs=['install_path_summa']),
+    Step('2_install/2a_clone_mizuroute.sh', outputs=['install_path_mizuroute']),
+    Step('2_install/2b_compile_mizuroute.sh', requires=['2a_clone_mizuroute.sh'], outputs=['install_path_mizuroute']),
+
+    # Forcing
+    Step('3a_forcing/1a_download_forcing/run_download_ERA5_surfaceLevel.sh', outputs=['forcing_raw_path']),
+    Step('3a_forcing/1a_download_forcing/run_download_ERA5_pressureLevel.sh', outputs=['forcing_raw_path']),
+    Step('3a_forcing/1b_download_geopotential/download_ERA5_geopotential.py', outputs=['forcing_geo_path']),
+    Step('3a_forcing/2_merge_forcing/ERA5_surface_and_pressure_level_combiner.py',
+         requires=['run_download_ERA5_surfaceLevel.sh', 'run_download_ERA5_pressureLevel.sh'],
+         outputs=['forcing_merged_path']),
+    Step('3a_forcing/3_create_shapefile/create_ERA5_shapefile.py',
+         requires=['ERA5_surface_and_pressure_level_combiner.py', 'download_ERA5_geopotential.py'],
+         outputs=['forcing_shape_path']),
+
+    # Parameters - DEM
+    Step('3b_parameters/MERIT_Hydro_DEM/1_download/download_merit_hydro_adjusted_elevation.py', outputs=['parameter_dem_raw_path']),
+    Step('3b_parameters/MERIT_Hydro_DEM/2_unpack/unpack_merit_hydro_dem.sh',
+         requires=['download_merit_hydro_adjusted_elevation.py'], outputs=['parameter_dem_unpack_path']),
+    Step('3b_parameters/MERIT_Hydro_DEM/3_create_vrt/make_merit_dem_vrt.sh',
+         requires=['unpack_merit_hydro_dem.sh'], outputs=['parameter_dem_vrt1_path']),
+    Step('3b_parameters/MERIT_Hydro_DEM/4_specify_subdomain/specify_subdomain.sh',
+         requires=['make_merit_dem_vrt.sh'], outputs=['parameter_dem_vrt2_path']),
+    Step('3b_parameters/MERIT_Hydro_DEM/5_convert_to_tif/convert_vrt_to_tif.sh',
+         requires=['3b_parameters/MERIT_Hydro_DEM/4_specify_subdomain/specify_subdomain.sh'], outputs=['parameter_dem_tif_path']),
+
+    # Parameters - land
+    Step('3b_parameters/MODIS_MCD12Q1_V6/1_download/download_modis_mcd12q1_v6.py', outputs=['parameter_land_raw_path']),
+    Step('3b_parameters/MODIS_MCD12Q1_V6/2_create_vrt/make_vrt_per_year.sh',
+         requires=['download_modis_mcd12q1_v6.py'], outputs=['parameter_land_vrt1_path']),
+    Step('3b_parameters/MODIS_MCD12Q1_V6/3_reproject_vrt/reproject_vrt.sh',
+         requires=['make_vrt_per_year.sh'], outputs=['parameter_land_vrt2_path']),
+    Step('3b_parameters/MODIS_MCD12Q1_V6/4_specify_subdomain/specify_subdomain.sh',
+         requires=['reproject_vrt.sh'], outputs=['parameter_land_vrt3_path']),
+    Step('3b_parameters/MODIS_MCD12Q1_V6/5_multiband_vrt/create_multiband_vrt.sh',
+         requires=['3b_parameters/MODIS_MCD12Q1_V6/4_specify_subdomain/specify_subdomain.sh'], outputs=['parameter_land_vrt4_path']),
+    Step('3b_parameters/MODIS_MCD12Q1_V6/6_convert_to_tif/convert_vrt_to_tif.sh',
+         requires=['create_multiband_vrt.sh'], outputs=['parameter_land_tif_path']),
+    Step('3b_parameters/MODIS_MCD12Q1_V6/7_find_mode_land_class/find_mode_landclass.py',
+         requires=['3b_parameters/MODIS_MCD12Q1_V6/6_convert_to_tif/convert_vrt_to_tif.sh'], outputs=['parameter_land_mode_path']),
+
+    # Parameters - soil
+    Step('3b_parameters/SOILGRIDS/1_download/download_soilclass_global_map.py', outputs=['parameter_soil_raw_path']),
+    Step('3b_parameters/SOILGRIDS/2_extract_domain/extract_domain.py',
+         requires=['download_soilclass_global_map.py'], outputs=['parameter_soil_domain_path']),
+
+    # Catchment shapefile
+    Step('4a_sort_shape/1_sort_catchment_shape.py', outputs=['catchment_shp_path']),
+
+    # Remapping - geospatial data
+    Step('4b_remapping/1_topo/1_find_HRU_elevation.py',
+         requires=['1_sort_catchment_shape.py', '3b_parameters/MERIT_Hydro_DEM/5_convert_to_tif/convert_vrt_to_tif.sh'],
+         outputs=['intersect_dem_path']),
+    Step('4b_remapping/1_topo/2_find_HRU_soil_classes.py',
+         requires=['1_sort_catchment_shape.py', 'extract_domain.py'], outputs=['intersect_soil_path']),
+    Step('4b_remapping/1_topo/3_find_HRU_land_classes.py',
+         requires=['1_sort_catchment_shape.py', 'find_mode_landclass.py'], outputs=['intersect_land_path']),
+    Step('4b_remapping/1_topo/1_2_3_find_HRU_elevation_soil_and_land_classes.py',
+         requires=['1_sort_catchment_shape.py', '3b_parameters/MERIT_Hydro_DEM/5_convert_to_tif/convert_vrt_to_tif.sh',
+                   'extract_domain.py', 'find_mode_landclass.py'],
+         outputs=['intersect_dem_path', 'intersect_soil_path', 'intersect_land_path'],
+         replaces=['1_find_HRU_elevation.py', '2_find_HRU_soil_classes.py', '3_find_HRU_land_classes.py']),
+
+    # Remapping - forcing
+    Step('4b_remapping/2_forcing/1_make_one_weighted_forcing_file.py',
+         requires=['1_find_HRU_elevation.py', 'create_ERA5_shapefile.py', 'ERA5_surface_and_pressure_level_combiner.py'],
+         outputs=['intersect_forcing_path', 'forcing_basin_avg_path']),
+    Step('4b_remapping/2_forcing/2_make_all_weighted_forcing_files.py',
+         requires=['1_make_one_weighted_forcing_file.py'], outputs=['forcing_basin_avg_path']),
+    Step('4b_remapping/2_forcing/3_temperature_lapsing_and_datastep.py',
+         requires=['2_make_all_weighted_forcing_files.py'], outputs=['forcing_summa_path']),
+    Step('4b_remapping/2_forcing/2_3_remap_lapse_and_datastep_in_one_pass.py',
+         requires=['1_make_one_weighted_forcing_file.py'], outputs=['forcing_summa_path'],
+         replaces=['2_make_all_weighted_forcing_files.py', '3_temperature_lapsing_and_datastep.py']),
+
+    # SUMMA inputs
+    Step('5_model_input/SUMMA/1a_copy_base_settings/1_copy_base_settings.py', outputs=['settings_summa_path']),
+    Step('5_model_input/SUMMA/1b_file_manager/1_create_file_manager.py',
+         requires=['5_model_input/SUMMA/1a_copy_base_settings/1_copy_base_settings.py'], outputs=['settings_summa_path']),
+    Step('5_model_input/SUMMA/1c_forcing_file_list/1_create_forcing_file_list.py',
+         requires=['5_model_input/SUMMA/1a_copy_base_settings/1_copy_base_settings.py', '3_temperature_lapsing_and_datastep.py'],
+         outputs=['settings_summa_path']),
+    Step('5_model_input/SUMMA/1d_initial_conditions/1_create_coldState.py',
+         requires=['5_model_input/SUMMA/1a_copy_base_settings/1_copy_base_settings.py', '3_temperature_lapsing_and_datastep.py'],
+         outputs=['settings_summa_path']),
+    Step('5_model_input/SUMMA/1e_trial_parameters/1_create_trialParams.py',
+         requires=['5_model_input/SUMMA/1a_copy_base_settings/1_copy_base_settings.py', '3_temperature_lapsing_and_datastep.py'],
+         outputs=['settings_summa_path']),
+    Step('5_model_input/SUMMA/1f_attributes/1_initialize_attributes_nc.py',
+         requires=['5_model_input/SUMMA/1a_copy_base_settings/1_copy_base_settings.py', '3_temperature_lapsing_and_datastep.py'],
+         outputs=['settings_summa_path']),
+    Step('5_model_input/SUMMA/1f_attributes/2a_insert_soilclass_from_hist_into_attributes.py',
+         requires=['1_initialize_attributes_nc.py', '2_find_HRU_soil_classes.py'], outputs=['settings_summa_path']),
+    Step('5_model_input/SUMMA/1f_attributes/2b_insert_landclass_from_hist_into_attributes.py',
+         requires=['2a_insert_soilclass_from_hist_into_attributes.py', '3_find_HRU_land_classes.py'], outputs=['settings_summa_path']),
+    Step('5_model_input/SUMMA/1f_attributes/2c_insert_elevation_into_attributes.py',
+         requires=['2b_insert_landclass_from_hist_into_attributes.py', '1_find_HRU_elevation.py'], outputs=['settings_summa_path']),
+
+    # mizuRoute inputs
+    Step('5_model_input/mizuRoute/1a_copy_base_settings/1_copy_base_settings.py', outputs=['settings_mizu_path']),
+    Step('5_model_input/mizuRoute/1b_network_topology_file/1_create_network_topology_file.py',
+         requires=['5_model_input/mizuRoute/1a_copy_base_settings/1_copy_base_settings.py'], outputs=['settings_mizu_path'],
+         files=[('river_network_shp_path', 'river_network_shp_name'), ('river_basin_shp_path', 'river_basin_shp_name')]),
+    Step('5_model_input/mizuRoute/1c_optional_remapping_file/1_remap_summa_catchments_to_routing.py',
+         requires=['5_model_input/mizuRoute/1a_copy_base_settings/1_copy_base_settings.py', '1_sort_catchment_shape.py'],
+         outputs=['settings_mizu_path']),
+    Step('5_model_input/mizuRoute/1d_control_file/1_create_control_file.py',
+         requires=['5_model_input/mizuRoute/1a_copy_base_settings/1_copy_base_settings.py'], outputs=['settings_mizu_path']),
+
+    # Model runs
+    Step('6_model_runs/1_run_summa.sh',
+         requires=['1b_compile_summa.sh', '1_create_file_manager.py', '1_create_forcing_file_list.py', '1_create_coldState.py',
+                   '1_create_trialParams.py', '2c_insert_elevation_into_attributes.py'],
+         outputs=['experiment_output_summa']),
+    Step('6_model_runs/2_run_mizuRoute.sh',
+         requires=['2b_compile_mizuroute.sh', '1_run_summa.sh', '1_create_network_topology_file.py',
+                   '1_remap_summa_catchments_to_routing.py', '1_create_control_file.py'],
+         outputs=['experiment_output_mizuRoute']),
+]
+
+
+# --- Functions
+def find_step(steps, name):
+
+    '''Returns the step that matches 'name'. Names can be the script path relative to the repository root,
+    or the script file name if that is unique.'''
+
+    matches = [step for step in steps if name in (step.script, step.name)]
+    if len(matches) != 1:
+        options = ', '.join(step.script for step in matches) if matches else 'none'
+        raise KeyError('Step name {} is not unique or does not exist. Matches: {}'.format(name, options))
+    return matches[0]
+
+
+def use_alternatives(steps, use=()):
+
+    '''Returns the steps with the alternative steps in 'use' in place of the steps they replace. Steps that
+    required a replaced step require the alternative instead. Alternative steps not in 'use' are left out.'''
+
+    chosen = [find_step(steps, name) for name in use]
+    for step in chosen:
+        if not step.replaces:
+            raise KeyError('Step {} is not an alternative to other steps'.format(step.script))
+    replaced = {find_step(steps, name).script: step.script for step in chosen for name in step.replaces}
+
+    result = []
+    for step in steps:
+        if (step.replaces and step not in chosen) or step.script in replaced:
+            continue
+        requires = [replaced.get(find_step(steps, name).script, name) for name in step.requires]
+        result.append(Step(step.script, dict.fromkeys(requires), step.outputs, step.files, step.replaces))
+    return result
+
+
+def settings_used_by(script, control):
+
+    '''Finds the control file settings a script reads by looking for their names in the script source.
+    Settings constructed in f-strings (e.g. f'settings_summa_trialParam_{ii+1}') match on their prefix.'''
+
+    source = (repo_path / script).read_text()
+    used = {'root_path', 'domain_name'} # needed for every default path
+    for name in control:
+        if re.search(r'''['"]''' + re.escape(name) + r'''['"]''', source):
+            used.add(name)
+    for prefix in re.findall(r'''f['"](\w+)\{''', source):
+        used.update(name for name in control if name.startswith(prefix))
+    return sorted(used)
+
+
+def hash_file(file, block_size=2**20):
+    sha = hashlib.sha256()
+    with open(file, 'rb') as src:
+        for block in iter(lambda: src.read(block_size), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def compute_hashes(steps, control):
+
+    '''Returns {step name: hash} for all steps. Steps are expected in dependency order.'''
+
+    hashes = {}
+    for step in steps:
+        sha = hashlib.sha256()
+        sha.update(hash_file(repo_path / step.script).encode())
+        for name in settings_used_by(step.script, control):
+            sha.update('{}|{}\n'.format(name, control[name]).encode())
+        for path_name, file_name in step.files:
+            file = control.path(path_name) / control[file_name]
+            sha.update((hash_file(file) if file.is_file() else 'missing').encode())
+        for upstream in step.requires:
+            sha.update(hashes[find_step(steps, upstream).script].encode())
+        hashes[step.script] = sha.hexdigest()
+    return hashes
+
+
+def stamp_file(step, control):
+    return control.default_path(stamp_folder) / (step.script.replace('/', '__') + '.json')
+
+
+def is_up_to_date(step, step_hash, control):
+
+    '''True if the step ran before with the same hash and all its outputs still exist.'''
+
+    file = stamp_file(step, control)
+    if not file.is_file():
+        return False
+    with open(file) as src:
+        stamp = json.load(src)
+    if stamp.get('hash') != step_hash:
+        return False
+    return all(control.path(name).exists() for name in step.outputs)
+
+
+def write_stamp(step, step_hash, control, duration):
+    file = stamp_file(step, control)
+    file.parent.mkdir(parents=True, exist_ok=True)
+    with open(file, 'w') as dest:
+        json.dump({'script': step.script, 'hash': step_hash, 'seconds': round(duration, 1),
+                   'finished': datetime.now().strftime('%Y/%m/%d %H:%M:%S')}, dest, indent=1)
+
+
+def run_script(script):
+
+    '''Runs a single workflow script as a separate process, from inside its own folder.'''
+
+    file = repo_path / script
+    interpreter = sys.executable if file.suffix == '.py' else 'bash'
+    result = subprocess.run([interpreter, file.name], cwd=file.parent)
+    if result.returncode != 0:
+        raise RuntimeError('{} exited with code {}'.format(script, result.returncode))
+
+
+def select_steps(steps, targets):
+
+    '''Returns the targets and all their upstream steps, in workflow order. No targets means all steps.'''
+
+    if not targets:
+        return list(steps)
+    needed = set()
+    todo = [find_step(steps, target) for target in targets]
+    while todo:
+        step = todo.pop()
+        if step.script not in needed:
+            needed.add(step.script)
+            todo += [find_step(steps, name) for name in step.requires]
+    return [step for step in steps if step.script in needed]
+
+
+def run(targets=(), control_file=None, force=(), dry_run=False, use=(), steps=STEPS):
+
+    '''Runs all out-of-date steps needed for 'targets'. Steps in 'force' are run regardless of their state,
+    as are all steps downstream of a step that is run. Alternative steps in 'use' or 'targets' are run instead
+    of the steps they replace.'''
+
+    if control_file is None:
+        control_file = repo_path / '0_control_files' / 'control_active.txt'
+    control = load_control(control_file)
+    use = list(use) + [name for name in targets if find_step(steps, name).replaces]
+    steps = use_alternatives(steps, use)
+    hashes = compute_hashes(steps, control)
+    forced = {find_step(steps, name).script for name in force}
+
+    done = set()
+    for step in select_steps(steps, targets):
+
+        # Downstream steps of anything we (re)run are out of date as well
+        upstream_ran = any(find_step(steps, name).script in done for name in step.requires)
+        if step.script not in forced and not upstream_ran and is_up_to_date(step, hashes[step.script], control):
+            print('Up to date:  {}'.format(step.script))
+            continue
+
+        print('Running:     {}'.format(step.script))
+        done.add(step.script)
+        if dry_run:
+            continue
+        start = time.time()
+        run_script(step.script)
+        write_stamp(step, hashes[step.script], control, time.time() - start)
+        print('Finished:    {} in {:.1f} s'.format(step.script, time.time() - start))
+
+    return done
+
+
+def list_steps(control_file=None, use=(), steps=STEPS):
+    if control_file is None:
+        control_file = repo_path / '0_control_files' / 'control_active.txt'
+    control = load_control(control_file)
+    workflow = use_alternatives(steps, use)
+    hashes = compute_hashes(workflow, control)
+    for step in workflow:
+        state = 'up to date' if is_up_to_date(step, hashes[step.script], control) else 'out of date'
+        print('{:12s} {}'.format(state, step.script))
+    for step in steps:
+        if step.replaces and step.script not in hashes:
+            print('{:12s} {} (instead of {})'.format('alternative', step.script, ', '.join(step.replaces)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the CWARHM workflow steps that are out of date.')
+    parser.add_argument('targets', nargs='*', help='steps to run (with their upstream steps); default: all')
+    parser.add_argument('--control', default=None, help='control file; default: 0_control_files/control_active.txt')
+    parser.add_argument('--force', nargs='+', default=[], help='steps to re-run even if they are up to date')
+    parser.add_argument('--dry-run', action='store_true', help='only print which steps would run')
+    parser.add_argument('--list', action='store_true', help='print all steps and their state')
+    parser.add_argument('--use', nargs='+', default=[], help='alternative steps to run instead of the steps they replace')
+    args = parser.parse_args()
+
+    if args.list:
+        list_steps(args.control, args.use)
+    else:
+        run(args.targets, args.control, args.force, args.dry_run, args.use)
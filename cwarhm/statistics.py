@@ -0,0 +1,155 @@
+'''
+Statistics of long timeseries, computed in a single pass over blocks of time steps.
+
+Each statistic is kept up to date as blocks of data come in, so that memory use depends on the number of
+elements (e.g. GRUs) and not on the length of the timeseries. Missing values (NaN) are skipped.
+
+Available statistics:
+- 'mean', 'min', 'max', 'sum', 'count';
+- 'std': population standard deviation (as xarray's std()), from running means and sums of squared deviations;
+- 'qNN': the NN-th percentile, e.g. 'q50' for the median or 'q99.9'. Percentiles are found from a sample of
+  the time steps (the same random sample of at most 'sample_size' time steps for all elements and percentiles),
+  which is kept in memory as float32 ('sample_bytes'; 4 bytes per sampled time step per element). They are exact
+  (to float32 precision) for timeseries of up to 'sample_size' time steps, and estimates otherwise: with the
+  default sample of 10,000 time steps, the estimated 90th percentile typically lies between the 89.4th and 90.6th
+  percentiles of the full timeseries;
+- 'monthly_mean': mean of each calendar month (January to December), as an extra leading dimension of size 12.
+
+Usage:
+    from cwarhm.statistics import StreamingStatistics
+    stats = StreamingStatistics(['mean','std','q90','monthly_mean'], shape=(n_gru,), n_time=n_time)
+    for block, months in blocks: # block: [time, gru] array, months: calendar month (1-12) of each time step
+        stats.update(block, months)
+    results = stats.results() # {'mean': [gru] array, ..., 'monthly_mean': [12, gru] array}
+'''
+
+import warnings
+import numpy as np
+
+# Statistics other than percentiles ('qNN')
+STATISTICS = ['mean', 'min', 'max', 'sum', 'count', 'std', 'monthly_mean']
+
+
+def percentile_of(statistic):
+
+    '''Returns the fraction (0-1) of a percentile statistic such as 'q90', or None for other statistics.'''
+
+    if statistic.startswith('q'):
+        try:
+            return float(statistic[1:]) / 100
+        except ValueError:
+            return None
+    return None
+
+
+class StreamingStatistics:
+
+    '''Running statistics over time of an array of elements with the given 'shape' (e.g. (n_gru,)). Percentiles
+    need the total number of time steps ('n_time'), to draw the sample of time steps.'''
+
+    def __init__(self, statistics, shape, n_time=None, sample_size=10000, seed=0):
+
+        for statistic in statistics:
+            if statistic not in STATISTICS and percentile_of(statistic) is None:
+                raise ValueError('Unknown statistic {}; use one of {} or qNN (percentile NN)'.format(statistic, STATISTICS))
+        self.statistics = list(statistics)
+        self.shape = tuple(shape)
+        n = int(np.prod(self.shape))
+        self.count = np.zeros(n, dtype=np.int64)
+        self.sum = np.zeros(n)
+        self.mean = np.zeros(n)
+        self.m2 = np.zeros(n) # sum of squared deviations from the mean
+        self.min = np.full(n, np.nan)
+        self.max = np.full(n, np.nan)
+        self.month_sum = np.zeros((12, n))
+        self.month_count = np.zeros((12, n), dtype=np.int64)
+        self.percentiles = {s: percentile_of(s) for s in self.statistics if percentile_of(s) is not None}
+
+        # Random sample of time steps for the percentiles
+        self.time = 0 # number of time steps seen so far
+        if self.percentiles:
+            if n_time is None:
+                raise ValueError('Percentiles need the number of time steps (n_time)')
+            if n_time <= sample_size:
+                self.sample_steps = np.arange(n_time)
+            else:
+                self.sample_steps = np.sort(np.random.default_rng(seed).choice(n_time, sample_size, replace=False))
+            self.sample = np.full((len(self.sample_steps), n), np.nan, dtype=np.float32)
+
+    @property
+    def sample_bytes(self):
+
+        '''Memory used by the sample of time steps for the percentiles [bytes]; 0 without percentiles.'''
+
+        return self.sample.nbytes if self.percentiles else 0
+
+    def update(self, block, months=None):
+
+        '''Adds a block of time steps ([time, *shape] array; NaN for missing values). 'months' (calendar month
+        of each time step, 1-12) is needed for 'monthly_mean'.'''
+
+        block = np.asarray(block, dtype=np.float64).reshape(len(block), -1)
+        valid = ~np.isnan(block)
+        filled = np.where(valid, block, 0)
+        count = valid.sum(axis=0)
+
+        # Sum, minimum and maximum
+        block_sum = filled.sum(axis=0)
+        self.sum += block_sum
+        self.min = np.fmin(self.min, np.fmin.reduce(block, axis=0))
+        self.max = np.fmax(self.max, np.fmax.reduce(block, axis=0))
+
+        # Mean and sum of squared deviations, combined with the previous blocks (Chan et al., 1979)
+        if 'std' in self.statistics:
+            with np.errstate(invalid='ignore', divide='ignore'):
+                block_mean = np.where(count > 0, block_sum / count, 0)
+                block_m2 = (np.where(valid, block - block_mean, 0)**2).sum(axis=0)
+                total = self.count + count
+                delta = block_mean - self.mean
+                self.mean = np.where(total > 0, self.mean + delta * count / total, 0)
+                self.m2 = np.where(total > 0, self.m2 + block_m2 + delta**2 * self.count * count / total, 0)
+        self.count += count
+
+        # Monthly sums
+        if 'monthly_mean' in self.statistics:
+            if months is None:
+                raise ValueError('monthly_mean needs the month of each time step')
+            months = np.asarray(months)
+            for month in np.unique(months):
+                rows = months == month
+                self.month_sum[month-1] += filled[rows].sum(axis=0)
+                self.month_count[month-1] += valid[rows].sum(axis=0)
+
+        # Keep the sampled time steps for the percentiles
+        if self.percentiles:
+            first, last = np.searchsorted(self.sample_steps, [self.time, self.time + len(block)])
+            self.sample[first:last] = block[self.sample_steps[first:last] - self.time]
+        self.time += len(block)
+
+    def results(self):
+
+        '''Returns {statistic: array}; arrays have 'shape', or (12, *shape) for 'monthly_mean'. Statistics of
+        elements without any values are NaN (0 for 'count' and 'sum').'''
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            values = {'mean':  np.where(self.count > 0, self.sum / self.count, np.nan),
+                      'min':   self.min,
+                      'max':   self.max,
+                      'sum':   self.sum,
+                      'count': self.count,
+                      'std':   np.where(self.count > 0, np.sqrt(self.m2 / self.count), np.nan),
+                      'monthly_mean': np.where(self.month_count > 0, self.month_sum / self.month_count, np.nan)}
+            if self.percentiles:
+                with warnings.catch_warnings():
+                    warnings.simplefilter('ignore', RuntimeWarning) # elements without values
+                    percentiles = np.nanquantile(self.sample, list(self.percentiles.values()), axis=0)
+        results = {}
+        for statistic in self.statistics:
+            if statistic in self.percentiles:
+                i = list(self.percentiles).index(statistic)
+                results[statistic] = percentiles[i].reshape(self.shape)
+            elif statistic == 'monthly_mean':
+                results[statistic] = values[statistic].reshape((12,) + self.shape)
+            else:
+                results[statistic] = values[statistic].reshape(self.shape)
+        return results
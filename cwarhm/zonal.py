@@ -0,0 +1,207 @@
+'''
+Zonal statistics of rasters over HRU polygons, through polygon-to-raster coverage weights.
+
+exactextract finds which fraction of each raster cell is covered by each HRU polygon. These coverage fractions
+only depend on the polygons and the raster grid, not on the raster values. They are therefore computed once
+per grid and stored as a sparse (HRU x raster cell) matrix. Zonal statistics of any raster on that grid are
+then sparse matrix products:
+- mean: sum(coverage * value) / sum(coverage), over cells with data (as exactextract's 'mean');
+- class fractions: for each class, sum(coverage of cells with that class) / sum(coverage), over cells with
+  data (as exactextract's 'unique' and 'frac').
+
+Coverage weights can be saved to disk and are then reused for as long as the polygons and the raster grid do
+not change (cached_coverage_weights()). Repeat zonal statistics, e.g. with a new soil or land class raster on
+the same grid, then only need to read the raster.
+
+Usage:
+    from cwarhm.zonal import CoverageWeights, cached_coverage_weights
+    weights = CoverageWeights.from_polygons(gdf, dem_file)
+    weights = cached_coverage_weights(gdf, dem_file, cache_path) # same, but saved in/loaded from cache_path
+    gdf['elev_mean'] = weights.mean(weights.values(dem_file))
+    classes, fractions = weights.class_fractions(weights.values(soil_file))
+    soil_table = class_fraction_table(classes, fractions, 'USGS', index=gdf.index)
+'''
+
+import os
+import hashlib
+import numpy as np
+import pandas as pd
+import rasterio
+import multiprocessing as mp
+from scipy import sparse
+from exactextract import exact_extract
+
+# Size of the raster data read in one go [pixels]
+READ_PIXELS = 2**24
+
+
+def raster_grid(raster_file):
+
+    '''Returns (width, height, geotransform, CRS as WKT) of a raster; rasters with equal grids share coverage weights.'''
+
+    with rasterio.open(raster_file) as src:
+        return (src.width, src.height, tuple(src.transform.to_gdal()), src.crs.to_wkt() if src.crs else '')
+
+
+def geometry_hash(gdf):
+
+    '''Returns a hash (hexadecimal string) of the geometries of a GeoDataFrame, in order, and their CRS.'''
+
+    sha = hashlib.sha256()
+    sha.update((gdf.crs.to_wkt() if gdf.crs else '').encode())
+    for geometry in gdf.geometry:
+        sha.update(geometry.wkb if geometry is not None else b'')
+    return sha.hexdigest()
+
+
+def class_fraction_table(classes, fractions, prefix, index=None, decimals=4):
+
+    '''Returns a DataFrame of class fractions with one column per class ('[prefix]_[class]', e.g. 'USGS_3'),
+    rounded to 'decimals', as used in the intersection shapefiles of the topo scripts.'''
+
+    table = pd.DataFrame(fractions, columns=[f'{prefix}_{int(c)}' for c in classes], index=index)
+    return table.astype(float).round(decimals)
+
+
+def _polygon_coverage(args):
+
+    '''Returns the cell IDs and coverage fractions of each polygon in a GeoDataFrame. Cells without data are
+    included ('default_value'), so that the coverage does not depend on the raster values.'''
+
+    gdf, raster_file = args
+    coverage = exact_extract(str(raster_file), gdf, ['cell_id(default_value=0)', 'coverage(default_value=0)'], output='pandas')
+    return list(coverage.iloc[:,0]), list(coverage.iloc[:,1])
+
+
+class CoverageWeights:
+
+    '''Sparse (HRU x raster cell) matrix of the fraction of each raster cell covered by each HRU polygon.
+    Rows are in the order of the polygons; columns are the cells in 'cells' (row * raster width + column).'''
+
+    def __init__(self, matrix, cells, grid):
+
+        self.matrix = matrix.tocsr()
+        self.cells = cells
+        self.grid = grid
+
+    @classmethod
+    def from_polygons(cls, gdf, raster_file, ncpus=1):
+
+        '''Computes the coverage weights of the polygons in 'gdf' on the grid of 'raster_file'. The polygons
+        are split into 'ncpus' groups that are processed in parallel.'''
+
+        n_groups = max(1, min(ncpus, len(gdf)))
+        bounds = [len(gdf) * i // n_groups for i in range(n_groups + 1)]
+        groups = [(gdf.iloc[start:end], raster_file) for start, end in zip(bounds[:-1], bounds[1:]) if end > start]
+        if len(groups) > 1:
+            with mp.Pool(processes=len(groups)) as pool:
+                results = pool.map(_polygon_coverage, groups)
+        else:
+            results = [_polygon_coverage(group) for group in groups]
+        cell_ids = [ids for result in results for ids in result[0]]
+        coverage = [fracs for result in results for fracs in result[1]]
+
+        # Flat (hru, cell, coverage) arrays and the matrix
+        hru = np.repeat(np.arange(len(cell_ids)), [len(ids) for ids in cell_ids])
+        cell_ids = np.concatenate(cell_ids).astype(np.int64) if cell_ids else np.zeros(0, dtype=np.int64)
+        coverage = np.concatenate(coverage).astype(np.float64) if coverage else np.zeros(0)
+        cells, column = np.unique(cell_ids, return_inverse=True)
+        matrix = sparse.csr_matrix((coverage, (hru, column)), shape=(len(gdf), len(cells)))
+        return cls(matrix, cells, raster_grid(raster_file))
+
+    def values(self, raster_file, band=1):
+
+        '''Reads the values of the cells covered by the polygons from a raster on the same grid. Cells without
+        data (the raster's nodata value or NaN) are returned as NaN. The raster is read in blocks of rows,
+        limited to the columns that contain covered cells.'''
+
+        if raster_grid(raster_file) != self.grid:
+            raise ValueError('Raster {} is not on the grid these coverage weights were made for'.format(raster_file))
+
+        width = self.grid[0]
+        rows, cols = np.divmod(self.cells, width)
+        values = np.full(len(self.cells), np.nan)
+        if len(self.cells) == 0:
+            return values
+        col_start, col_end = cols.min(), cols.max() + 1
+        rows_per_read = max(1, READ_PIXELS // (col_end - col_start))
+
+        with rasterio.open(raster_file) as src:
+            nodata = src.nodata
+            for row_start in range(rows.min(), rows.max() + 1, rows_per_read):
+                row_end = row_start + rows_per_read
+                in_block = (rows >= row_start) & (rows < row_end)
+                if not in_block.any():
+                    continue
+                window = rasterio.windows.Window(col_start, row_start, col_end - col_start, min(row_end, src.height) - row_start)
+                data = src.read(band, window=window)
+                values[in_block] = data[rows[in_block] - row_start, cols[in_block] - col_start]
+
+        if nodata is not None:
+            values[values == nodata] = np.nan
+        return values
+
+    def mean(self, values):
+
+        '''Coverage-weighted mean of 'values' (from values()) for each HRU; NaN for HRUs without data.'''
+
+        valid = ~np.isnan(values)
+        total = self.matrix @ np.where(valid, values, 0)
+        weight = self.matrix @ valid.astype(np.float64)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(weight > 0, total / weight, np.nan)
+
+    def class_fractions(self, values):
+
+        '''Fraction of the covered area of each HRU that has each class in 'values' (from values()). Returns
+        the classes (sorted) and a dense (HRU x class) matrix of fractions; HRUs without data have all zeros.'''
+
+        valid = ~np.isnan(values)
+        classes, class_index = np.unique(values[valid], return_inverse=True)
+        one_hot = sparse.csr_matrix((np.ones(valid.sum()), (np.flatnonzero(valid), class_index)),
+                                    shape=(len(values), len(classes)))
+        area = (self.matrix @ one_hot).toarray()
+        total = area.sum(axis=1, keepdims=True)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            fractions = np.where(total > 0, area / total, 0)
+        return classes, fractions
+
+    def save(self, file):
+
+        '''Saves the coverage weights to a .npz file. The file is written under a temporary name first, so that
+        an interrupted write never leaves an incomplete file.'''
+
+        part = str(file) + '.part'
+        with open(part, 'wb') as f:
+            np.savez(f, data=self.matrix.data, indices=self.matrix.indices, indptr=self.matrix.indptr,
+                     shape=np.array(self.matrix.shape), cells=self.cells,
+                     grid_size=np.array(self.grid[:2]), geotransform=np.array(self.grid[2]), crs=np.array(self.grid[3]))
+        os.replace(part, file)
+
+    @classmethod
+    def load(cls, file):
+
+        '''Loads coverage weights saved with save().'''
+
+        with np.load(file) as f:
+            matrix = sparse.csr_matrix((f['data'], f['indices'], f['indptr']), shape=tuple(f['shape']))
+            grid = (int(f['grid_size'][0]), int(f['grid_size'][1]), tuple(float(x) for x in f['geotransform']), str(f['crs']))
+            return cls(matrix, f['cells'], grid)
+
+
+def cached_coverage_weights(gdf, raster_file, cache_path, ncpus=1):
+
+    '''Returns the coverage weights of the polygons in 'gdf' on the grid of 'raster_file'. Weights are loaded
+    from 'cache_path' if they were found before for the same polygons and grid; otherwise they are found with
+    CoverageWeights.from_polygons() and saved in 'cache_path'. The cache file name is a hash of the polygons
+    and the grid (size, geotransform and CRS), so that any change to either gives a new file.'''
+
+    grid = raster_grid(raster_file)
+    key = hashlib.sha256((geometry_hash(gdf) + repr(grid)).encode()).hexdigest()
+    cache_file = os.path.join(str(cache_path), 'coverage_weights_{}.npz'.format(key[:32]))
+    if os.path.isfile(cache_file):
+        return CoverageWeights.load(cache_file)
+    weights = CoverageWeights.from_polygons(gdf, raster_file, ncpus=ncpus)
+    os.makedirs(str(cache_path), exist_ok=True)
+    weights.save(cache_file)
+    return weights
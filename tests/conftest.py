@@ -0,0 +1,6 @@
+# Make the shared workflow code (cwarhm) and the example data importable from the tests
+import sys
+from pathlib import Path
+
+REPO = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO))
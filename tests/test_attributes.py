@@ -0,0 +1,74 @@
+'''Tests of cwarhm/attributes.py'''
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import REPO
+from cwarhm.attributes import down_hru_index
+
+
+def old_down_hru_index(shp, hru_id_var, gru_id_var):
+
+    '''The per-GRU loop that 5_model_input/SUMMA/1f_attributes/2c_insert_elevation_into_attributes.py used
+    before down_hru_index(), with Series.iteritems() replaced by Series.items() and the prints removed.'''
+
+    shp = shp.copy()
+    gru_ids = shp[gru_id_var].unique()
+    shp.set_index(hru_id_var, inplace=True)
+    for gru_id in gru_ids:
+        gru_mask = (shp[gru_id_var] == gru_id)
+        tmp_sort = shp[gru_mask]['elev_mean'].argsort()
+        HRUs_seen = 0
+        last_HRU = 0
+        for HRU,order in tmp_sort.items():
+            if order == 0:
+                if last_HRU != 0:
+                    shp.at[last_HRU, 'downHRUindex'] = int(HRU)
+                shp.at[HRU,      'downHRUindex'] = 0
+            elif HRUs_seen > 0:
+                shp.at[last_HRU, 'downHRUindex'] = int(HRU)
+            HRUs_seen += 1
+            last_HRU = HRU
+    shp.reset_index(inplace=True)
+    return shp['downHRUindex'].astype(int).values
+
+
+@pytest.fixture
+def bow_zones():
+
+    '''GRU and HRU IDs of the Bow at Banff elevation zones in 0_example, in shapefile order.'''
+
+    gpd = pytest.importorskip('geopandas')
+    shp = gpd.read_file(REPO / '0_example/shapefiles/catchment/bow_distributed_elevation_zone.shp')
+    return pd.DataFrame(shp[['GRU_ID','HRU_ID']])
+
+
+def test_old_chaining_when_zones_are_listed_high_to_low(bow_zones):
+
+    # Elevations decrease in shapefile order within each GRU, so the old loop's shapefile-order chaining is
+    # also the elevation order
+    shp = bow_zones.copy()
+    shp['elev_mean'] = 3000.0 - 100.0 * shp.groupby('GRU_ID').cumcount()
+    expected = old_down_hru_index(shp, 'HRU_ID', 'GRU_ID')
+    assert (expected == 0).sum() == shp['GRU_ID'].nunique() # one outlet per GRU
+    np.testing.assert_array_equal(down_hru_index(shp, 'HRU_ID', 'GRU_ID'), expected)
+
+
+def test_chaining_follows_elevation_when_zones_are_not_sorted(bow_zones):
+
+    shp = bow_zones.copy()
+    shp['elev_mean'] = np.random.default_rng(0).permutation(len(shp)) * 10.0 + 1000.0
+    down = pd.Series(down_hru_index(shp, 'HRU_ID', 'GRU_ID'), index=shp['HRU_ID'].values)
+
+    # Within each GRU, each HRU drains to the HRU with the next-lower elevation and the lowest HRU is the outlet
+    for _, gru in shp.groupby('GRU_ID'):
+        hrus = gru.sort_values('elev_mean')['HRU_ID'].values
+        np.testing.assert_array_equal(down[hrus].values, np.concatenate(([0], hrus[:-1])))
+
+
+def test_chaining_of_zones_listed_low_to_high():
+
+    # HRU 3 is the highest and drains to 2, which drains to the outlet 1; GRU 8 has a single HRU
+    shp = pd.DataFrame({'GRU_ID': [7, 7, 7, 8], 'HRU_ID': [1, 2, 3, 4], 'elev_mean': [1000., 1500., 2000., 500.]})
+    np.testing.assert_array_equal(down_hru_index(shp, 'HRU_ID', 'GRU_ID'), [0, 1, 2, 0])
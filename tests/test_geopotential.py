@@ -0,0 +1,55 @@
+'''Tests of cwarhm/geopotential.py'''
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+import pytest
+
+from cwarhm.geopotential import cell_elevation, G
+
+
+@pytest.fixture
+def geo():
+
+    '''Synthetic ERA5 geopotential on a 0.25 degree grid, with latitudes in descending order as in ERA5 files.'''
+
+    lat = np.arange(52.0, 50.0, -0.25, dtype=np.float32)
+    lon = np.arange(-117.0, -114.5, 0.25, dtype=np.float32)
+    z = np.random.default_rng(0).uniform(5000, 30000, (1, len(lat), len(lon))).astype(np.float32)
+    ds = xr.Dataset({'z': (('time','latitude','longitude'), z)},
+                    coords={'time': pd.to_datetime(['1979-01-01']), 'latitude': lat, 'longitude': lon})
+    return ds.isel(time=0)
+
+
+def grid_cells(geo):
+
+    '''Cell centers in the order of create_ERA5_shapefile.py (longitude first, latitude second), rounded to the
+    4 decimals of the shapefile's lat/lon fields.'''
+
+    center_lon, center_lat = np.meshgrid(geo['longitude'].values.astype('float64'), geo['latitude'].values.astype('float64'), indexing='ij')
+    return pd.DataFrame({'lat': np.round(center_lat.ravel(), 4), 'lon': np.round(center_lon.ravel(), 4)})
+
+
+def test_same_elevation_as_per_row_lookup(geo):
+
+    # The lookup that create_ERA5_shapefile.py used before cell_elevation(): one sel() per shapefile row
+    shp = grid_cells(geo).assign(elev_m = -999.0)
+    for index, row in shp.iterrows():
+        elev = geo['z'].sel(latitude = row['lat'], longitude=row['lon']).values.flatten() / G
+        shp.at[index,'elev_m'] = elev[0]
+
+    np.testing.assert_array_equal(cell_elevation(geo['z'], shp['lat'].values, shp['lon'].values), shp['elev_m'].values)
+
+
+def test_extra_dimensions_use_the_first_value(geo):
+
+    cells = grid_cells(geo)
+    z = xr.concat([geo['z'], geo['z'] * 2], dim='level')
+    np.testing.assert_array_equal(cell_elevation(z, cells['lat'].values, cells['lon'].values),
+                                  cell_elevation(geo['z'], cells['lat'].values, cells['lon'].values))
+
+
+def test_coordinates_must_match_exactly(geo):
+
+    with pytest.raises(KeyError):
+        cell_elevation(geo['z'], np.array([51.1]), np.array([-116.0]))
@@ -0,0 +1,38 @@
+'''Tests of cwarhm/netcdf_profile.py'''
+
+import numpy as np
+import netCDF4 as nc4
+
+from cwarhm.netcdf_profile import copy_with_profile, variable_settings
+
+
+def test_copy_with_profile_keeps_values_and_compresses(tmp_path):
+
+    # Uncompressed file as written by EASYMORE: forcing (time, hru), hruId (hru) and an unlimited time dimension
+    source = tmp_path / 'easymore.nc'
+    values = np.random.default_rng(0).uniform(250, 300, (50, 7)).astype('f4')
+    values[3, 2] = -9999
+    with nc4.Dataset(source, 'w') as src:
+        src.setncattr('author', 'test')
+        src.createDimension('time', None)
+        src.createDimension('hru', 7)
+        src.createVariable('time', 'f8', ('time',))[:] = np.arange(50)
+        src.createVariable('hruId', 'i8', ('hru',))[:] = np.arange(100, 107)
+        airtemp = src.createVariable('airtemp', 'f4', ('time','hru'), fill_value=-9999)
+        airtemp.setncattr('units', 'K')
+        airtemp[:] = values
+
+    dest = tmp_path / 'profiled.nc'
+    copy_with_profile(source, dest, slab_bytes=4*7*8) # 8 time steps per slab
+    with nc4.Dataset(dest) as des:
+        des.set_auto_maskandscale(False)
+        assert des.getncattr('author') == 'test'
+        assert des.dimensions['time'].isunlimited()
+        np.testing.assert_array_equal(des['airtemp'][:], values)
+        np.testing.assert_array_equal(des['hruId'][:], np.arange(100, 107))
+        assert des['airtemp'].getncattr('_FillValue') == -9999
+        assert des['airtemp'].getncattr('units') == 'K'
+        filters = des['airtemp'].filters()
+        assert filters['zlib'] and filters['shuffle']
+        assert des['airtemp'].chunking() == list(variable_settings((50, 7))['chunksizes'])
+        assert des['hruId'].chunking() == 'contiguous'
@@ -0,0 +1,88 @@
+'''Tests of cwarhm/runner.py'''
+
+import pytest
+
+from conftest import REPO
+from cwarhm.control import load_control, clear_cache
+from cwarhm.runner import (STEPS, find_step, use_alternatives, select_steps, compute_hashes, is_up_to_date,
+                           write_stamp, run)
+
+
+def scripts(steps):
+    return [step.script for step in steps]
+
+
+def test_alternatives_are_left_out_by_default():
+    workflow = use_alternatives(STEPS)
+    assert not any(step.replaces for step in workflow)
+    assert len(workflow) == len(STEPS) - 2
+
+
+def test_alternative_replaces_steps_and_their_downstream_requirements():
+    topo = find_step(STEPS, '1_2_3_find_HRU_elevation_soil_and_land_classes.py')
+    workflow = use_alternatives(STEPS, [topo.name])
+    for name in topo.replaces:
+        with pytest.raises(KeyError):
+            find_step(workflow, name)
+
+    # Downstream steps now require the alternative, once
+    attributes = find_step(workflow, '2c_insert_elevation_into_attributes.py')
+    assert attributes.requires == ('2b_insert_landclass_from_hist_into_attributes.py', topo.script)
+    needed = scripts(select_steps(workflow, ['1_make_one_weighted_forcing_file.py']))
+    assert topo.script in needed
+
+
+def test_every_step_requires_an_earlier_step():
+    use = [step.name for step in STEPS if step.replaces]
+    for workflow in (use_alternatives(STEPS), use_alternatives(STEPS, use)):
+        for ix, step in enumerate(workflow):
+            for name in step.requires:
+                assert find_step(workflow, name).script in scripts(workflow[:ix])
+
+
+def test_only_alternatives_can_be_used():
+    with pytest.raises(KeyError):
+        use_alternatives(STEPS, ['1_find_HRU_elevation.py'])
+
+
+@pytest.fixture
+def control_file(tmp_path):
+
+    '''Copy of the Bow at Banff control file with its data folder in a temporary folder.'''
+
+    lines = []
+    for line in (REPO / '0_control_files' / 'control_Bow_at_Banff.txt').read_text().splitlines(keepends=True):
+        if line.startswith('root_path'):
+            line = 'root_path | {} # temporary\n'.format(tmp_path)
+        lines.append(line)
+    file = tmp_path / 'control_test.txt'
+    file.write_text(''.join(lines))
+    return file
+
+
+def test_changed_setting_only_reruns_the_steps_that_use_it(control_file):
+
+    # Mark all steps as completed: stamp each step with its current hash and create its outputs
+    control = load_control(control_file)
+    workflow = use_alternatives(STEPS)
+    hashes = compute_hashes(workflow, control)
+    for step in workflow:
+        for name in step.outputs:
+            control.path(name).mkdir(parents=True, exist_ok=True)
+        write_stamp(step, hashes[step.script], control, 0)
+        assert is_up_to_date(step, hashes[step.script], control)
+    assert run(control_file=control_file, dry_run=True) == set()
+
+    # Change one trial parameter: only the trial parameter step and the model runs that depend on it are run
+    control_file.write_text(control_file.read_text().replace('maxstep,900', 'maxstep,600'))
+    clear_cache()
+    assert run(control_file=control_file, dry_run=True) == {'5_model_input/SUMMA/1e_trial_parameters/1_create_trialParams.py',
+                                                            '6_model_runs/1_run_summa.sh',
+                                                            '6_model_runs/2_run_mizuRoute.sh'}
+
+    # A missing output makes its step out of date as well
+    control = load_control(control_file)
+    control.path('settings_mizu_path').rmdir()
+    done = run(['1_create_control_file.py'], control_file=control_file, dry_run=True)
+    assert done == {'5_model_input/mizuRoute/1a_copy_base_settings/1_copy_base_settings.py',
+                    '5_model_input/mizuRoute/1d_control_file/1_create_control_file.py'}
@@ -0,0 +1,73 @@
+'''Tests of cwarhm/statistics.py'''
+
+import warnings
+import numpy as np
+import pytest
+
+from cwarhm.statistics import StreamingStatistics
+
+
+@pytest.fixture
+def series():
+
+    '''Daily values of 2 x 3 elements over 4 years, with missing values: scattered ones, a full chunk of one
+    element and one element without any values. Returns the values and the month of each time step.'''
+
+    rng = np.random.default_rng(1)
+    n_time = 1461
+    months = np.array([(np.datetime64('2001-01-01') + np.timedelta64(t, 'D')).astype(object).month for t in range(n_time)])
+    values = rng.gamma(2, 3, (n_time, 2, 3)) + 10 * np.sin(2 * np.pi * months / 12)[:, None, None]
+    values[rng.random(values.shape) < 0.05] = np.nan
+    values[300:400, 0, 1] = np.nan # covers all of the chunk that starts at time step 300
+    values[:, 1, 2] = np.nan
+    return values, months
+
+
+def stream(values, months, statistics, **kwargs):
+    stats = StreamingStatistics(statistics, values.shape[1:], n_time=len(values), **kwargs)
+    for start in range(0, len(values), 100): # chunks of 100 time steps
+        stats.update(values[start:start+100], months[start:start+100])
+    return stats.results()
+
+
+def test_matches_numpy(series):
+    values, months = series
+    results = stream(values, months, ['mean', 'std', 'min', 'max', 'sum', 'count', 'monthly_mean', 'q50', 'q90'])
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning) # element without values
+        np.testing.assert_allclose(results['mean'], np.nanmean(values, axis=0), rtol=1e-12)
+        np.testing.assert_allclose(results['std'], np.nanstd(values, axis=0), rtol=1e-10)
+        np.testing.assert_array_equal(results['min'], np.nanmin(values, axis=0))
+        np.testing.assert_array_equal(results['max'], np.nanmax(values, axis=0))
+        np.testing.assert_allclose(results['sum'], np.nansum(values, axis=0), rtol=1e-12)
+        np.testing.assert_array_equal(results['count'], (~np.isnan(values)).sum(axis=0))
+        monthly = np.stack([np.nanmean(values[months == m], axis=0) for m in range(1, 13)])
+        np.testing.assert_allclose(results['monthly_mean'], monthly, rtol=1e-12)
+
+        # Fewer time steps than 'sample_size': percentiles of all values, stored as float32
+        for q in [50, 90]:
+            np.testing.assert_allclose(results['q{}'.format(q)], np.nanquantile(values, q / 100, axis=0), rtol=1e-6)
+    assert results['monthly_mean'].shape == (12, 2, 3)
+    assert results['count'][1, 2] == 0 and np.isnan(results['mean'][1, 2]) and np.isnan(results['q90'][1, 2])
+
+
+def test_sampled_percentiles(series):
+    values, months = series
+    results = stream(values, months, ['q10', 'q90'], sample_size=500)
+    for q in [10, 90]:
+        # The estimate lies close to the true percentile: within a few percentiles of the full series
+        found = results['q{}'.format(q)]
+        for ix in [(0, 0), (0, 1), (1, 1)]:
+            valid = values[(slice(None),) + ix]
+            valid = valid[~np.isnan(valid)]
+            rank = (valid < found[ix]).mean() * 100
+            assert abs(rank - q) < 5
+
+
+def test_sample_size_and_bytes():
+    stats = StreamingStatistics(['q50'], (4,), n_time=10000, sample_size=1000)
+    assert stats.sample.dtype == np.float32
+    assert stats.sample_bytes == 1000 * 4 * 4
+    assert StreamingStatistics(['mean'], (4,)).sample_bytes == 0
+    with pytest.raises(ValueError):
+        StreamingStatistics(['q50'], (4,))
@@ -0,0 +1,93 @@
+'''Tests of the coverage weights in cwarhm/zonal.py'''
+
+import numpy as np
+import geopandas as gpd
+import rasterio
+import pytest
+from affine import Affine
+from shapely.geometry import Polygon
+from exactextract import exact_extract
+
+from cwarhm.zonal import CoverageWeights, cached_coverage_weights
+
+
+def write_raster(file, values, transform=Affine(0.1, 0, -116.0, 0, -0.1, 51.5), crs='EPSG:4326', nodata=-1):
+    with rasterio.open(file, 'w', driver='GTiff', width=values.shape[1], height=values.shape[0], count=1,
+                       dtype=values.dtype, transform=transform, crs=crs, nodata=nodata) as dest:
+        dest.write(values, 1)
+    return file
+
+
+@pytest.fixture
+def classes():
+
+    '''10 x 10 raster of classes 1-4, with a few cells without data.'''
+
+    values = np.random.default_rng(0).integers(1, 5, (10, 10)).astype('int16')
+    values[2, 3:6] = -1
+    return values
+
+
+@pytest.fixture
+def gdf():
+
+    '''Two HRUs that cover parts of raster cells, and each other's neighbouring cells.'''
+
+    return gpd.GeoDataFrame({'HRU_ID': [1, 2]},
+                            geometry=[Polygon([(-115.93, 51.47), (-115.52, 51.45), (-115.55, 51.08), (-115.91, 51.12)]),
+                                      Polygon([(-115.52, 51.45), (-115.13, 51.38), (-115.21, 50.63), (-115.55, 51.08)])],
+                            crs='EPSG:4326')
+
+
+def test_statistics_match_exactextract(tmp_path, gdf, classes):
+    raster = write_raster(tmp_path / 'classes.tif', classes)
+    weights = CoverageWeights.from_polygons(gdf, raster)
+    values = weights.values(raster)
+
+    expected = exact_extract(str(raster), gdf, ['mean', 'unique', 'frac'], output='pandas')
+    np.testing.assert_allclose(weights.mean(values), expected['mean'], rtol=1e-6)
+
+    found, fractions = weights.class_fractions(values)
+    for hru in range(len(gdf)):
+        frac = dict(zip(expected['unique'][hru], expected['frac'][hru]))
+        np.testing.assert_allclose(fractions[hru], [frac.get(c, 0) for c in found], rtol=1e-6, atol=1e-12)
+
+
+def test_save_and_load(tmp_path, gdf, classes):
+    raster = write_raster(tmp_path / 'classes.tif', classes)
+    weights = CoverageWeights.from_polygons(gdf, raster)
+    weights.save(tmp_path / 'weights.npz')
+    loaded = CoverageWeights.load(tmp_path / 'weights.npz')
+
+    assert loaded.grid == weights.grid
+    np.testing.assert_array_equal(loaded.cells, weights.cells)
+    assert (loaded.matrix != weights.matrix).nnz == 0
+    np.testing.assert_array_equal(loaded.mean(loaded.values(raster)), weights.mean(weights.values(raster)))
+
+
+@pytest.mark.filterwarnings('ignore:Spatial reference system') # the raster in EPSG:4269
+def test_cache_key(tmp_path, gdf, classes):
+    cache = tmp_path / 'cache'
+    raster = write_raster(tmp_path / 'classes.tif', classes)
+    def cache_files():
+        return sorted(p.name for p in cache.iterdir())
+
+    # Found once, then loaded; also for a different raster on the same grid
+    first = cached_coverage_weights(gdf, raster, cache)
+    assert len(cache_files()) == 1
+    same_grid = write_raster(tmp_path / 'other_values.tif', (classes * 2).astype('int16'))
+    again = cached_coverage_weights(gdf, same_grid, cache)
+    assert len(cache_files()) == 1
+    assert (again.matrix != first.matrix).nnz == 0
+
+    # Changed geometry, geotransform or CRS: new weights
+    moved = gdf.copy()
+    moved.geometry = gdf.geometry.translate(xoff=0.05)
+    cached_coverage_weights(moved, raster, cache)
+    assert len(cache_files()) == 2
+    shifted = write_raster(tmp_path / 'shifted.tif', classes, transform=Affine(0.1, 0, -116.05, 0, -0.1, 51.5))
+    cached_coverage_weights(gdf, shifted, cache)
+    assert len(cache_files()) == 3
+    other_crs = write_raster(tmp_path / 'other_crs.tif', classes, crs='EPSG:4269')
+    cached_coverage_weights(gdf, other_crs, cache)
+    assert len(cache_files()) == 4